@@ -0,0 +1,95 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import random
+from argparse import ArgumentParser
+from xml.sax.saxutils import escape
+
+NS_MARCSLIM = 'http://www.loc.gov/MARC21/slim'
+
+# date values of the generated records, the mix decides how often dates need complex parsing
+DATE_VALUES = {
+  'simple': ['1850', '1900-01-02', '12/03/1901', '(1877)', '[1912]', '19450508'],
+  'complex': ['ca. 1850', '1850 or 1851', '185X', 'XIXe siècle', 'janvier 1900', 'before 1900', '1850/1851'],
+  'invalid': ['----', 'unknown', '19th c.']
+}
+
+DATE_MIXES = {
+  'simple': {'simple': 1.0},
+  'mixed': {'simple': 0.7, 'complex': 0.2, 'invalid': 0.1},
+  'complex': {'simple': 0.2, 'complex': 0.7, 'invalid': 0.1}
+}
+
+FIRST_NAMES = ['Jan', 'Marie', 'Pieter', 'Anne', 'Louis', 'Sofie', 'Hendrik', 'Émile', 'Zoë', 'Jean']
+LAST_NAMES = ['Peeters', 'Janssens', 'Maes', 'Jacobs', 'Mertens', 'Willems', 'Claes', 'Goossens', 'Dubois', 'Lambert']
+PLACES = [('Gent', 'BE'), ('Brussel', 'BE'), ('Antwerpen', 'BE'), ('Liège', 'BE'), ('Paris', 'FR'), ('Amsterdam', 'NL')]
+
+# -----------------------------------------------------------------------------
+def _datafield(tag, subfields):
+  content = ''.join(f'<marc:subfield code="{code}">{escape(value)}</marc:subfield>' for code, value in subfields)
+  return f'<marc:datafield tag="{tag}" ind1=" " ind2=" ">{content}</marc:datafield>'
+
+# -----------------------------------------------------------------------------
+def _date(rng, dateMix):
+  kinds = list(DATE_MIXES[dateMix].keys())
+  kind = rng.choices(kinds, weights=[DATE_MIXES[dateMix][k] for k in kinds])[0]
+  return rng.choice(DATE_VALUES[kind])
+
+# -----------------------------------------------------------------------------
+def generateRecord(rng, identifier, maxAlternateNames=3, dateMix='mixed', personRatio=0.9):
+  """Returns a MARC slim authority record as string.
+     Every record declares the MARC namespace itself, such that it can also be parsed on its own with --incremental.
+  """
+  name = f'{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}'
+  fields = [
+    f'<marc:controlfield tag="001">{identifier}</marc:controlfield>',
+    _datafield('075', [('a', 'p' if rng.random() < personRatio else 'o')]),
+    _datafield('046', [('f', _date(rng, dateMix)), ('g', _date(rng, dateMix))]),
+    _datafield('100', [('a', name)])
+  ]
+  if rng.random() < 0.5:
+    fields.append(_datafield('024', [('a', f'{rng.randrange(10**15):016d}'), ('2', 'isni')]))
+  if rng.random() < 0.7:
+    town, country = rng.choice(PLACES)
+    fields.append(_datafield('370', [('a', town), ('c', country)]))
+  for i in range(rng.randint(0, maxAlternateNames)):
+    fields.append(_datafield('400', [('a', f'{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}')]))
+
+  return f'<marc:record xmlns:marc="{NS_MARCSLIM}">' + ''.join(fields) + '</marc:record>'
+
+# -----------------------------------------------------------------------------
+def generateMARCFile(filename, numberRecords, seed=42, maxAlternateNames=3, dateMix='mixed', personRatio=0.9):
+  """Writes a synthetic MARC slim file, the same parameters always result in the same file.
+
+  >>> import tempfile, os
+  >>> filename = os.path.join(tempfile.mkdtemp(), 'records.xml')
+  >>> generateMARCFile(filename, 2) == os.path.getsize(filename)
+  True
+  """
+  rng = random.Random(seed)
+  with open(filename, 'w', encoding='utf-8') as outFile:
+    outFile.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<marc:collection xmlns:marc="{NS_MARCSLIM}">\n')
+    for identifier in range(1, numberRecords + 1):
+      outFile.write(generateRecord(rng, identifier, maxAlternateNames, dateMix, personRatio) + '\n')
+    outFile.write('</marc:collection>\n')
+    return outFile.tell()
+
+# -----------------------------------------------------------------------------
+def parseArguments():
+
+  parser = ArgumentParser(description='This script generates a synthetic MARC slim file for benchmarks.')
+  parser.add_argument('-o', '--output-file', action='store', required=True, help='The XML file which should be created')
+  parser.add_argument('-n', '--records', action='store', type=int, default=10000, help='The number of records, default is 10000')
+  parser.add_argument('-s', '--seed', action='store', type=int, default=42, help='The seed of the random generator, default is 42')
+  parser.add_argument('--alternate-names', action='store', type=int, default=3, help='The maximum number of alternate names per record, default is 3')
+  parser.add_argument('--date-mix', action='store', choices=sorted(DATE_MIXES.keys()), default='mixed', help='How many dates need complex parsing, default is mixed')
+  parser.add_argument('--person-ratio', action='store', type=float, default=0.9, help='The share of records which pass the filter of the benchmark config, default is 0.9')
+  args = parser.parse_args()
+
+  return args
+
+
+if __name__ == '__main__':
+  args = parseArguments()
+  generateMARCFile(args.output_file, args.records, seed=args.seed, maxAlternateNames=args.alternate_names, dateMix=args.date_mix, personRatio=args.person_ratio)
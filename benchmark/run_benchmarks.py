@@ -0,0 +1,162 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import tempfile
+import itertools
+import lxml.etree as ET
+from argparse import ArgumentParser
+import xml_to_csv.xml_to_csv as xml_to_csv
+import xml_to_csv.utils as utils
+import benchmark.generate_marc as generate_marc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = os.path.join(BENCHMARK_DIR, 'benchmark-config.json')
+DEFAULT_DATE_CONFIG = os.path.join(os.path.dirname(BENCHMARK_DIR), 'date-mapping.json')
+
+# -----------------------------------------------------------------------------
+def getScenarios(chunkSizes, batchSizes):
+  """Returns the benchmark scenarios: the regular path and the incremental path for each chunk and batch size,
+     each of them with and without 1:n output files.
+
+  >>> [s['name'] for s in getScenarios([1024], [10])]
+  ['regular', 'regular-1n', 'incremental-chunk1024-batch10', 'incremental-chunk1024-batch10-1n']
+  """
+  scenarios = []
+  for withPrefix in [False, True]:
+    scenarios.append({'name': 'regular' + ('-1n' if withPrefix else ''), 'incremental': False, 'prefix': withPrefix})
+  for chunkSize, batchSize in itertools.product(chunkSizes, batchSizes):
+    for withPrefix in [False, True]:
+      scenarios.append({
+        'name': f'incremental-chunk{chunkSize}-batch{batchSize}' + ('-1n' if withPrefix else ''),
+        'incremental': True,
+        'prefix': withPrefix,
+        'byteChunkSize': chunkSize,
+        'recordBatchSize': batchSize
+      })
+  return scenarios
+
+# -----------------------------------------------------------------------------
+def runScenario(scenario, inputFilename, numberRecords, configFilename, dateConfigFilename, workDir):
+  """Runs xml_to_csv once for the given scenario and returns the measured throughput."""
+
+  with open(configFilename, 'r') as configFile:
+    config = json.load(configFile)
+  if scenario['incremental']:
+    config.setdefault('execution', {}).update({'byteChunkSize': scenario['byteChunkSize'], 'recordBatchSize': scenario['recordBatchSize']})
+
+  scenarioDir = os.path.join(workDir, scenario['name'])
+  os.makedirs(scenarioDir, exist_ok=True)
+  scenarioConfigFilename = os.path.join(scenarioDir, 'config.json')
+  with open(scenarioConfigFilename, 'w') as configFile:
+    json.dump(config, configFile)
+
+  prefix = os.path.join(scenarioDir, 'bench') if scenario['prefix'] else ''
+  startTime = time.perf_counter()
+  xml_to_csv.main([inputFilename], os.path.join(scenarioDir, 'output.csv'), scenarioConfigFilename, dateConfigFilename, prefix,
+                  scenario['incremental'], logFile=os.path.join(scenarioDir, 'log.csv'))
+  seconds = time.perf_counter() - startTime
+
+  # main adds a log handler for every run, remove it such that the next scenario does not write to the old log file
+  logger = logging.getLogger(utils.LOGGER_NAME)
+  for handler in list(logger.handlers):
+    logger.removeHandler(handler)
+    handler.close()
+
+  inputSize = os.path.getsize(inputFilename)
+  result = dict(scenario)
+  result.update({
+    'seconds': round(seconds, 4),
+    'recordsPerSecond': round(numberRecords / seconds, 2),
+    'megabytesPerSecond': round(inputSize / (1024*1024) / seconds, 4)
+  })
+  return result
+
+# -----------------------------------------------------------------------------
+def compareResults(results, baseline, tolerance):
+  """Returns the scenarios whose records per second are more than tolerance (a fraction) below the baseline.
+     Scenarios which are not part of the baseline are not compared.
+
+  >>> baseline = {'results': [{'name': 'regular', 'recordsPerSecond': 1000.0}]}
+  >>> compareResults({'results': [{'name': 'regular', 'recordsPerSecond': 850.0}]}, baseline, 0.1)
+  [{'name': 'regular', 'recordsPerSecond': 850.0, 'baselineRecordsPerSecond': 1000.0, 'change': -0.15}]
+  >>> compareResults({'results': [{'name': 'regular', 'recordsPerSecond': 950.0}]}, baseline, 0.1)
+  []
+  """
+  baselineResults = {r['name']: r for r in baseline['results']}
+  regressions = []
+  for result in results['results']:
+    if result['name'] in baselineResults:
+      expected = baselineResults[result['name']]['recordsPerSecond']
+      change = (result['recordsPerSecond'] - expected) / expected
+      if change < -tolerance:
+        regressions.append({'name': result['name'], 'recordsPerSecond': result['recordsPerSecond'], 'baselineRecordsPerSecond': expected, 'change': round(change, 4)})
+  return regressions
+
+# -----------------------------------------------------------------------------
+def main(outputFilename, numberRecords, seed, dateMix, maxAlternateNames, chunkSizes, batchSizes, repeat=1,
+         configFilename=DEFAULT_CONFIG, dateConfigFilename=DEFAULT_DATE_CONFIG, baselineFilename=None, tolerance=0.1):
+  """Generates a synthetic input file, runs all scenarios and writes the results to a JSON file.
+     Returns the list of regressions compared to the baseline (empty without baseline).
+  """
+  with tempfile.TemporaryDirectory() as workDir:
+    inputFilename = os.path.join(workDir, 'input.xml')
+    inputSize = generate_marc.generateMARCFile(inputFilename, numberRecords, seed=seed, maxAlternateNames=maxAlternateNames, dateMix=dateMix)
+
+    results = []
+    for scenario in getScenarios(chunkSizes, batchSizes):
+      # the best of several repetitions is the least disturbed by other processes
+      runs = [runScenario(scenario, inputFilename, numberRecords, configFilename, dateConfigFilename, os.path.join(workDir, f'run{i}')) for i in range(repeat)]
+      best = max(runs, key=lambda r: r['recordsPerSecond'])
+      results.append(best)
+      print(f'{best["name"]}: {best["recordsPerSecond"]} records/s, {best["megabytesPerSecond"]} MB/s', file=sys.stderr)
+
+  report = {
+    'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'lxml': ET.__version__},
+    'input': {'records': numberRecords, 'bytes': inputSize, 'seed': seed, 'dateMix': dateMix, 'maxAlternateNames': maxAlternateNames},
+    'results': results
+  }
+  with open(outputFilename, 'w') as outFile:
+    json.dump(report, outFile, indent=2)
+
+  regressions = []
+  if baselineFilename:
+    with open(baselineFilename, 'r') as baselineFile:
+      regressions = compareResults(report, json.load(baselineFile), tolerance)
+    for regression in regressions:
+      print(f'regression {regression["name"]}: {regression["recordsPerSecond"]} records/s instead of {regression["baselineRecordsPerSecond"]} ({regression["change"]:+.1%})', file=sys.stderr)
+  return regressions
+
+# -----------------------------------------------------------------------------
+def parseArguments():
+
+  parser = ArgumentParser(description='This script measures the throughput of xml_to_csv on a synthetic MARC slim file.')
+  parser.add_argument('-o', '--output-file', action='store', required=True, help='The JSON file with the benchmark results')
+  parser.add_argument('-n', '--records', action='store', type=int, default=20000, help='The number of generated records, default is 20000')
+  parser.add_argument('-s', '--seed', action='store', type=int, default=42, help='The seed of the record generator, default is 42')
+  parser.add_argument('--date-mix', action='store', choices=sorted(generate_marc.DATE_MIXES.keys()), default='mixed', help='How many dates need complex parsing, default is mixed')
+  parser.add_argument('--alternate-names', action='store', type=int, default=3, help='The maximum number of alternate names per record, default is 3')
+  parser.add_argument('--chunk-sizes', action='store', type=int, nargs='+', default=[65536, 1048576], help='The byteChunkSize values of the incremental scenarios')
+  parser.add_argument('--batch-sizes', action='store', type=int, nargs='+', default=[1000, 40000], help='The recordBatchSize values of the incremental scenarios')
+  parser.add_argument('-r', '--repeat', action='store', type=int, default=1, help='How often each scenario is run, the best run is reported, default is 1')
+  parser.add_argument('-c', '--config-file', action='store', default=DEFAULT_CONFIG, help='The config file used for the extraction')
+  parser.add_argument('-d', '--date-config-file', action='store', default=DEFAULT_DATE_CONFIG, help='The config file for date parsing')
+  parser.add_argument('-b', '--baseline', action='store', help='Optional JSON file with results of an earlier run to compare with')
+  parser.add_argument('-t', '--tolerance', action='store', type=float, default=0.1, help='The allowed slowdown compared to the baseline as fraction, default is 0.1')
+  args = parser.parse_args()
+
+  return args
+
+
+if __name__ == '__main__':
+  args = parseArguments()
+  regressions = main(args.output_file, args.records, args.seed, args.date_mix, args.alternate_names, args.chunk_sizes, args.batch_sizes,
+                     repeat=args.repeat, configFilename=args.config_file, dateConfigFilename=args.date_config_file,
+                     baselineFilename=args.baseline, tolerance=args.tolerance)
+  sys.exit(1 if regressions else 0)
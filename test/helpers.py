@@ -1,8 +1,59 @@
+import os
 import csv
+import json
+import contextlib
+from unittest import mock
+import xml_to_csv.utils as utils
+import xml_to_csv.xml_to_csv as xml_to_csv
 
 def getRecordsAsDict(filename):
   with open(filename, 'r') as fIn:
     reader = csv.DictReader(fIn)
     return list(reader)
 
+def runMain(outputFolder, name, inputFilenames, configFilename='test/resources/incrementalConfig.json', incremental=True, extension='.csv', **kwargs):
+  """Runs xml_to_csv with the main output file output<extension> and the 1:n output files prefix-* in the subfolder name of outputFolder.
+     Further keyword arguments are passed to xml_to_csv.main. Returns the content of all files in this subfolder,
+     key: filename, value: bytes, decompressed if the extension is one of a compressed file.
+  """
+  runFolder = os.path.join(outputFolder, name)
+  os.makedirs(runFolder, exist_ok=True)
+  xml_to_csv.main(inputFilenames, os.path.join(runFolder, f'output{extension}'), configFilename, 'test/resources/date-mapping.json',
+                  'prefix', incremental, **kwargs)
 
+  opener = utils.COMPRESSED_FILE_OPENERS.get(extension, open)
+  output = {}
+  for filename in sorted(os.listdir(runFolder)):
+    if os.path.isfile(os.path.join(runFolder, filename)):
+      with opener(os.path.join(runFolder, filename), 'rb') as outputFile:
+        output[filename] = outputFile.read()
+  return output
+
+def runMainWithProfile(outputFolder, name, inputFilenames, **kwargs):
+  """Same as runMain, but returns also the report of --profile-stats, which is stored as name-profile.json next to the subfolder name."""
+  profileFilename = os.path.join(outputFolder, f'{name}-profile.json')
+  output = runMain(outputFolder, name, inputFilenames, profileStats=profileFilename, **kwargs)
+  with open(profileFilename, 'r') as profileFile:
+    return output, json.load(profileFile)
+
+@contextlib.contextmanager
+def crashingProcessRecord(recordID='8'):
+  """Patches utils.processRecord such that it raises an exception for the record with the given identifier, like a crash of the run."""
+  originalProcessRecord = utils.processRecord
+
+  def processRecord(elem, *args, **kwargs):
+    if elem.findtext('id') == recordID:
+      raise Exception('simulated crash')
+    return originalProcessRecord(elem, *args, **kwargs)
+
+  with mock.patch.object(utils, 'processRecord', side_effect=processRecord):
+    yield
+
+def runCrashingMain(outputFolder, name, inputFilenames, **kwargs):
+  """Runs runMain while processing the record with identifier 8 raises an exception, returns the exit code of the run."""
+  with crashingProcessRecord():
+    try:
+      runMain(outputFolder, name, inputFilenames, **kwargs)
+    except SystemExit as e:
+      return e.code
+  return 0
@@ -1,14 +1,32 @@
 import unittest
 import doctest
 import json
+import io
 import csv
 import time
 import re
 import tempfile
+import os
+import gzip
+import bz2
+import sqlite3
+import lzma
+import random
+import threading
 
 import test.helpers as helpers
 import lxml.etree as ET
 import xml_to_csv.utils as utils
+import xml_to_csv.xml_to_csv as xml_to_csv
+import xml_to_csv.position_index as position_index
+import xml_to_csv.checkpoint as checkpoint
+import xml_to_csv.metrics as xml_metrics
+import xml_to_csv.byte_extractor as byte_extractor
+import xml_to_csv.sqlite_output as sqlite_output
+import xml_to_csv.record_manifest as record_manifest
+import benchmark.generate_marc as generate_marc
+import benchmark.run_benchmarks as run_benchmarks
+import shutil
 from test.position_test_cases import PositionTestCases
 
 # Don't show the traceback of an AssertionError, because the AssertionError already says what the issue is!
@@ -72,6 +90,84 @@ class TestMixedCollectionRecords(PositionTestCases, unittest.TestCase):
     cls.positionsChunk1500 = utils.find_record_positions('test/resources/10-records-with-unrelated-records.xml', 'record', chunkSize=1500)
 
 
+class TestRecordPositions(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def test_lazy_positions_equal_materialized_positions(self):
+        materialized = utils.find_record_positions('test/resources/10-records-with-unrelated-records.xml', 'record', chunkSize=110)
+        lazy = list(utils.iter_record_positions('test/resources/10-records-with-unrelated-records.xml', 'record', chunkSize=110))
+        self.assertListEqual(lazy, list(materialized), msg='Lazy and materialized record positions differ')
+
+    # -------------------------------------------------------------------------
+    def test_batches_from_lazy_positions(self):
+        positions = utils.iter_record_positions('test/resources/10-records.xml', 'record', chunkSize=200)
+        batches = list(utils.iter_batches(positions, 4))
+        batchSizes = [len(b) for b in batches]
+        self.assertListEqual(batchSizes, [4, 4, 2], msg=f'Wrong batch sizes {batchSizes}')
+        self.assertEqual(batches[0].start, 15, msg=f'Wrong start of the first batch {batches[0].start}')
+        self.assertEqual(batches[-1].end, batches[-1][-1][1], msg='End of the batch should be the end of its last record')
+
+    # -------------------------------------------------------------------------
+    def test_parse_batch_from_mapped_file_in_small_pieces(self):
+        positions = utils.find_record_positions('test/resources/10-records-with-unrelated-records.xml', 'record')
+        with utils.MappedInputFile('test/resources/10-records-with-unrelated-records.xml') as inputFile:
+            chunks = inputFile.iter_chunks(positions[2][0], positions[5][1], chunkSize=7)
+            identifiers = [record.findtext('id') for record in utils.iter_parsed_records(chunks, 'record')]
+        self.assertListEqual(identifiers, ['3', '4', '5', '6'], msg=f'Wrong records parsed from the batch: {identifiers}')
+
+
+class TestPositionIndex(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def test_index_is_stored_and_reused(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            inputFilename = os.path.join(tmpDir, 'input.xml')
+            shutil.copyfile('test/resources/10-records-with-unrelated-records.xml', inputFilename)
+
+            scanned = list(position_index.iter_indexed_record_positions(inputFilename, 'record', chunkSize=110))
+            indexFilename = position_index.getIndexFilename(inputFilename)
+            self.assertTrue(os.path.isfile(indexFilename), msg='No position index was written')
+
+            fingerprint = position_index.getFileFingerprint(inputFilename)
+            stored = position_index.readPositionIndex(indexFilename, fingerprint, 'record')
+            self.assertListEqual(list(stored), scanned, msg='Positions in the index differ from the scanned positions')
+            self.assertListEqual(list(position_index.iter_indexed_record_positions(inputFilename, 'record')), scanned, msg='Reloaded positions differ from the scanned positions')
+
+    # -------------------------------------------------------------------------
+    def test_index_is_invalid_for_changed_file(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            inputFilename = os.path.join(tmpDir, 'input.xml')
+            shutil.copyfile('test/resources/10-records.xml', inputFilename)
+            list(position_index.iter_indexed_record_positions(inputFilename, 'record', indexDir=tmpDir))
+            indexFilename = position_index.getIndexFilename(inputFilename, tmpDir)
+
+            with open(inputFilename, 'a') as inputFile:
+                inputFile.write('<!-- changed -->')
+
+            fingerprint = position_index.getFileFingerprint(inputFilename)
+            self.assertIsNone(position_index.readPositionIndex(indexFilename, fingerprint, 'record'), msg='Index of a changed file should not be used')
+            self.assertIsNone(position_index.readPositionIndex(indexFilename, position_index.getFileFingerprint('test/resources/10-records.xml'), 'otherTag'), msg='Index of another record tag should not be used')
+
+    # -------------------------------------------------------------------------
+    def test_fingerprint_covers_whole_file(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            inputFilename = os.path.join(tmpDir, 'input.xml')
+            content = bytearray(b'<collection>' + b' ' * (4 * position_index.FINGERPRINT_CHUNK_SIZE) + b'</collection>')
+            with open(inputFilename, 'wb') as inputFile:
+                inputFile.write(content)
+            fingerprint = position_index.getFileFingerprint(inputFilename)
+
+            # a byte far from the beginning, the middle and the end changes, size and modification time stay the same
+            content[position_index.FINGERPRINT_CHUNK_SIZE + 1] = ord('x')
+            with open(inputFilename, 'wb') as inputFile:
+                inputFile.write(content)
+            os.utime(inputFilename, ns=(fingerprint['mtime_ns'], fingerprint['mtime_ns']))
+
+            changedFingerprint = position_index.getFileFingerprint(inputFilename)
+            self.assertEqual(changedFingerprint['size'], fingerprint['size'], msg='The size should not change')
+            self.assertNotEqual(changedFingerprint, fingerprint, msg='A changed byte should change the fingerprint')
+
+
 class TestDateParsing(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -99,6 +195,64 @@ class TestDateParsing(unittest.TestCase):
         self.assertEqual(result[0], "1978-04/1980-11")
         self.assertEqual(result[1], "range_with_and_written_month")
 
+    def test_date_rule_engine(self):
+        # The compiled rule engine should return exactly the same as parseComplexDate did per call
+        monthMapping = utils.buildMonthMapping(self.config)
+        engine = utils.DateRuleEngine(self.config, monthMapping)
+        expected = {
+          'before November 1980 and after April 1978': ('1978-04/1980-11', 'range_with_and_written_month'),
+          'avant 1850': ('[..1850]', 'before_year'),
+          'apres 1850': ('[1850..]', 'after_year'),
+          'entre 1800 et 1810': ('[1800..1810]', 'between_years'),
+          'avant mars 1920': ('[..1920-03]', 'before_written_month_year'),
+          'avant 12/03/1920': ('[..1920-03-12]', 'before_dash_date'),
+          'après août 1914': ('[1914-08..]', 'after_written_month_year'),
+          'Juni 1950': ('1950-06', 'written_month_year'),
+          '1950 of 1951': ('[1950,1951]', 'year_or'),
+          '1950 (ou 1951)': ('[1950,1951]', 'year_or_brackets'),
+          '1890 ?': ('1890?', 'uncertain_year'),
+          'ca. 1890': ('1890~', 'circa_year'),
+          '1890-1891': ('[1890,1891]', 'one_of_two_years_dash'),
+          '1890 / 1891': ('[1890,1891]', 'one_of_two_years_slash'),
+          '1890/91': ('[1890,1891]', 'years_slash_abbreviation'),
+          '1890-04': ('1890-04', 'year_month'),
+          '1890-04-12 Brussel': ('1890', 'year_and_text'),
+          '19e': ('19XX', 'century'),
+          'unknown': (None, None)
+        }
+        for value, expectedResult in expected.items():
+            self.assertEqual(engine.parse(value), expectedResult, msg=f'Wrong result for "{value}"')
+
+    def test_date_pattern_parser_same_results(self):
+        # The fast path should return exactly what parseDate returns, None instead of an exception
+        patterns = self.config["datePatterns"]
+        parser = utils.DatePatternParser(patterns)
+        inputs = ['1988', '780', '93', '0', '0000', '(1988)', '[1988]', '1988.', '1988-04', '198804', '19880425', '1988-4-5',
+                  '1988-04-25', '1988--04-25', '1988--04--25', '25/04/1988', '5/4/1988', '1988/04/25', '1980----',
+                  '1988.04.25', '25.04.1988', '1988-02-29', '1989-02-29', '1988-13-01', '1988-04-31', '1233?', '1988-04-25x', '', '----']
+        for value in inputs:
+            try:
+                expected = utils.parseDate(value, patterns)
+            except Exception:
+                expected = None
+            self.assertEqual(parser.parse(value), expected, msg=f'Different result for "{value}"')
+
+    def test_date_cache_logs_on_hit(self):
+        # Cached results should still produce the per-record log messages
+        monthMapping = utils.buildMonthMapping(self.config)
+        engine = utils.DateRuleEngine(self.config, monthMapping)
+        cache = utils.DateCache(10)
+        for recordID in ['1', '2']:
+            with self.assertLogs(utils.LOGGER_NAME, level='WARNING') as logs:
+                self.assertEqual(utils.handleTypeDate(recordID, '----', self.config, monthMapping, engine, cache), (None, 'placeholder_value'))
+                self.assertEqual(utils.handleTypeDate(recordID, 'unknown', self.config, monthMapping, engine, cache), (None, None))
+            self.assertEqual(len(logs.records), 2, msg=f'Expected a warning and an error for record {recordID}, got {logs.output}')
+            self.assertTrue(all(r.identifier == recordID for r in logs.records), msg=f'Log messages should be about record {recordID}')
+
+        self.assertEqual(utils.handleTypeDate('3', '1900', self.config, monthMapping, engine, cache), ('1900', 'simplePattern'))
+        self.assertEqual(cache.counters['dateCacheHits'], 2)
+        self.assertEqual(cache.counters['dateCacheMisses'], 3)
+
 class TestEncoding(unittest.TestCase):
 
     @classmethod
@@ -146,6 +300,29 @@ class TestEncoding(unittest.TestCase):
     def test_encoding_fixing_invalid_type_dict(self):
         self.assertEqual(utils.fix_encoding({}), {}, msg='dict is not handled properly')
 
+    def test_encoding_repair_same_as_fixing(self):
+        counters = {}
+        repair = utils.EncodingRepair(counters)
+        texts = list(TestEncoding.testStrings.keys()) + list(TestEncoding.testStrings.values()) + ['plain ASCII', '', 'ŒŠ']
+        for text in texts:
+            expected = utils.fix_encoding(text) if utils.needs_encoding_fixing(text) else text
+            self.assertEqual(repair.repair(text), expected, msg=f'The repair of "{text}" differs')
+        self.assertEqual(counters['repairedEncodingCounter'], len(TestEncoding.testStrings), msg='Only the wrongly encoded texts should be counted')
+
+    def test_encoding_repair_per_field(self):
+        config = {"recordIDExpression": "./id", "recordIDColumnName": "id", "counters": {}, "dataFields": [
+          {"columnName": "repaired", "expression": "./name", "valueType": "text"},
+          {"columnName": "original", "expression": "./alternateName", "valueType": "text", "fixEncoding": "false"},
+          {"columnName": "place", "expression": "./place", "valueType": "json", "fixEncoding": "false", "subfields": [
+            {"columnName": "town", "expression": "./town", "valueType": "text"},
+            {"columnName": "country", "expression": "./country", "valueType": "text", "fixEncoding": "true"}]}]}
+        elem = ET.fromstring("<record><id>1</id><name>MÃ©ridionaux</name><alternateName>MÃ©ridionaux</alternateName><place><town>LiÃ¨ge</town><country>BelgiÃ«</country></place></record>")
+        values = utils.getValueList(elem, config, "dataFields", {}, {})
+        self.assertEqual(values['repaired'], [{'repaired': 'Méridionaux'}], msg='The text should be repaired by default')
+        self.assertEqual(values['original'], [{'original': 'MÃ©ridionaux'}], msg='The text should not be repaired with fixEncoding false')
+        self.assertEqual(values['place'], [{'town': 'LiÃ¨ge', 'country': 'België'}], msg='Subfields should use the setting of their field unless they have their own')
+        self.assertEqual(config['counters']['repairedEncodingCounter'], 2, msg='Two texts were repaired')
+
 
 class TestRecordProcessing(unittest.TestCase):
 
@@ -209,6 +386,47 @@ class TestRecordProcessing(unittest.TestCase):
 
 
  
+    # -------------------------------------------------------------------------
+    def test_value_list_with_execution_plan(self):
+        plan = utils.ExtractionPlan(TestRecordProcessing.splitConfig, self.dateConfig, self.monthMapping)
+        withPlan = utils.getValueList(TestRecordProcessing.multipleElementsWithSubfields, TestRecordProcessing.splitConfig, "dataFields", self.dateConfig, self.monthMapping, plan)
+        withoutPlan = utils.getValueList(TestRecordProcessing.multipleElementsWithSubfields, TestRecordProcessing.splitConfig, "dataFields", self.dateConfig, self.monthMapping)
+        self.assertDictEqual(withPlan, withoutPlan, msg='Extraction with a compiled execution plan differs from extraction without plan')
+
+    # -------------------------------------------------------------------------
+    def test_extraction_plan_split_rules(self):
+        plan = utils.ExtractionPlan(TestRecordProcessing.splitConfig, self.dateConfig, self.monthMapping)
+        field, location = plan.fields
+        self.assertEqual(field.splitCharacter, ';', msg='Split character of a text field not precomputed')
+        self.assertIsNone(location.splitCharacter, msg='A json field without split character should not be split')
+        self.assertDictEqual(location.subfieldSplitCharacters, {'place': ';', 'country': ';'}, msg='Split characters of subfields not precomputed')
+        self.assertListEqual(location.outputFields, ['autID', 'place', 'country'], msg='Wrong columns for the 1:n output of a json field')
+
+    # -------------------------------------------------------------------------
+    def test_duplicate_values_added_once(self):
+        names = ''.join(f'<field>name{i % 50}</field>' for i in range(500))
+        values = utils.extractRecordValues(ET.fromstring(f'<record><id>1</id>{names}</record>'), TestRecordProcessing.splitConfig, "dataFields", self.dateConfig, self.monthMapping)
+        self.assertListEqual(values.values[0], [(f'name{i}',) for i in range(50)], msg='Each value should be added once, in the order in which it was found first')
+
+    # -------------------------------------------------------------------------
+    def test_rows_written_as_tuples(self):
+        config = TestRecordProcessing.splitConfig
+        plan = utils.ExtractionPlan(config, self.dateConfig, self.monthMapping)
+        record = ET.fromstring("<record><id>1</id><field>value1 ; value2</field><field>value1 ; value2</field><field>value3</field><location><place>Ghent ; Gent</place><country>Belgium</country></location></record>")
+        outputs = []
+        for createWriter in [lambda f, fieldnames: csv.DictWriter(f, fieldnames=fieldnames), utils.BatchedCSVWriter]:
+            mainFile = io.StringIO()
+            files = {field.columnName: io.StringIO() for field in plan.fields}
+            mainWriter = createWriter(mainFile, plan.mainOutputFields)
+            writers = {field.columnName: createWriter(files[field.columnName], field.outputFields) for field in plan.fields}
+            utils.processRecord(record, config, self.dateConfig, self.monthMapping, mainWriter, writers, 'prefix', plan=plan)
+            for writer in [mainWriter] + list(writers.values()):
+                if hasattr(writer, 'flush'):
+                    writer.flush()
+            outputs.append([mainFile.getvalue()] + [f.getvalue() for f in files.values()])
+        self.assertListEqual(outputs[0], outputs[1], msg='Rows written as tuples should be the same as rows written by csv.DictWriter')
+        self.assertEqual(outputs[1][1].splitlines(), ['1,value1', '1,value2', '1,value3'], msg='Wrong 1:n rows of a split field')
+
     # -------------------------------------------------------------------------
     def test_subfield_split_cartesian_product(self):
         splitCharacters = {
@@ -332,9 +550,767 @@ class TestRecordProcessing(unittest.TestCase):
         self.assertEqual(resultLocation[1]['country'], 'Belgium', msg=f'Extracted value should be "Belgium", but is {resultLocation[1]["country"]}')
 
 
+class TestParallelBatchProcessing(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def test_parallel_output_equals_sequential_output(self):
+        inputFiles = ['test/resources/10-records-with-unrelated-records.xml']
+        with tempfile.TemporaryDirectory() as outputFolder:
+            sequential = helpers.runMain(outputFolder, 'sequential', inputFiles)
+            parallel = helpers.runMain(outputFolder, 'parallel', inputFiles, workers=3)
+
+        records = list(csv.DictReader(io.StringIO(parallel['output.csv'].decode('utf-8'))))
+        self.assertEqual(len(records), 10, msg=f'There should be 10 records, but found {len(records)}')
+        self.assertEqual(parallel, sequential, msg='Output of parallel processing differs from sequential processing')
+
+    # -------------------------------------------------------------------------
+    def test_parallel_record_order(self):
+        with tempfile.TemporaryDirectory() as outputFolder:
+            parallel = helpers.runMain(outputFolder, 'parallel', ['test/resources/10-records-with-unrelated-records.xml'], workers=2)
+
+        identifiers = [row['autID'] for row in csv.DictReader(io.StringIO(parallel['prefix-name.csv'].decode('utf-8')))]
+        self.assertListEqual(identifiers, [str(i) for i in range(1, 11)], msg=f'Records are not written in the original order: {identifiers}')
+
+    # -------------------------------------------------------------------------
+    def test_parallel_output_with_dates_and_subfields(self):
+        """The main output cells of date and json columns must not contain the record identifier added for the 1:n outputs."""
+        with tempfile.TemporaryDirectory() as outputFolder:
+            output = {}
+            for workers in [1, 3]:
+                output[workers] = helpers.runMain(outputFolder, str(workers), ['test/resources/10-records-with-subfields.xml'], 'test/resources/incrementalSubfieldConfig.json', workers=workers)
+
+        self.assertNotIn(b"'autID'", output[3]['output.csv'], msg='The record identifier of the 1:n outputs leaked into the main output')
+        self.assertEqual(output[3], output[1], msg='Output of parallel processing with 1:n outputs differs from sequential processing')
+
+
+class TestBatchedCSVWriter(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def _write(self, writerClass, rows):
+        with tempfile.TemporaryFile('w+') as outFile:
+            writer = writerClass(outFile, fieldnames=['id', 'name', 'date'], delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+            if hasattr(writer, 'flush'):
+                writer.flush()
+            outFile.seek(0)
+            return outFile.read()
+
+    # -------------------------------------------------------------------------
+    def test_same_output_as_dict_writer(self):
+        rows = [
+          {'id': '1', 'name': ['a, b', 'c "quoted"'], 'date': [{'date': '1900', 'rule': 'simplePattern'}]},
+          {'id': '2', 'name': '', 'date': None},
+          {'id': '3', 'name': 'multi\nline'},
+          {'id': '4', 'date': ['', 'ümlaut']}
+        ]
+        expected = self._write(lambda f, fieldnames, **kwargs: csv.DictWriter(f, fieldnames=fieldnames, **kwargs), rows)
+        batched = self._write(lambda f, fieldnames, **kwargs: utils.BatchedCSVWriter(f, fieldnames, maxRows=3, **kwargs), rows)
+        self.assertEqual(batched, expected, msg='The batched writer should write the same CSV as csv.DictWriter')
+
+    # -------------------------------------------------------------------------
+    def test_row_is_fixed_when_written(self):
+        with tempfile.TemporaryFile('w+') as outFile:
+            writer = utils.BatchedCSVWriter(outFile, ['id', 'date'])
+            date = {'date': '1900'}
+            writer.writerow({'id': '1', 'date': [date]})
+            # processRecord adds the identifier to the same dictionary for the 1:n output
+            date['id'] = '1'
+            writer.flush()
+            outFile.seek(0)
+            self.assertEqual(outFile.read(), "1,[{'date': '1900'}]\n", msg='Changes after writing a row should not be part of the output')
+
+
+class TestCheckpointResume(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def test_resume_after_crash(self):
+        inputFiles = ['test/resources/10-records.xml']
+        for workers in [1, 2]:
+            with self.subTest(workers=workers), tempfile.TemporaryDirectory() as outputFolder:
+                expected = helpers.runMain(outputFolder, 'reference', inputFiles)
+                self.assertNotIn('output.csv' + checkpoint.CHECKPOINT_SUFFIX, expected, msg='The checkpoint of a successful run should be removed')
+
+                # batches of 3 records: the run dies in the third batch after record 7 was written
+                exitCode = helpers.runCrashingMain(outputFolder, 'resumed', inputFiles, workers=workers)
+                self.assertEqual(exitCode, 1, msg='A run which died in a batch should exit with an error, such that it is resumed')
+
+                checkpointFilename = checkpoint.getCheckpointFilename(os.path.join(outputFolder, 'resumed', 'output.csv'))
+                state = checkpoint.loadCheckpoint(checkpointFilename, inputFiles)
+                self.assertEqual(state['lastBatch'], 2, msg=f'The last fully written batch should be 2, but is {state["lastBatch"]}')
+                self.assertEqual(state['counters']['recordCounter'], 6, msg=f'The checkpoint should count 6 records, but counts {state["counters"]["recordCounter"]}')
+
+                output = helpers.runMain(outputFolder, 'resumed', inputFiles, resume=True, workers=workers)
+                self.assertEqual(output, expected, msg='The output of the resumed run differs')
+
+    # -------------------------------------------------------------------------
+    def _create_checkpoint(self, outputFolder):
+        """Returns the input file, the main output file and the checkpoint filename of a run which died after the second batch."""
+        inputFilename = os.path.join(outputFolder, 'records.xml')
+        shutil.copyfile('test/resources/10-records.xml', inputFilename)
+        outputFilename = os.path.join(outputFolder, 'output.csv')
+        with open(outputFilename, 'wb') as outputFile:
+            outputFile.write(b'id,name\n1,a\n')
+            checkpointFilename = checkpoint.getCheckpointFilename(outputFilename)
+            checkpointer = checkpoint.Checkpoint(checkpointFilename, [inputFilename], {outputFilename: outputFile})
+            checkpointer.save({'counters': {'batchCounter': 2}}, 0, 100)
+        return inputFilename, outputFilename, checkpointFilename
+
+    # -------------------------------------------------------------------------
+    def test_resume_refuses_changed_input(self):
+        with tempfile.TemporaryDirectory() as outputFolder:
+            inputFilename, outputFilename, checkpointFilename = self._create_checkpoint(outputFolder)
+            checkpoint.loadCheckpoint(checkpointFilename, [inputFilename])
+
+            with open(inputFilename, 'ab') as inputFile:
+                inputFile.write(b'\n')
+            with self.assertRaises(ValueError, msg='A checkpoint of an input file which changed afterwards should not be used'):
+                checkpoint.loadCheckpoint(checkpointFilename, [inputFilename])
+
+    # -------------------------------------------------------------------------
+    def test_resume_refuses_short_output(self):
+        with tempfile.TemporaryDirectory() as outputFolder:
+            inputFilename, outputFilename, checkpointFilename = self._create_checkpoint(outputFolder)
+            state = checkpoint.loadCheckpoint(checkpointFilename, [inputFilename])
+
+            with open(outputFilename, 'r+b') as outputFile:
+                outputFile.truncate(5)
+            with self.assertRaises(ValueError, msg='An output file shorter than stored in the checkpoint should not be extended'):
+                checkpoint.truncateOutputs(state)
+            self.assertEqual(os.path.getsize(outputFilename), 5, msg='The short output file should not be changed')
+
+
+class TestProfileStats(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def test_report_of_incremental_run(self):
+        with tempfile.TemporaryDirectory() as outputFolder:
+            _, report = helpers.runMainWithProfile(outputFolder, 'incremental', ['test/resources/10-records.xml'])
+
+        self.assertEqual(report['records'], 10, msg=f'The report should count 10 records, but counts {report["records"]}')
+        self.assertEqual(report['batches'], 4, msg=f'The report should count 4 batches, but counts {report["batches"]}')
+        self.assertEqual(report['counters']['recordCounter'], 10, msg='The counters are not part of the report')
+        self.assertEqual(report['stages']['recordProcessing']['calls'], 10, msg='The processing of each record should be measured')
+        self.assertEqual(report['stages']['xpathEvaluation']['calls'], 20, msg='The record identifier and the name of each record should be evaluated')
+        self.assertGreater(report['stages']['positionScanning']['seconds'], 0, msg='Position scanning was not measured')
+        batches = utils.iter_batches(utils.find_record_positions('test/resources/10-records.xml', 'record'), 3)
+        expectedBytes = sum(batch.end - batch.start for batch in batches)
+        self.assertEqual(report['bytesRead'], expectedBytes, msg=f'{expectedBytes} bytes should be read, but the report says {report["bytesRead"]}')
+
+    # -------------------------------------------------------------------------
+    def test_report_of_parallel_run(self):
+        with tempfile.TemporaryDirectory() as outputFolder:
+            _, report = helpers.runMainWithProfile(outputFolder, 'parallel', ['test/resources/10-records.xml'], workers=2)
+
+        self.assertEqual(report['stages']['recordProcessing']['calls'], 10, msg='The stage times of the workers are not merged')
+        self.assertGreater(report['stages']['csvWriting']['seconds'], 0, msg='The CSV writing of the parent was not measured')
+
+
+
+class TestFileParallelProcessing(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def test_parallel_output_equals_sequential_output(self):
+        inputFiles = ['test/resources/10-records.xml', 'test/resources/10-records-with-unrelated-records.xml', 'test/resources/10-records.xml']
+        with tempfile.TemporaryDirectory() as outputFolder:
+            sequential, sequentialReport = helpers.runMainWithProfile(outputFolder, 'sequential', inputFiles)
+            parallel, parallelReport = helpers.runMainWithProfile(outputFolder, 'parallel', inputFiles, fileWorkers=3)
+            remainingFiles = os.listdir(os.path.join(outputFolder, 'parallel'))
+
+        self.assertEqual(parallel, sequential, msg='Output of file parallel processing differs from sequential processing')
+        self.assertEqual(parallel['output.csv'].count(b'autID'), 1, msg='The header of the main output should only be written once')
+        self.assertEqual(parallelReport['counters']['fileCounter'], 3, msg=f'3 files should be counted, but counted {parallelReport["counters"]["fileCounter"]}')
+        self.assertDictEqual(parallelReport['counters'], sequentialReport['counters'], msg='The counters of the file workers are not summed correctly')
+        self.assertFalse([f for f in remainingFiles if f.startswith('.xml-to-csv-shards-')], msg='The shard folder was not removed')
+
+    # -------------------------------------------------------------------------
+    def test_failing_file_worker(self):
+        inputFiles = ['test/resources/10-records.xml', 'test/resources/10-records-with-unrelated-records.xml']
+        with tempfile.TemporaryDirectory() as outputFolder:
+            exitCode = helpers.runCrashingMain(outputFolder, 'failed', inputFiles, fileWorkers=2)
+            remainingFiles = os.listdir(os.path.join(outputFolder, 'failed'))
+
+        self.assertEqual(exitCode, 1, msg='A failing file worker should end the run with an error')
+        self.assertFalse([f for f in remainingFiles if f.startswith('.xml-to-csv-shards-')], msg='The shard folder was not removed')
+
+    # -------------------------------------------------------------------------
+    def test_stop_event_ends_extraction(self):
+        with open('test/resources/incrementalConfig.json', 'r') as configFile:
+            config = json.load(configFile)
+        with open('test/resources/date-mapping.json', 'r') as dateConfigFile:
+            dateConfig = json.load(dateConfigFile)
+        stopEvent = threading.Event()
+        stopEvent.set()
+
+        with tempfile.TemporaryDirectory() as outputFolder:
+            # more records than the update frequency, such that also the regular processing checks the stop event
+            inputFilename = os.path.join(outputFolder, 'records.xml')
+            with open(inputFilename, 'w') as inputFile:
+                inputFile.write('<collection>' + ''.join(f'<record><id>{i}</id><name>record {i}</name></record>' for i in range(1, 251)) + '</collection>')
+
+            for incremental in [True, False]:
+                with self.subTest(incremental=incremental):
+                    with self.assertRaises(xml_to_csv.ExtractionStopped, msg='A set stop event should end the extraction'):
+                        xml_to_csv.extractFiles([inputFilename], os.path.join(outputFolder, 'output.csv'), config, dateConfig, utils.buildMonthMapping(dateConfig), 'prefix', incremental,
+                                                progress=False, stopEvent=stopEvent)
+
+    # -------------------------------------------------------------------------
+    def test_directory_and_glob_arguments(self):
+        with tempfile.TemporaryDirectory() as inputFolder:
+            for filename in ['b.xml', 'a.xml', 'c.txt']:
+                shutil.copy('test/resources/10-records.xml', os.path.join(inputFolder, filename))
+
+            self.assertListEqual(xml_to_csv.expandInputFilenames([inputFolder]), [os.path.join(inputFolder, 'a.xml'), os.path.join(inputFolder, 'b.xml')], msg='Directories should be expanded to their XML files')
+            self.assertListEqual(xml_to_csv.expandInputFilenames([os.path.join(inputFolder, 'b*')]), [os.path.join(inputFolder, 'b.xml')], msg='Glob patterns should be expanded')
+
+
+class TestCompressedInput(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+        with open('test/resources/10-records-with-unrelated-records.xml', 'rb') as inFile:
+            data = inFile.read()
+        self.compressedFiles = []
+        for extension, opener in [('gz', gzip.open), ('bz2', bz2.open), ('xz', lzma.open)]:
+            filename = os.path.join(self.tempDir, f'records.xml.{extension}')
+            with opener(filename, 'wb') as outFile:
+                outFile.write(data)
+            self.compressedFiles.append(filename)
+
+    # -------------------------------------------------------------------------
+    def test_same_output_as_uncompressed_input(self):
+        for incremental in [False, True]:
+            expected = helpers.runMain(self.tempDir, f'reference-{incremental}', ['test/resources/10-records-with-unrelated-records.xml'], incremental=incremental)
+            for filename in self.compressedFiles:
+                with self.subTest(filename=os.path.basename(filename), incremental=incremental):
+                    output = helpers.runMain(self.tempDir, f'{os.path.basename(filename)}-{incremental}', [filename], incremental=incremental)
+                    self.assertEqual(output, expected, msg=f'The output of {filename} differs from the output of the uncompressed file')
+
+    # -------------------------------------------------------------------------
+    def test_parallel_workers(self):
+        expected = helpers.runMain(self.tempDir, 'reference', ['test/resources/10-records-with-unrelated-records.xml'])
+        output = helpers.runMain(self.tempDir, 'parallel', self.compressedFiles[:1], workers=2)
+        self.assertEqual(output, expected, msg='The output of parallel workers for a compressed file differs')
+
+    # -------------------------------------------------------------------------
+    def test_resume_after_crash(self):
+        expected = helpers.runMain(self.tempDir, 'reference', self.compressedFiles[:1])
+        self.assertEqual(helpers.runCrashingMain(self.tempDir, 'resumed', self.compressedFiles[:1]), 1, msg='The run should die in a batch')
+        output = helpers.runMain(self.tempDir, 'resumed', self.compressedFiles[:1], resume=True)
+        self.assertEqual(output, expected, msg='The output of the resumed run with a compressed file differs')
+
+    # -------------------------------------------------------------------------
+    def test_decompressed_data_is_freed(self):
+        with utils.DecompressedInputFile(self.compressedFiles[0]) as inputFile:
+            positions = list(utils.iter_stream_record_positions(inputFile, 'record', chunkSize=64))
+            start, end = positions[0]
+            data = inputFile.read_range(start, end)
+            self.assertTrue(data.startswith(b'<record') and data.endswith(b'</record>'), msg=f'Wrong bytes of the first record: {data}')
+            self.assertEqual(inputFile.windowStart, end, msg='The data of a requested byte range should be freed')
+            with self.assertRaises(ValueError):
+                inputFile.read_range(start, end)
+
+
+class TestCompressedOutput(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+
+    # -------------------------------------------------------------------------
+    def test_same_output_as_uncompressed_output(self):
+        for incremental in [False, True]:
+            expected = helpers.runMain(self.tempDir, f'reference-{incremental}', ['test/resources/10-records.xml'], incremental=incremental)
+            for extension in ['.gz', '.xz']:
+                with self.subTest(extension=extension, incremental=incremental):
+                    output = helpers.runMain(self.tempDir, f'compressed{extension}-{incremental}', ['test/resources/10-records.xml'], incremental=incremental, extension=extension)
+                    self.assertEqual(list(output.values()), list(expected.values()), msg=f'The decompressed {extension} output differs from the uncompressed output')
+                    self.assertFalse([f for f in output if f.endswith(checkpoint.CHECKPOINT_SUFFIX)], msg='No checkpoint should be left')
+
+    # -------------------------------------------------------------------------
+    def test_resume_is_not_possible(self):
+        with self.assertRaises(SystemExit):
+            helpers.runMain(self.tempDir, 'resumed', ['test/resources/10-records.xml'], extension='.gz', resume=True)
+
+    # -------------------------------------------------------------------------
+    def test_appending_is_not_possible(self):
+        with self.assertRaises(ValueError):
+            utils.openOutputFile(os.path.join(self.tempDir, 'out.csv.gz'), 'a')
+
+
+class TestSQLiteOutput(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+
+    # -------------------------------------------------------------------------
+    def _run_main(self, name, extension, incremental, workers=1):
+        """Runs xml_to_csv and returns the rows of the main output and of the 1:n output of names, empty values as empty strings."""
+        output = helpers.runMain(self.tempDir, name, ['test/resources/10-records-with-unrelated-records.xml'], incremental=incremental, extension=extension, workers=workers)
+        if extension == '.csv':
+            return [[tuple(row) for row in csv.reader(io.StringIO(output[filename].decode('utf-8'), newline=''))][1:] for filename in ['output.csv', 'prefix-name.csv']]
+        with sqlite3.connect(os.path.join(self.tempDir, name, f'output{extension}')) as connection:
+            return [[tuple('' if value is None else value for value in row) for row in connection.execute(f'SELECT * FROM "{table}" ORDER BY rowid')] for table in ['output', 'prefix-name']]
+
+    # -------------------------------------------------------------------------
+    def test_same_rows_as_csv_output(self):
+        for incremental, workers in [(False, 1), (True, 1), (True, 2)]:
+            with self.subTest(incremental=incremental, workers=workers):
+                expected = self._run_main(f'reference-{incremental}', '.csv', incremental)
+                output = self._run_main(f'database-{incremental}-{workers}', '.sqlite', incremental, workers=workers)
+                self.assertTrue(expected[0] and expected[1], msg='The test should compare rows')
+                self.assertEqual(output, expected, msg='The tables should contain the rows of the CSV output files')
+                self.assertFalse([f for f in os.listdir(os.path.join(self.tempDir, f'database-{incremental}-{workers}')) if f.endswith(checkpoint.CHECKPOINT_SUFFIX)], msg='No checkpoint should be left')
+
+    # -------------------------------------------------------------------------
+    def test_record_id_is_indexed(self):
+        self._run_main('database', '.sqlite', True)
+        with sqlite3.connect(os.path.join(self.tempDir, 'database', 'output.sqlite')) as connection:
+            indexedTables = [table for (table,) in connection.execute("SELECT tbl_name FROM sqlite_master WHERE type = 'index'")]
+            tables = [table for (table,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.assertIn('prefix-name', tables, msg='There should be a table per 1:n output')
+        self.assertCountEqual(indexedTables, tables, msg='Each table should have an index on the record identifier')
+
+    # -------------------------------------------------------------------------
+    def test_resume_is_not_possible(self):
+        with self.assertRaises(SystemExit):
+            helpers.runMain(self.tempDir, 'resumed', ['test/resources/10-records.xml'], extension='.sqlite', resume=True)
+
+
+class TestPipelinedProcessing(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+        with open('test/resources/incrementalConfig.json', 'r') as configFile:
+            config = json.load(configFile)
+        config.setdefault('execution', {}).update({'pipelineQueueDepth': 2, 'outputBufferSize': 16})
+        self.pipelineConfig = os.path.join(self.tempDir, 'pipelineConfig.json')
+        with open(self.pipelineConfig, 'w') as configFile:
+            json.dump(config, configFile)
+
+    # -------------------------------------------------------------------------
+    def test_same_output_as_without_pipeline(self):
+        for incremental in [False, True]:
+            with self.subTest(incremental=incremental):
+                expected = helpers.runMain(self.tempDir, f'reference-{incremental}', ['test/resources/10-records-with-unrelated-records.xml'], incremental=incremental)
+                output = helpers.runMain(self.tempDir, f'pipeline-{incremental}', ['test/resources/10-records-with-unrelated-records.xml'], self.pipelineConfig, incremental=incremental)
+                self.assertEqual(output, expected, msg='The output with reader and writer threads differs')
+
+    # -------------------------------------------------------------------------
+    def test_resume_after_crash(self):
+        inputFiles = ['test/resources/10-records-with-unrelated-records.xml']
+        expected = helpers.runMain(self.tempDir, 'reference', inputFiles)
+        self.assertEqual(helpers.runCrashingMain(self.tempDir, 'resumed', inputFiles, configFilename=self.pipelineConfig), 1, msg='The run should die in a batch')
+        output = helpers.runMain(self.tempDir, 'resumed', inputFiles, self.pipelineConfig, resume=True)
+        self.assertEqual(output, expected, msg='The checkpoint of a pipelined run does not match the written rows')
+
+    # -------------------------------------------------------------------------
+    def test_reader_error_is_raised(self):
+        def failingIterator():
+            yield 1
+            raise OSError('simulated read error')
+
+        with self.assertRaises(OSError):
+            list(utils.iter_prefetched(failingIterator(), 2))
+
+
+class TestMetricsReporter(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+
+    # -------------------------------------------------------------------------
+    def test_status_file_of_finished_run(self):
+        statusFilename = os.path.join(self.tempDir, 'status.json')
+        for incremental in [False, True]:
+            with self.subTest(incremental=incremental):
+                helpers.runMain(self.tempDir, f'run-{incremental}', ['test/resources/10-records.xml'], incremental=incremental, statusFile=statusFilename)
+                with open(statusFilename, 'r') as statusFile:
+                    status = json.load(statusFile)
+                self.assertEqual(status['state'], 'finished', msg='The status file should report the finished run')
+                self.assertEqual(status['records'], 10, msg=f'The status file should report 10 records, but reports {status["records"]}')
+                self.assertEqual(status['processedBytes'], os.path.getsize('test/resources/10-records.xml'), msg='All bytes of the input file should be processed')
+                self.assertEqual(status['totalBytes'], status['processedBytes'], msg='The total should be the size of the input file')
+
+    # -------------------------------------------------------------------------
+    def test_prometheus_textfile(self):
+        statusFilename = os.path.join(self.tempDir, 'status.prom')
+        helpers.runMain(self.tempDir, 'run', ['test/resources/10-records.xml'], statusFile=statusFilename)
+        with open(statusFilename, 'r') as statusFile:
+            lines = statusFile.read().splitlines()
+        self.assertIn('xml_to_csv_records 10', lines, msg=f'The number of records is missing: {lines}')
+        self.assertIn('xml_to_csv_finished 1', lines, msg=f'The run should be reported as finished: {lines}')
+        for counter in ['xml_to_csv_date_cache_hits', 'xml_to_csv_date_cache_misses', 'xml_to_csv_repaired_encoding_counter']:
+            with self.subTest(counter=counter):
+                self.assertIn(f'# TYPE {counter} gauge', lines, msg=f'The counter {counter} is missing: {lines}')
+
+    # -------------------------------------------------------------------------
+    def test_date_cache_in_progress(self):
+        config = {'counters': {'recordCounter': 3, 'dateCacheHits': 2, 'dateCacheMisses': 1}}
+        reporter = xml_metrics.MetricsReporter(config, [1000], progress=False)
+        reporter.update()
+        self.assertIn('date cache hits: 2; date cache misses: 1', reporter.pbar.postfix, msg=f'The date cache hits and misses are missing: {reporter.pbar.postfix}')
+
+    # -------------------------------------------------------------------------
+    def test_no_date_cache_in_progress(self):
+        reporter = xml_metrics.MetricsReporter({'counters': {'recordCounter': 3}}, [1000], progress=False)
+        reporter.update()
+        self.assertNotIn('date cache', reporter.pbar.postfix, msg=f'Without date cache no hits and misses should be shown: {reporter.pbar.postfix}')
+
+    # -------------------------------------------------------------------------
+    def test_metrics_are_throttled(self):
+        config = {'counters': {'recordCounter': 0}, 'recordFilter': {}}
+        statusFilename = os.path.join(self.tempDir, 'status.json')
+        reporter = xml_metrics.MetricsReporter(config, [1000, 3000], interval=3600, statusFilename=statusFilename, progress=False)
+        reporter.startFile(1, position=500)
+        config['counters'].update({'recordCounter': 4, 'filteredRecordCounter': 1})
+        reporter.update()
+        reporter.setFilePosition(2000)
+        reporter.update()
+        with open(statusFilename, 'r') as statusFile:
+            status = json.load(statusFile)
+        self.assertEqual(status['processedBytes'], 1500, msg='Only the first update within the interval should be reported')
+        self.assertEqual(status['filterPassRate'], 0.75, msg=f'3 of 4 records passed the filter, but the pass rate is {status["filterPassRate"]}')
+        self.assertEqual(reporter.getMetrics()['processedBytes'], 3000, msg='The first file and 2000 bytes of the second file are processed')
+
+
+class TestMarcFieldIndex(unittest.TestCase):
+
+    EXPRESSIONS = [
+      './marc:controlfield[@tag="001"]',
+      './marc:datafield[@tag="100"]/marc:subfield[@code="a"]',
+      "./marc:datafield[@tag='400']/marc:subfield[@code='a']",
+      './marc:datafield[@tag="024"]/marc:subfield[@code="2" and (text()="isni" or text()="ISNI")]/../marc:subfield[@code="a"]',
+      './marc:datafield[@tag="024"]/marc:subfield[@code="2" and text()="viaf"]/../marc:subfield[@code="a"]',
+      './marc:datafield[@tag="370"]'
+    ]
+
+    EDGE_CASES = '''<collection xmlns:marc="http://www.loc.gov/MARC21/slim">
+  <marc:record><marc:controlfield tag="001">1</marc:controlfield>
+    <marc:datafield tag="024"><marc:subfield code="a">first</marc:subfield><marc:subfield code="2">is<!-- split -->ni</marc:subfield><marc:subfield code="a">second</marc:subfield></marc:datafield>
+    <marc:datafield tag="024"><marc:subfield code="2">ISNI</marc:subfield><marc:subfield code="2">isni</marc:subfield><marc:subfield code="a">third</marc:subfield></marc:datafield>
+    <marc:datafield tag="024"><marc:subfield code="a">not isni</marc:subfield><marc:subfield code="2"> isni</marc:subfield></marc:datafield>
+    <marc:datafield tag="100"><marc:subfield code="a">name</marc:subfield><other code="a">other namespace</other></marc:datafield>
+    <marc:datafield tag="100"><marc:subfield code="a"/><marc:subfield>no code</marc:subfield></marc:datafield>
+  </marc:record>
+  <marc:record/>
+</collection>'''
+
+    # -------------------------------------------------------------------------
+    def assertSameAsXPath(self, records):
+        indexer = utils.MarcRecordIndexer()
+        for expression in TestMarcFieldIndex.EXPRESSIONS:
+            marcExpression = utils.compileMarcExpression(expression, indexer)
+            xpath = ET.XPath(expression, namespaces=utils.ALL_NS)
+            self.assertIsNotNone(marcExpression, msg=f'The expression should be answered from the index: {expression}')
+            for record in records:
+                self.assertEqual(marcExpression(record), xpath(record), msg=f'Other elements than with XPath for {expression}')
+
+    # -------------------------------------------------------------------------
+    def test_same_elements_as_xpath_for_edge_cases(self):
+        self.assertSameAsXPath(list(ET.fromstring(TestMarcFieldIndex.EDGE_CASES)))
+
+    # -------------------------------------------------------------------------
+    def test_same_elements_as_xpath_for_generated_records(self):
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        filename = os.path.join(tempDir, 'records.xml')
+        generate_marc.generateMARCFile(filename, 50)
+        self.assertSameAsXPath(list(ET.parse(filename).getroot()))
+
+    # -------------------------------------------------------------------------
+    def test_index_can_be_disabled(self):
+        with open('config-example.json', 'r') as configFile:
+            config = json.load(configFile)
+        self.assertEqual(utils.ExecutionPlan(config).numberIndexedExpressions, utils.ExecutionPlan(config).numberExpressions, msg='All expressions of the example config have a MARC shape')
+        config['execution'] = {'marcFieldIndex': False}
+        self.assertEqual(utils.ExecutionPlan(config).numberIndexedExpressions, 0, msg='Without marcFieldIndex only XPath should be used')
+        config['execution'] = {'marcFieldIndex': 'false'}
+        self.assertEqual(utils.ExecutionPlan(config).numberIndexedExpressions, 0, msg='With marcFieldIndex "false" only XPath should be used')
+        config['execution'] = {'marcFieldIndex': 'true'}
+        self.assertGreater(utils.ExecutionPlan(config).numberIndexedExpressions, 0, msg='With marcFieldIndex "true" the MARC field index should be used')
+
+    # -------------------------------------------------------------------------
+    def test_record_id_with_element_path(self):
+        records = list(ET.parse('test/resources/marc-records.xml').getroot())
+        expressions = ['./marc:controlfield[@tag="001"]', './{http://www.loc.gov/MARC21/slim}controlfield[@tag="001"]']
+        for expression in expressions:
+            for marcFieldIndex in [True, False]:
+                with self.subTest(expression=expression, marcFieldIndex=marcFieldIndex):
+                    config = {'recordIDExpression': expression, 'dataFields': [], 'execution': {'marcFieldIndex': marcFieldIndex}}
+                    plan = utils.ExecutionPlan(config)
+                    recordIDs = [utils.getRecordID(record, config, plan) for record in records]
+                    self.assertEqual(recordIDs, [utils.getRecordID(record, config) for record in records], msg='The plan should find the same identifiers as elem.find')
+                    self.assertTrue(all(recordIDs), msg=f'Every record should have an identifier: {recordIDs}')
+
+    # -------------------------------------------------------------------------
+    def test_invalid_flag_ends_the_run(self):
+        with open('test/resources/marcConfig.json', 'r') as configFile:
+            config = json.load(configFile)
+        config['execution']['marcFieldIndex'] = 'yes'
+        with tempfile.TemporaryDirectory() as outputFolder:
+            for engine in ['lxml', 'bytes']:
+                with self.subTest(engine=engine):
+                    config['execution']['extractionEngine'] = engine
+                    configFilename = os.path.join(outputFolder, f'config-{engine}.json')
+                    with open(configFilename, 'w') as configFile:
+                        json.dump(config, configFile)
+                    with self.assertLogs('XML_TO_CSV.utils', level='ERROR') as logs, self.assertRaises(SystemExit) as context:
+                        helpers.runMain(outputFolder, engine, ['test/resources/marc-records.xml'], configFilename)
+                    self.assertEqual(context.exception.code, 1, msg='An invalid marcFieldIndex should end the run with an error')
+                    self.assertTrue(any('Invalid value "yes" for marcFieldIndex' in message for message in logs.output), msg=f'The invalid value is not reported: {logs.output}')
+
+
+class TestByteExtractor(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+
+    # -------------------------------------------------------------------------
+    def _write_config(self, name, engine):
+        with open('test/resources/marcConfig.json', 'r') as configFile:
+            config = json.load(configFile)
+        config['execution']['extractionEngine'] = engine
+        configFilename = os.path.join(self.tempDir, f'{name}.json')
+        with open(configFilename, 'w') as configFile:
+            json.dump(config, configFile)
+        return configFilename
+
+    # -------------------------------------------------------------------------
+    def test_same_output_as_lxml(self):
+        generatedFilename = os.path.join(self.tempDir, 'generated.xml')
+        generate_marc.generateMARCFile(generatedFilename, 100, seed=3)
+        for inputFilename in ['test/resources/marc-records.xml', generatedFilename]:
+            for workers in [1, 2]:
+                with self.subTest(inputFilename=inputFilename, workers=workers):
+                    name = f'{os.path.basename(inputFilename)}-{workers}'
+                    expected = helpers.runMain(self.tempDir, f'lxml-{name}', [inputFilename], self._write_config(f'lxml-{name}', 'lxml'))
+                    output = helpers.runMain(self.tempDir, f'bytes-{name}', [inputFilename], self._write_config(f'bytes-{name}', 'bytes'), workers=workers)
+                    self.assertEqual(output, expected, msg='The output of the byte extractor differs from the output with lxml')
+
+    # -------------------------------------------------------------------------
+    def test_unsupported_records_are_parsed_with_lxml(self):
+        with open('test/resources/marc-records.xml', 'rb') as inputFile:
+            data = inputFile.read()
+        counters = {}
+        extractor = byte_extractor.ByteRecordExtractor(xml_to_csv.getRecordTagName({'recordTag': 'marc:record'}))
+        records = list(extractor.iter_records(data, data.find(b'<marc:record'), data.rfind(b'</marc:collection>'), counters=counters))
+        recordID = utils.compileMarcExpression('./marc:controlfield[@tag="001"]', utils.MarcRecordIndexer())
+        self.assertEqual([recordID(r)[0].text for r in records], ['1', '2', '3', '4', '5', '6'], msg='Not all records were found')
+        self.assertEqual(counters['byteExtractorFallbackCounter'], 1, msg='Only the record with a comment and a CDATA section should be parsed with lxml')
+        self.assertIsInstance(records[3], ET._Element, msg='The record with a comment should be parsed with lxml')
+
+    # -------------------------------------------------------------------------
+    def test_unsupported_config_is_refused(self):
+        with open('test/resources/incrementalConfig.json', 'r') as configFile:
+            config = json.load(configFile)
+        config['execution']['extractionEngine'] = 'bytes'
+        configFilename = os.path.join(self.tempDir, 'config.json')
+        with open(configFilename, 'w') as configFile:
+            json.dump(config, configFile)
+        with self.assertRaises(SystemExit):
+            helpers.runMain(self.tempDir, 'refused', ['test/resources/10-records.xml'], configFilename)
+
+
+class TestBytePreFilter(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+
+    # -------------------------------------------------------------------------
+    def _run_main(self, name, inputFilename, engine, preFilter, workers=1):
+        """Runs xml_to_csv with the given extraction engine and byte pre-filter setting, returns the content of all output files and the counters."""
+        with open('test/resources/marcConfig.json', 'r') as configFile:
+            config = json.load(configFile)
+        config['execution']['extractionEngine'] = engine
+        config['execution']['bytePreFilter'] = preFilter
+        configFilename = os.path.join(self.tempDir, f'{name}.json')
+        with open(configFilename, 'w') as configFile:
+            json.dump(config, configFile)
+
+        output, report = helpers.runMainWithProfile(self.tempDir, name, [inputFilename], configFilename=configFilename, workers=workers)
+        return output, report['counters']
+
+    # -------------------------------------------------------------------------
+    def test_same_output_without_pre_filter(self):
+        generatedFilename = os.path.join(self.tempDir, 'generated.xml')
+        generate_marc.generateMARCFile(generatedFilename, 100, seed=5)
+        for inputFilename in ['test/resources/marc-records.xml', generatedFilename]:
+            for engine in ['lxml', 'bytes']:
+                for workers in [1, 2]:
+                    with self.subTest(inputFilename=inputFilename, engine=engine, workers=workers):
+                        name = f'{os.path.basename(inputFilename)}-{engine}-{workers}'
+                        expected, expectedCounters = self._run_main(f'all-{name}', inputFilename, engine, False)
+                        output, counters = self._run_main(f'pre-{name}', inputFilename, engine, True, workers=workers)
+                        self.assertEqual(output, expected, msg='The output with the byte pre-filter differs from the output without it')
+                        for counter in ['recordCounter', 'filteredRecordCounter', 'filteredRecordExceptionCounter']:
+                            self.assertEqual(counters[counter], expectedCounters[counter], msg=f'The {counter} differs with the byte pre-filter')
+                        self.assertGreater(counters['preFilteredRecordCounter'], 0, msg='No record was rejected by the byte pre-filter')
+
+    # -------------------------------------------------------------------------
+    def test_pre_filter_flag_as_string(self):
+        _, counters = self._run_main('string-false', 'test/resources/marc-records.xml', 'lxml', 'false')
+        self.assertNotIn('preFilteredRecordCounter', counters, msg='The byte pre-filter should be disabled with "false"')
+        _, counters = self._run_main('string-true', 'test/resources/marc-records.xml', 'lxml', 'true')
+        self.assertGreater(counters['preFilteredRecordCounter'], 0, msg='The byte pre-filter should be enabled with "true"')
+
+    # -------------------------------------------------------------------------
+    def test_invalid_pre_filter_flag(self):
+        with self.assertLogs('XML_TO_CSV.utils', level='ERROR') as logs, self.assertRaises(SystemExit) as context:
+            self._run_main('invalid', 'test/resources/marc-records.xml', 'lxml', 'yes')
+        self.assertEqual(context.exception.code, 1, msg='An invalid bytePreFilter should end the run with an error')
+        self.assertTrue(any('Invalid value "yes" for bytePreFilter' in message for message in logs.output), msg=f'The invalid value is not reported: {logs.output}')
+        self.assertListEqual(os.listdir(os.path.join(self.tempDir, 'invalid')), [], msg='The flags should be checked before any output is written')
+
+    # -------------------------------------------------------------------------
+    def test_ambiguous_records_are_not_rejected(self):
+        preFilter = byte_extractor.BytePreFilter(xml_to_csv.getRecordTagName({'recordTag': 'marc:record'}),
+                                                 {"expression": './marc:datafield[@tag="075"]/marc:subfield[@code="a"]', "condition": "equals", "value": "p"})
+        record = '<marc:record xmlns:marc="http://www.loc.gov/MARC21/slim">{}</marc:record>'
+        cases = {
+          'a single other value': ('<marc:datafield tag="075"><marc:subfield code="a">o</marc:subfield></marc:datafield>', True),
+          'the value of the filter': ('<marc:datafield tag="075"><marc:subfield code="a">p</marc:subfield></marc:datafield>', False),
+          'multiple values': ('<marc:datafield tag="075"><marc:subfield code="a">o</marc:subfield><marc:subfield code="a">o</marc:subfield></marc:datafield>', False),
+          'no value': ('<marc:datafield tag="100"><marc:subfield code="a">o</marc:subfield></marc:datafield>', False),
+          'a character reference': ('<marc:datafield tag="075"><marc:subfield code="a">&#112;</marc:subfield></marc:datafield>', False),
+          'a commented field': ('<!-- <marc:datafield tag="075"><marc:subfield code="a">o</marc:subfield></marc:datafield> -->', False),
+          'another prefix': ('<m:datafield xmlns:m="http://www.loc.gov/MARC21/slim" tag="075"><m:subfield code="a">p</m:subfield></m:datafield>', False)
+        }
+        for description, (content, rejected) in cases.items():
+            with self.subTest(record=description):
+                self.assertEqual(preFilter.rejects(record.format(content).encode('utf-8')), rejected)
+
+    # -------------------------------------------------------------------------
+    def test_unsupported_filter_parses_all_records(self):
+        with open('test/resources/marcConfig.json', 'r') as configFile:
+            config = json.load(configFile)
+        config['recordFilter']['expression'] = './marc:datafield[@tag="075"]/marc:subfield[@code="a" or @code="b"]'
+        config['execution']['extractionEngine'] = 'lxml'
+        config['execution']['bytePreFilter'] = True
+        configFilename = os.path.join(self.tempDir, 'config.json')
+        with open(configFilename, 'w') as configFile:
+            json.dump(config, configFile)
+        with self.assertLogs('XML_TO_CSV.utils', level='WARNING') as logs:
+            _, report = helpers.runMainWithProfile(self.tempDir, 'unsupported', ['test/resources/marc-records.xml'], configFilename=configFilename)
+        self.assertTrue(any('byte pre-filter cannot be used' in message for message in logs.output), msg='No warning about the unsupported filter')
+        self.assertNotIn('preFilteredRecordCounter', report['counters'])
+
+
+class TestRecordManifest(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempDir)
+        self.configFilename = 'test/resources/marcConfig.json'
+
+        # the records of the previous run, one per line
+        self.previousFilename = os.path.join(self.tempDir, 'previous.xml')
+        generate_marc.generateMARCFile(self.previousFilename, 30, seed=7)
+        with open(self.previousFilename, 'r', encoding='utf-8') as inputFile:
+            self.lines = inputFile.readlines()
+
+    # -------------------------------------------------------------------------
+    def _run_main(self, name, inputFilename, workers=1, **kwargs):
+        """Runs xml_to_csv and returns the identifiers in the main output and the counters."""
+        output, report = helpers.runMainWithProfile(self.tempDir, name, [inputFilename], configFilename=self.configFilename, workers=workers, **kwargs)
+        recordIDs = [row['autID'] for row in csv.DictReader(io.StringIO(output['output.csv'].decode('utf-8')))]
+        return recordIDs, report['counters']
+
+    # -------------------------------------------------------------------------
+    def test_only_changed_records_are_extracted(self):
+        manifestFilename = os.path.join(self.tempDir, 'manifest')
+        previousIDs, counters = self._run_main('previous', self.previousFilename, manifest=manifestFilename)
+        self.assertEqual(counters['unchangedRecordCounter'], 0, msg='Without previous manifest all records should be extracted')
+        changedID, deletedID = previousIDs[0], previousIDs[1]
+
+        # a record is changed, one is deleted and a new one is added
+        lines = [line.replace('</marc:record>', '<marc:datafield tag="400"><marc:subfield code="a">Changed</marc:subfield></marc:datafield></marc:record>')
+                 if f'tag="001">{changedID}<' in line else line
+                 for line in self.lines if f'tag="001">{deletedID}<' not in line]
+        lines.insert(-1, generate_marc.generateRecord(random.Random(1), 'new', personRatio=1.0) + '\n')
+        inputFilename = os.path.join(self.tempDir, 'input.xml')
+        with open(inputFilename, 'w', encoding='utf-8') as inputFile:
+            inputFile.writelines(lines)
+
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                deletedFilename = os.path.join(self.tempDir, f'deleted-{workers}.csv')
+                recordIDs, counters = self._run_main(f'delta-{workers}', inputFilename, workers=workers, previousManifest=manifestFilename, deletedIDs=deletedFilename)
+                self.assertEqual(recordIDs, [changedID, 'new'], msg='Only the changed and the new record should be extracted')
+                self.assertEqual(counters['unchangedRecordCounter'], 28, msg='All other records should be skipped')
+                with open(deletedFilename, 'r', encoding='utf-8') as deletedFile:
+                    self.assertEqual(list(csv.reader(deletedFile)), [['autID'], [deletedID]], msg='The deleted record should be listed')
+
+    # -------------------------------------------------------------------------
+    def test_changed_config_extracts_all_records(self):
+        manifestFilename = os.path.join(self.tempDir, 'manifest')
+        previousIDs, counters = self._run_main('previous', self.previousFilename, manifest=manifestFilename)
+
+        with open(self.configFilename, 'r') as configFile:
+            config = json.load(configFile)
+        config['dataFields'] = config['dataFields'][:1]
+        self.configFilename = os.path.join(self.tempDir, 'config.json')
+        with open(self.configFilename, 'w') as configFile:
+            json.dump(config, configFile)
+
+        with self.assertLogs('XML_TO_CSV.utils', level='WARNING') as logs:
+            recordIDs, counters = self._run_main('delta', self.previousFilename, previousManifest=manifestFilename)
+        self.assertTrue(any('config changed' in message for message in logs.output), msg='No warning about the changed config')
+        self.assertEqual(recordIDs, previousIDs, msg='All records should be extracted again')
+        self.assertEqual(counters['deletedRecordCounter'], 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.tempDir, 'delta', 'output-deleted.csv')), msg='The deleted identifiers should be stored next to the output by default')
+
+    # -------------------------------------------------------------------------
+    def test_manifest_requires_incremental_processing(self):
+        with self.assertRaises(SystemExit):
+            helpers.runMain(self.tempDir, 'refused', [self.previousFilename], self.configFilename, incremental=False, manifest=os.path.join(self.tempDir, 'manifest'))
+
+
+class TestBenchmarkGenerator(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    def test_generated_file_is_deterministic(self):
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        first, second = os.path.join(tempDir, 'first.xml'), os.path.join(tempDir, 'second.xml')
+        generate_marc.generateMARCFile(first, 20, seed=7)
+        generate_marc.generateMARCFile(second, 20, seed=7)
+        with open(first, 'rb') as firstFile, open(second, 'rb') as secondFile:
+            self.assertEqual(firstFile.read(), secondFile.read(), msg='The same seed should generate the same file')
+
+    # -------------------------------------------------------------------------
+    def test_generated_records_are_found(self):
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        filename = os.path.join(tempDir, 'records.xml')
+        generate_marc.generateMARCFile(filename, 25)
+        positions = utils.find_record_positions(filename, 'marc:record', chunkSize=512)
+        self.assertEqual(len(positions), 25, msg='Not all generated records were found')
 
 # -----------------------------------------------------------------------------
 def load_tests(loader, tests, ignore):
   tests.addTests(doctest.DocTestSuite(utils, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
+  tests.addTests(doctest.DocTestSuite(position_index, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
+  tests.addTests(doctest.DocTestSuite(xml_metrics, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
+  tests.addTests(doctest.DocTestSuite(byte_extractor, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
+  tests.addTests(doctest.DocTestSuite(sqlite_output, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
+  tests.addTests(doctest.DocTestSuite(record_manifest, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
+  tests.addTests(doctest.DocTestSuite(xml_to_csv, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
+  tests.addTests(doctest.DocTestSuite(run_benchmarks, optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS))
   return tests
 
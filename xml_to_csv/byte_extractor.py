@@ -0,0 +1,490 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import re
+import logging
+import lxml.etree as ET
+import xml_to_csv.utils as utils
+
+LOGGER_NAME = "XML_TO_CSV.utils"
+logger = logging.getLogger(LOGGER_NAME)
+
+# the extraction engines which can be chosen with extractionEngine in the execution section of the config
+EXTRACTION_ENGINES = ['lxml', 'bytes']
+
+# attributes of a start tag, XML does not allow < in attribute values
+ATTRIBUTES = rb'''(?:\s+[^\s=/<>"']+\s*=\s*(?:"[^"<]*"|'[^'<]*'))*\s*'''
+ATTRIBUTE = re.compile(r'''([^\s=/<>"']+)\s*=\s*(?:"([^"<]*)"|'([^'<]*)')''')
+NAME = rb'''[^\s=/<>"'!?]+'''
+PREFIX = rb'''[^\s=/<>"'!?:]+'''
+
+# child of a record: empty element, element with only text (and its end tag) or the start tag of an element with children
+CHILD = re.compile(rb'(\s*)<(' + NAME + rb')(' + ATTRIBUTES + rb')(?:(/)>|>([^<]*)</(' + NAME + rb')\s*>|>)')
+WHITESPACE = re.compile(rb'\s*')
+
+# raw characters and sequences which are not allowed in XML content, records containing them are left to lxml which reports them
+INVALID_CONTENT = re.compile(rb'[\x00-\x08\x0b\x0c\x0e-\x1f]|\]\]>')
+
+ENTITY = re.compile(r'&([^&;]*);|&')
+PREDEFINED_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+# -----------------------------------------------------------------------------
+class UnsupportedContent(Exception):
+  """Raised for XML content the byte extractor does not handle itself, such content is parsed with lxml instead."""
+
+# -----------------------------------------------------------------------------
+class ByteElement():
+  """Element of a record read by the ByteRecordExtractor. It provides the part of the lxml element interface
+     which is used to evaluate MarcExpression objects and to process the found values: tag in Clark notation, get, text, tail
+     and iteration over the children.
+  """
+
+  __slots__ = ('tag', 'attrib', 'text', 'tail', 'children')
+
+  def __init__(self, tag, attrib, text=None, children=()):
+    self.tag = tag
+    self.attrib = attrib
+    self.text = text
+    self.tail = None
+    self.children = children
+
+  def get(self, key, default=None):
+    return self.attrib.get(key, default)
+
+  def __iter__(self):
+    return iter(self.children)
+
+  def __len__(self):
+    return len(self.children)
+
+# -----------------------------------------------------------------------------
+def _replaceEntity(match):
+  name = match.group(1)
+  if name is None:
+    raise UnsupportedContent('& without entity')
+  if name in PREDEFINED_ENTITIES:
+    return PREDEFINED_ENTITIES[name]
+  try:
+    codepoint = int(name[2:], 16) if name.startswith('#x') else int(name[1:]) if name.startswith('#') else None
+  except ValueError:
+    codepoint = None
+  if codepoint is None or not (codepoint in (0x9, 0xA, 0xD) or 0x20 <= codepoint <= 0xD7FF or 0xE000 <= codepoint <= 0xFFFD or 0x10000 <= codepoint <= 0x10FFFF):
+    raise UnsupportedContent(f'entity &{name};')
+  return chr(codepoint)
+
+# -----------------------------------------------------------------------------
+def decodeText(raw):
+  """Returns the text of the given raw element content like lxml: line endings normalized, entities decoded and None if it is empty.
+     UnsupportedContent is raised for entities which are not predefined and for invalid UTF-8.
+
+  >>> decodeText(b'Ghent &amp; Gent &#233;&#x20AC;')
+  'Ghent & Gent é€'
+  >>> decodeText(b'a\\r\\nb') == 'a\\nb', decodeText(b'') is None
+  (True, True)
+  """
+  if not raw:
+    return None
+  try:
+    text = raw.decode('utf-8')
+  except UnicodeDecodeError as e:
+    raise UnsupportedContent(str(e))
+  if '\r' in text:
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+  if '&' in text:
+    text = ENTITY.sub(_replaceEntity, text)
+  return text
+
+# -----------------------------------------------------------------------------
+def decodeAttributes(raw):
+  """Returns a dictionary of the attributes in the given raw part of a start tag, values are normalized like by an XML parser.
+
+  >>> decodeAttributes(b' tag="100" ind1=\\' \\' code="a&#9;b\\tc"')
+  {'tag': '100', 'ind1': ' ', 'code': 'a\\tb c'}
+  """
+  attrib = {}
+  if raw:
+    try:
+      rawText = raw.decode('utf-8')
+    except UnicodeDecodeError as e:
+      raise UnsupportedContent(str(e))
+    for name, doubleQuoted, singleQuoted in ATTRIBUTE.findall(rawText):
+      value = doubleQuoted or singleQuoted
+      # whitespace characters are replaced before entities are decoded, hence &#9; stays a tab
+      if '\r' in value or '\n' in value or '\t' in value:
+        value = value.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ').replace('\t', ' ')
+      if '&' in value:
+        value = ENTITY.sub(_replaceEntity, value)
+      attrib[name] = value
+  return attrib
+
+# -----------------------------------------------------------------------------
+def getExtractionEngine(config):
+  """Returns the extraction engine configured with extractionEngine in the execution section of the config, lxml by default.
+
+  >>> getExtractionEngine({"execution": {"extractionEngine": "bytes"}})
+  'bytes'
+  >>> getExtractionEngine({})
+  'lxml'
+  """
+  engine = config["execution"].get("extractionEngine", "lxml") if "execution" in config else "lxml"
+  if engine not in EXTRACTION_ENGINES:
+    raise ValueError(f'Unknown extraction engine "{engine}", should be one of {EXTRACTION_ENGINES}')
+  return engine
+
+# -----------------------------------------------------------------------------
+def getUnsupportedReasons(config, plan):
+  """Returns why the records of the given config cannot be extracted with the ByteRecordExtractor, an empty list if they can.
+     The records have to be MARC slim records and all expressions of the given ExecutionPlan have to be MarcExpression objects.
+
+  >>> config = {"recordTag": "marc:record", "recordIDExpression": './marc:controlfield[@tag="001"]', "recordIDColumnName": "id", "dataFields": [{"columnName": "name", "expression": "./marc:datafield[@tag='100']/marc:subfield[@code='a' or @code='b']", "valueType": "text"}]}
+  >>> print(getUnsupportedReasons(config, utils.ExecutionPlan(config))[0])
+  expression not supported by the byte extractor: ./marc:datafield[@tag='100']/marc:subfield[@code='a' or @code='b']
+  """
+  reasons = []
+  recordTag = config.get('recordTag', '')
+  if ':' not in recordTag or utils.ALL_NS.get(recordTag.split(':')[0]) != utils.NS_MARCSLIM:
+    reasons.append(f'record tag "{recordTag}" is not in the MARC slim namespace')
+  if plan.marcIndexer is None:
+    reasons.append('marcFieldIndex is disabled')
+  for expression, compiledExpression in plan.expressions.items():
+    if not isinstance(compiledExpression, utils.MarcExpression):
+      reasons.append(f'expression not supported by the byte extractor: {expression}')
+  return reasons
+
+# the maximum number of distinct attribute sets (e.g. tag="100" ind1=" " ind2=" ") which are kept decoded
+ATTRIBUTE_CACHE_SIZE = 10000
+
+# -----------------------------------------------------------------------------
+class ByteRecordExtractor():
+  """Reads MARC slim records directly from the bytes of a batch, without building lxml trees.
+     A small tokenizer finds the controlfields, datafields and subfields of each record with regular expressions
+     and returns them as ByteElement objects, which can be processed with an ExecutionPlan whose expressions are MarcExpression objects.
+
+     Only the regular structure of MARC slim records is handled: the namespace is declared at the record element,
+     all children of the record use its prefix and contain only text, except datafields which contain only subfields.
+     Records with any other content (e.g. comments, CDATA sections, other entities or namespaces, malformed XML) are parsed with lxml,
+     as well as the rest of a batch if there is other content between the records, hence the output is the same as without this extractor.
+
+  >>> extractor = ByteRecordExtractor('{http://www.loc.gov/MARC21/slim}record')
+  >>> data = b'<marc:record xmlns:marc="http://www.loc.gov/MARC21/slim"><marc:controlfield tag="001">1</marc:controlfield><marc:datafield tag="100"><marc:subfield code="a">Lieber, Sven</marc:subfield></marc:datafield></marc:record>'
+  >>> [[(f.get('tag'), f.text, [s.text for s in f]) for f in record] for record in extractor.iter_records(data)]
+  [[('001', '1', []), ('100', None, ['Lieber, Sven'])]]
+  """
+
+  def __init__(self, tagName):
+    # Clark notation, e.g. {http://www.loc.gov/MARC21/slim}record
+    self.tagName = str(tagName)
+    self.namespace, self.localName = ET.QName(self.tagName).namespace, ET.QName(self.tagName).localname
+    self.recordStart = re.compile(rb'<(?:(' + PREFIX + rb'):)?' + re.escape(self.localName.encode('utf-8')) + rb'(' + ATTRIBUTES + rb')(/?)>')
+
+    # the datafield and subfield patterns depend on the prefix of the record, key: prefix
+    self.prefixPatterns = {}
+
+    # the same element names and attributes occur in every record, they are decoded once
+    # key: (prefix, element name), value: tag in Clark notation; key: raw attributes, value: dictionary
+    self.childTags = {}
+    self.childAttributes = {}
+
+  def _getPrefixPatterns(self, prefix):
+    if prefix not in self.prefixPatterns:
+      qualified = re.escape(prefix + b':') if prefix else b''
+      self.prefixPatterns[prefix] = (
+        re.compile(rb'(\s*)((?:<' + qualified + rb'subfield' + ATTRIBUTES + rb'(?:/>|>[^<]*</' + qualified + rb'subfield\s*>)\s*)*)</' + qualified + rb'datafield\s*>'),
+        re.compile(rb'<' + qualified + rb'subfield(' + ATTRIBUTES + rb')(?:/>|>([^<]*)</' + qualified + rb'subfield\s*>)'),
+        re.compile(rb'\s*</' + qualified + re.escape(self.localName.encode('utf-8')) + rb'\s*>'),
+        re.compile(rb'</' + qualified + re.escape(self.localName.encode('utf-8')) + rb'\s*>')
+      )
+    return self.prefixPatterns[prefix]
+
+  def _getNamespaces(self, prefix, attrib):
+    """Checks the namespace declarations of the record start tag, prefixed attributes have to be declared at the same element."""
+    namespaceAttribute = f'xmlns:{prefix}' if prefix else 'xmlns'
+    if attrib.get(namespaceAttribute) != self.namespace:
+      raise UnsupportedContent(f'record element without declaration of {self.namespace}')
+    for name in attrib:
+      attributePrefix = name.split(':')[0] if ':' in name else None
+      if attributePrefix not in (None, 'xmlns', 'xml') and f'xmlns:{attributePrefix}' not in attrib:
+        raise UnsupportedContent(f'attribute {name} with undeclared prefix')
+
+  def _getChildTag(self, prefix, name):
+    """Returns the tag in Clark notation of a child of a record with the given prefix, all children have to use the prefix of the record."""
+    key = (prefix, name)
+    if key not in self.childTags:
+      childPrefix = prefix + b':' if prefix else b''
+      if not name.startswith(childPrefix) or b':' in name[len(childPrefix):]:
+        raise UnsupportedContent(f'element {name} in another namespace')
+      self.childTags[key] = f'{{{self.namespace}}}{name[len(childPrefix):].decode("utf-8")}'
+    return self.childTags[key]
+
+  def _getChildAttributes(self, raw):
+    """Returns the decoded attributes of a child of a record, the returned dictionary is shared and must not be changed."""
+    attrib = self.childAttributes.get(raw)
+    if attrib is None:
+      attrib = decodeAttributes(raw)
+      for name in attrib:
+        if ':' in name and not name.startswith('xml:') or name == 'xmlns':
+          raise UnsupportedContent(f'attribute {name} of a record field')
+      if len(self.childAttributes) >= ATTRIBUTE_CACHE_SIZE:
+        self.childAttributes.clear()
+      self.childAttributes[raw] = attrib
+    return attrib
+
+  def _readRecord(self, data, start, end):
+    """Returns the record starting at start as ByteElement and the position after it."""
+    match = self.recordStart.match(data, start, end)
+    if match is None:
+      raise UnsupportedContent('record start tag')
+    prefix, rawAttributes, selfClosing = match.group(1) or b'', match.group(2), match.group(3)
+    attrib = decodeAttributes(rawAttributes)
+    self._getNamespaces(prefix.decode('utf-8'), attrib)
+    recordAttributes = {name: value for name, value in attrib.items() if name != 'xmlns' and not name.startswith('xmlns:')}
+    record = ByteElement(self.tagName, recordAttributes, children=[])
+    if selfClosing:
+      return record, match.end()
+
+    datafieldBody, subfieldPattern, recordEnd, _ = self._getPrefixPatterns(prefix)
+    getAttributes = self._getChildAttributes
+    children = record.children
+    position = match.end()
+    while True:
+      child = CHILD.match(data, position, end)
+      if child is None:
+        break
+      if not children:
+        record.text = decodeText(child.group(1))
+      name = child.group(2)
+      tag = self._getChildTag(prefix, name)
+      attrib = getAttributes(child.group(3))
+      position = child.end()
+
+      if child.group(4):
+        children.append(ByteElement(tag, attrib))
+      elif child.group(6) is not None:
+        if child.group(6) != name:
+          raise UnsupportedContent(f'end tag of element {name}')
+        children.append(ByteElement(tag, attrib, decodeText(child.group(5))))
+      elif tag == utils.MARC_DATAFIELD:
+        body = datafieldBody.match(data, position, end)
+        if body is None:
+          raise UnsupportedContent('content of a datafield')
+        subfields = [ByteElement(utils.MARC_SUBFIELD, getAttributes(rawAttributes), decodeText(rawText))
+                     for rawAttributes, rawText in subfieldPattern.findall(body.group(2))]
+        children.append(ByteElement(tag, attrib, decodeText(body.group(1)), subfields))
+        position = body.end()
+      else:
+        raise UnsupportedContent(f'content of element {name}')
+
+    recordEndMatch = recordEnd.match(data, position, end)
+    if recordEndMatch is None:
+      raise UnsupportedContent('content of the record')
+    return record, recordEndMatch.end()
+
+  def _parseRecord(self, data, start, end):
+    """Parses the record starting at start with lxml, for records with content which is not handled by the tokenizer.
+       Returns the record and the position after it.
+    """
+    match = self.recordStart.match(data, start, end)
+    if match is None:
+      raise UnsupportedContent('record start tag')
+    recordEnd = match.end()
+    if not match.group(3):
+      endTag = self._getPrefixPatterns(match.group(1) or b'')[3].search(data, recordEnd, end)
+      if endTag is None:
+        raise UnsupportedContent('record end tag')
+      recordEnd = endTag.end()
+
+    try:
+      collection = ET.fromstring(b'<collection>' + data[start:recordEnd] + b'</collection>')
+    except ET.XMLSyntaxError as e:
+      raise UnsupportedContent(str(e))
+    records = list(collection.iter(self.tagName))
+    if len(records) != 1 or records[0].getparent() is not collection:
+      raise UnsupportedContent('nested records')
+    return records[0], recordEnd
+
+  def iter_records(self, data, start=0, end=None, counters=None):
+    """Yields the records in the byte range start-end of the given bytes or memory-mapping.
+       A record which cannot be read by the tokenizer is parsed with lxml, if there is other content than records,
+       the rest of the range is parsed with lxml. Records parsed with lxml are counted as byteExtractorFallbackCounter in the given counters.
+    """
+    end = len(data) if end is None else end
+
+    # usually there are no invalid characters at all, hence the records are only checked one by one if there are some
+    hasInvalidContent = INVALID_CONTENT.search(data, start, end) is not None
+
+    position = WHITESPACE.match(data, start, end).end()
+    while position < end:
+      try:
+        record, recordEnd = self._readRecord(data, position, end)
+        if hasInvalidContent and INVALID_CONTENT.search(data, position, recordEnd):
+          raise UnsupportedContent('invalid characters')
+      except UnsupportedContent:
+        try:
+          record, recordEnd = self._parseRecord(data, position, end)
+        except UnsupportedContent as e:
+          logger.debug(f'parsing the rest of the batch with lxml from position {position}: {e}')
+          for lxmlRecord in utils.iter_parsed_records([data[position:end]], self.tagName):
+            if counters is not None:
+              counters['byteExtractorFallbackCounter'] = counters.get('byteExtractorFallbackCounter', 0) + 1
+            yield lxmlRecord
+          return
+        if counters is not None:
+          counters['byteExtractorFallbackCounter'] = counters.get('byteExtractorFallbackCounter', 0) + 1
+      yield record
+      position = WHITESPACE.match(data, recordEnd, end).end()
+
+# the conditions of a recordFilter which can be checked on the bytes of a record
+PRE_FILTER_CONDITIONS = ('equals', 'equal', 'startswith', 'exists', 'exist')
+
+# -----------------------------------------------------------------------------
+def isPreFilterEnabled(config):
+  """Returns True if the records should be checked with a BytePreFilter before they are parsed, see bytePreFilter in the execution section of the config.
+
+  >>> isPreFilterEnabled({"execution": {"bytePreFilter": "true"}}), isPreFilterEnabled({"execution": {"bytePreFilter": "false"}}), isPreFilterEnabled({})
+  (True, False, False)
+  """
+  return utils.getExecutionFlag(config, "bytePreFilter", False)
+
+# -----------------------------------------------------------------------------
+def getPreFilterUnsupportedReasons(config):
+  """Returns why the recordFilter of the given config cannot be checked with a BytePreFilter, an empty list if it can.
+     The records have to be MARC slim records and the filter expression has to select a controlfield or the subfields of a datafield,
+     with the condition exists also a datafield.
+
+  >>> config = {"recordTag": "marc:record", "recordFilter": {"expression": './marc:datafield[@tag="075"]', "condition": "equals", "value": "p"}}
+  >>> getPreFilterUnsupportedReasons(config)
+  ['filter condition "equals" is not supported for datafields']
+  """
+  reasons = []
+  recordTag = config.get('recordTag', '')
+  if ':' not in recordTag or utils.ALL_NS.get(recordTag.split(':')[0]) != utils.NS_MARCSLIM:
+    reasons.append(f'record tag "{recordTag}" is not in the MARC slim namespace')
+  if 'recordFilter' not in config:
+    reasons.append('no recordFilter')
+    return reasons
+
+  filterConfig = config['recordFilter']
+  expression = utils.compileMarcExpression(filterConfig['expression'], None)
+  condition = filterConfig['condition']
+  if expression is None or expression.shape not in ('controlfield', 'datafield', 'subfield'):
+    reasons.append(f'filter expression not supported by the byte pre-filter: {filterConfig["expression"]}')
+  elif condition not in PRE_FILTER_CONDITIONS:
+    reasons.append(f'filter condition "{condition}" is not supported')
+  elif expression.shape == 'datafield' and condition not in ('exists', 'exist'):
+    reasons.append(f'filter condition "{condition}" is not supported for datafields')
+  return reasons
+
+# -----------------------------------------------------------------------------
+class BytePreFilter():
+  """Checks the recordFilter of a config on the bytes of a single record, before the record is parsed.
+     rejects only returns True if passFilter would return False for the parsed record, i.e. if the record is filtered anyway.
+     If the result is not certain, e.g. because of comments, CDATA sections, character references or other namespaces in the record,
+     or if the filter would raise an exception (e.g. multiple values which do not all pass), the record is not rejected and passFilter decides.
+     Rejected records are not parsed at all, hence they are also not checked for well-formedness.
+
+  >>> preFilter = BytePreFilter('{http://www.loc.gov/MARC21/slim}record', {"expression": './marc:datafield[@tag="075"]/marc:subfield[@code="a"]', "condition": "equals", "value": "p"})
+  >>> record = '<m:record xmlns:m="http://www.loc.gov/MARC21/slim"><m:datafield tag="075" ind1=" "><m:subfield code="a">{}</m:subfield></m:datafield></m:record>'
+  >>> [preFilter.rejects(record.format(value).encode('utf-8')) for value in ['o', 'p', '<!-- o -->o']]
+  [True, False, False]
+  """
+
+  def __init__(self, tagName, filterConfig):
+    self.extractor = ByteRecordExtractor(tagName)
+    expression = utils.compileMarcExpression(filterConfig['expression'], None)
+    self.shape = expression.shape
+    self.tag = expression.tag.encode('utf-8')
+    self.code = expression.code
+    self.condition = filterConfig['condition']
+    self.value = filterConfig.get('value')
+
+    # markers of content whose meaning is only clear after parsing the record, e.g. a commented out field
+    self.ambiguousContent = (b'<!', b'<?', b'&#', b'xmlns')
+
+    # the pattern of the start tag of the selected field depends on the prefix of the record, key: prefix
+    self.fieldPatterns = {}
+
+    # the start tags of the records are usually all the same, key: (prefix, raw attributes), value: True if the record can be checked
+    self.recordStartTags = {}
+
+  def _getFieldPattern(self, prefix):
+    if prefix not in self.fieldPatterns:
+      qualified = re.escape(prefix + b':') if prefix else b''
+      name = b'controlfield' if self.shape == 'controlfield' else b'datafield'
+      # the tag attribute can be preceded and followed by other attributes
+      self.fieldPatterns[prefix] = re.compile(rb'<' + qualified + name
+        + rb'''(?:\s+[^\s=/<>"']+\s*=\s*(?:"[^"<]*"|'[^'<]*'))*?\s+tag\s*=\s*(["'])''' + re.escape(self.tag) + rb'\1' + ATTRIBUTES
+        + rb'(?:(/)>|>([^<]*)</' + qualified + name + rb'\s*>|>)')
+    return self.fieldPatterns[prefix]
+
+  def _isCheckable(self, prefix, rawAttributes):
+    """Returns True if the fields with the prefix of the record are the only ones in the MARC slim namespace."""
+    key = (prefix, rawAttributes)
+    if key not in self.recordStartTags:
+      try:
+        attrib = decodeAttributes(rawAttributes)
+        self.extractor._getNamespaces(prefix.decode('utf-8'), attrib)
+        recordNamespace = f'xmlns:{prefix.decode("utf-8")}' if prefix else 'xmlns'
+        checkable = not any(value == self.extractor.namespace for name, value in attrib.items()
+                            if (name == 'xmlns' or name.startswith('xmlns:')) and name != recordNamespace)
+      except UnsupportedContent:
+        checkable = False
+      if len(self.recordStartTags) >= ATTRIBUTE_CACHE_SIZE:
+        self.recordStartTags.clear()
+      self.recordStartTags[key] = checkable
+    return self.recordStartTags[key]
+
+  def _getTexts(self, data, start, end, prefix):
+    """Returns the texts of the elements selected by the filter expression, like passFilter would find them in the parsed record."""
+    texts = []
+    datafieldBody, subfieldPattern, _, _ = self.extractor._getPrefixPatterns(prefix)
+    for field in self._getFieldPattern(prefix).finditer(data, start, end):
+      selfClosing, rawText = field.group(2), field.group(3)
+      if self.shape == 'controlfield':
+        if not selfClosing and rawText is None:
+          raise UnsupportedContent('content of a controlfield')
+        texts.append(decodeText(rawText))
+      elif self.shape == 'datafield':
+        texts.append(None)
+      elif not selfClosing:
+        if rawText is not None:
+          # only whitespace, no subfields
+          continue
+        body = datafieldBody.match(data, field.end(), end)
+        if body is None:
+          raise UnsupportedContent('content of a datafield')
+        for rawAttributes, rawSubfieldText in subfieldPattern.findall(body.group(2)):
+          if self.extractor._getChildAttributes(rawAttributes).get('code') == self.code:
+            texts.append(decodeText(rawSubfieldText))
+    return texts
+
+  def rejects(self, data, start=0, end=None):
+    """Returns True if the record in the byte range start-end of the given bytes or memory-mapping certainly does not pass the filter."""
+    end = len(data) if end is None else end
+    match = self.extractor.recordStart.match(data, start, end)
+    if match is None or match.group(3):
+      return False
+
+    # the fields have to use the prefix of the record, namespaces declared inside the record are left to passFilter
+    prefix = match.group(1) or b''
+    if not self._isCheckable(prefix, match.group(2)):
+      return False
+    for marker in self.ambiguousContent:
+      if data.find(marker, match.end(), end) != -1:
+        return False
+    if self.extractor.recordStart.search(data, match.end(), end):
+      # nested records
+      return False
+
+    try:
+      texts = self._getTexts(data, match.end(), end, prefix)
+    except UnsupportedContent:
+      return False
+
+    # the same results as passFilter, the cases in which it raises an exception are left to it
+    if self.condition in ('exists', 'exist'):
+      return not texts
+    elif self.condition in ('equals', 'equal'):
+      return len(texts) == 1 and texts[0] != self.value
+    else:
+      return len(texts) > 0 and all(text is not None and not text.startswith(self.value) for text in texts)
@@ -0,0 +1,106 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import os
+import json
+import itertools
+import logging
+import xml_to_csv.position_index as position_index
+
+LOGGER_NAME = "XML_TO_CSV.utils"
+logger = logging.getLogger(LOGGER_NAME)
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+# -----------------------------------------------------------------------------
+def getCheckpointFilename(outputFilename):
+  """Returns the filename of the checkpoint which belongs to the given main output file.
+
+  >>> getCheckpointFilename('my-data.csv')
+  'my-data.csv.checkpoint'
+  """
+  return outputFilename + CHECKPOINT_SUFFIX
+
+# -----------------------------------------------------------------------------
+class Checkpoint():
+  """Durable progress of an incremental run.
+     After each fully written batch the output files are flushed and their lengths are stored,
+     together with the position in the input, the counters and the fingerprints of the input files, in a JSON file next to the main output file.
+  """
+
+  def __init__(self, filename, inputFilenames, outputFiles):
+    self.filename = filename
+    self.inputFilenames = list(inputFilenames)
+    self.inputFingerprints = [position_index.getFileFingerprint(inputFilename) for inputFilename in self.inputFilenames]
+
+    # key: filename, value: file handle of an output file
+    self.outputFiles = outputFiles
+
+  def save(self, config, fileIndex, byteOffset):
+    """Stores that everything of the input file with index fileIndex up to byteOffset is written to the output files."""
+
+    # the stored lengths are only valid if the written bytes survive a crash of the machine, hence fsync
+    outputLengths = {}
+    for outputFilename, outputFile in self.outputFiles.items():
+      outputFile.flush()
+      os.fsync(outputFile.fileno())
+      outputLengths[outputFilename] = os.fstat(outputFile.fileno()).st_size
+
+    state = {
+      'inputFilenames': self.inputFilenames,
+      'inputFingerprints': self.inputFingerprints,
+      'fileIndex': fileIndex,
+      'byteOffset': byteOffset,
+      'lastBatch': config['counters']['batchCounter'],
+      'counters': config['counters'],
+      'outputs': outputLengths
+    }
+
+    # write to a temporary file first, such that the previous checkpoint stays valid if the run dies while writing
+    tmpFilename = self.filename + '.tmp'
+    with open(tmpFilename, 'w') as checkpointFile:
+      json.dump(state, checkpointFile)
+      checkpointFile.flush()
+      os.fsync(checkpointFile.fileno())
+    os.replace(tmpFilename, self.filename)
+
+  def remove(self):
+    """Removes the checkpoint after a successful run."""
+    if os.path.isfile(self.filename):
+      os.remove(self.filename)
+
+# -----------------------------------------------------------------------------
+def loadCheckpoint(filename, inputFilenames):
+  """Returns the state stored by Checkpoint.save, an exception is raised if it cannot be used to resume the given input files."""
+
+  if not os.path.isfile(filename):
+    raise FileNotFoundError(f'No checkpoint "{filename}" found to resume from')
+
+  with open(filename, 'r') as checkpointFile:
+    state = json.load(checkpointFile)
+
+  if state['inputFilenames'] != list(inputFilenames):
+    raise ValueError(f'The checkpoint "{filename}" was created for other input files: {state["inputFilenames"]}')
+
+  # the byte offsets of the checkpoint are only valid for the same content of the input files
+  storedFingerprints = state.get('inputFingerprints', [])
+  for inputFilename, storedFingerprint in itertools.zip_longest(inputFilenames, storedFingerprints):
+    if storedFingerprint is None or position_index.getFileFingerprint(inputFilename) != storedFingerprint:
+      raise ValueError(f'The input file "{inputFilename}" changed since the checkpoint "{filename}" was created')
+
+  return state
+
+# -----------------------------------------------------------------------------
+def truncateOutputs(state):
+  """Truncates the output files to the lengths they had when the checkpoint was saved,
+     such that rows written after the last checkpointed batch are removed.
+     An exception is raised if an output file is shorter than stored, because then rows of checkpointed batches are missing.
+  """
+  for outputFilename, length in state['outputs'].items():
+    if not os.path.isfile(outputFilename):
+      raise FileNotFoundError(f'Output file "{outputFilename}" of the checkpoint not found')
+    if os.path.getsize(outputFilename) < length:
+      raise ValueError(f'Output file "{outputFilename}" is shorter than the {length} bytes stored in the checkpoint')
+    with open(outputFilename, 'r+b') as outputFile:
+      outputFile.truncate(length)
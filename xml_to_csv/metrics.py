@@ -0,0 +1,196 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import os
+import json
+import time
+from tqdm import tqdm
+
+# -----------------------------------------------------------------------------
+def getMetricsInterval(config):
+  """Returns after how many seconds the metrics of a run are reported again,
+     it can be configured with metricsInterval in the execution section of the config.
+
+  >>> getMetricsInterval({"execution": {"metricsInterval": 10}})
+  10.0
+  >>> getMetricsInterval({})
+  1.0
+  """
+  return float(config["execution"]["metricsInterval"]) if "execution" in config and "metricsInterval" in config["execution"] else 1.0
+
+# -----------------------------------------------------------------------------
+def getFilePositionFunction(file):
+  """Returns a function which returns the position in the operating system file under the given file object.
+     For compressed files this is the position in the compressed file, hence it can be compared with the file size.
+  """
+  fileDescriptor = file.fileno()
+  return lambda: os.lseek(fileDescriptor, 0, os.SEEK_CUR)
+
+# -----------------------------------------------------------------------------
+def formatDuration(seconds):
+  """Returns the given number of seconds as h:mm:ss, or ? if it is unknown.
+
+  >>> formatDuration(3725.2)
+  '1:02:05'
+  >>> formatDuration(None)
+  '?'
+  """
+  if seconds is None:
+    return '?'
+  minutes, seconds = divmod(int(seconds), 60)
+  hours, minutes = divmod(minutes, 60)
+  return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+# -----------------------------------------------------------------------------
+def getPrometheusText(metrics):
+  """Returns the given metrics in the Prometheus text format, e.g. for the textfile collector of the node exporter.
+     The values of the nested counters dictionary are written as gauges of their own.
+
+  >>> print(getPrometheusText({'records': 10, 'recordsPerSecond': 2.5, 'etaSeconds': None, 'state': 'running', 'counters': {'dateCacheHits': 7}}))
+  # TYPE xml_to_csv_records gauge
+  xml_to_csv_records 10
+  # TYPE xml_to_csv_records_per_second gauge
+  xml_to_csv_records_per_second 2.5
+  # TYPE xml_to_csv_date_cache_hits gauge
+  xml_to_csv_date_cache_hits 7
+  # TYPE xml_to_csv_finished gauge
+  xml_to_csv_finished 0
+  """
+  values = [(name, value) for name, value in metrics.items() if name != 'counters']
+  values.extend(metrics.get('counters', {}).items())
+
+  lines = []
+  for name, value in values:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+      metricName = 'xml_to_csv_' + ''.join(f'_{c.lower()}' if c.isupper() else c for c in name)
+      lines.append(f'# TYPE {metricName} gauge')
+      lines.append(f'{metricName} {value}')
+  lines.append('# TYPE xml_to_csv_finished gauge')
+  lines.append(f'xml_to_csv_finished {1 if metrics["state"] == "finished" else 0}')
+  return '\n'.join(lines)
+
+# -----------------------------------------------------------------------------
+class MetricsReporter():
+  """Reports the progress of a run at most once per interval seconds: records/s, MB/s, ETA, the pass rate of the record filter
+     and the hits and misses of the date cache.
+     The total is the size of the input files. The processed bytes of the current input file are either returned by the
+     positionFunction given to startFile or set with setFilePosition, completed input files are counted completely.
+     The metrics are shown after a progress bar and, if statusFilename is given, written to a JSON status file
+     (or a Prometheus textfile if statusFilename ends with .prom) which can be read during the run.
+  """
+
+  def __init__(self, config, fileSizes, interval=1.0, statusFilename=None, progress=True):
+    self.config = config
+    self.hasFilter = 'recordFilter' in config
+    self.fileSizes = list(fileSizes)
+    self.totalBytes = sum(self.fileSizes)
+    self.interval = interval
+    self.statusFilename = statusFilename
+
+    self.startTime = time.monotonic()
+    self.lastReport = None
+    self.state = 'running'
+
+    # a resumed run already processed some records and bytes, they do not count for the rates
+    self.startRecords = self._getCounter('recordCounter')
+    self.startBytes = None
+
+    self.completedBytes = 0
+    self.filePosition = 0
+    self.positionFunction = None
+
+    self.pbar = tqdm(total=self.totalBytes, unit='B', unit_scale=True, unit_divisor=1024, position=0, disable=not progress,
+                     desc='##### xml_to_csv #####', bar_format='{desc} {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}{postfix}]')
+
+  def _getCounter(self, name):
+    return self.config['counters'].get(name, 0)
+
+  def startFile(self, fileIndex, positionFunction=None, position=0):
+    """Continues with the input file with the given index, the files before it are completed.
+       If given, positionFunction returns how many bytes of this file are processed, otherwise setFilePosition is used.
+    """
+    self.completedBytes = sum(self.fileSizes[:fileIndex])
+    self.positionFunction = positionFunction
+    self.filePosition = position
+    if self.startBytes is None:
+      self.startBytes = self.completedBytes + position
+
+  def setFilePosition(self, position):
+    """Sets how many bytes of the current input file are processed."""
+    self.filePosition = position
+
+  def getProcessedBytes(self):
+    position = self.positionFunction() if self.positionFunction is not None else self.filePosition
+    return min(self.completedBytes + position, self.totalBytes)
+
+  def getMetrics(self):
+    """Returns the current metrics as dictionary."""
+    elapsed = time.monotonic() - self.startTime
+    records = self._getCounter('recordCounter')
+    processedBytes = self.getProcessedBytes()
+    runBytes = processedBytes - (self.startBytes if self.startBytes is not None else 0)
+    bytesPerSecond = runBytes / elapsed if elapsed > 0 else 0.0
+
+    etaSeconds = None
+    if self.state == 'finished':
+      etaSeconds = 0.0
+    elif bytesPerSecond > 0:
+      etaSeconds = round((self.totalBytes - processedBytes) / bytesPerSecond, 1)
+
+    metrics = {
+      'state': self.state,
+      'elapsedSeconds': round(elapsed, 1),
+      'files': self._getCounter('fileCounter'),
+      'batches': self._getCounter('batchCounter'),
+      'records': records,
+      'recordsPerSecond': round((records - self.startRecords) / elapsed, 1) if elapsed > 0 else 0.0,
+      'processedBytes': processedBytes,
+      'totalBytes': self.totalBytes,
+      'megabytesPerSecond': round(bytesPerSecond / (1024*1024), 3),
+      'etaSeconds': etaSeconds
+    }
+    if self.hasFilter:
+      passedFilter = records - self._getCounter('filteredRecordCounter')
+      metrics['passedFilter'] = passedFilter
+      metrics['filterPassRate'] = round(passedFilter / records, 4) if records > 0 else None
+    metrics['counters'] = dict(self.config['counters'])
+    return metrics
+
+  def update(self, force=False):
+    """Reports the metrics if the last report is at least interval seconds ago, hence it can be called often."""
+    now = time.monotonic()
+    if not force and self.lastReport is not None and now - self.lastReport < self.interval:
+      return
+    self.lastReport = now
+
+    metrics = self.getMetrics()
+    message = f'records: {metrics["records"]}; {metrics["recordsPerSecond"]} records/s; {metrics["megabytesPerSecond"]} MB/s; ETA {formatDuration(metrics["etaSeconds"])}'
+    if self.hasFilter and metrics['filterPassRate'] is not None:
+      message = f'{message}; passed filter: {metrics["filterPassRate"]:.1%}'
+    if 'dateCacheHits' in metrics['counters']:
+      message = f'{message}; date cache hits: {metrics["counters"]["dateCacheHits"]}; date cache misses: {metrics["counters"]["dateCacheMisses"]}'
+    self.pbar.update(metrics['processedBytes'] - self.pbar.n)
+    self.pbar.set_postfix_str(message)
+
+    if self.statusFilename:
+      self.writeStatus(metrics)
+
+  def writeStatus(self, metrics):
+    """Writes the metrics to the status file, a reader never sees a partially written file."""
+    tmpFilename = self.statusFilename + '.tmp'
+    with open(tmpFilename, 'w') as statusFile:
+      if self.statusFilename.endswith('.prom'):
+        statusFile.write(getPrometheusText(metrics) + '\n')
+      else:
+        json.dump(metrics, statusFile, indent=2)
+    os.replace(tmpFilename, self.statusFilename)
+
+  def finish(self):
+    """Reports the final metrics and closes the progress bar."""
+    self.state = 'finished'
+    self.completedBytes = self.totalBytes
+    self.positionFunction = None
+    self.filePosition = 0
+    self.update(force=True)
+    self.pbar.close()
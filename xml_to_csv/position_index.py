@@ -0,0 +1,131 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import os
+import sys
+import json
+import hashlib
+import logging
+import xml_to_csv.utils as utils
+
+LOGGER_NAME = "XML_TO_CSV.utils"
+logger = logging.getLogger(LOGGER_NAME)
+
+INDEX_MAGIC = b'XML_TO_CSV_POSITIONS 1\n'
+INDEX_SUFFIX = '.positions'
+
+# number of bytes read at once to hash the input file
+FINGERPRINT_CHUNK_SIZE = 1024*1024
+
+# -----------------------------------------------------------------------------
+def getIndexFilename(inputFilename, indexDir=None):
+  """Returns the filename of the position index for the given input file.
+     Without indexDir the index is a sidecar file next to the input file,
+     otherwise it is stored in indexDir with a name that also depends on the full path of the input file.
+
+  >>> getIndexFilename('data/input.xml')
+  'data/input.xml.positions'
+  >>> getIndexFilename('data/input.xml', 'cache').startswith(os.path.join('cache', 'input.xml-'))
+  True
+  """
+  if indexDir is None:
+    return inputFilename + INDEX_SUFFIX
+  else:
+    pathHash = hashlib.sha1(os.path.abspath(inputFilename).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(indexDir, f'{os.path.basename(inputFilename)}-{pathHash}{INDEX_SUFFIX}')
+
+# -----------------------------------------------------------------------------
+def getFileFingerprint(filename):
+  """Returns a dictionary with size, modification time and a content hash of the given file.
+     The hash is computed over the whole file, hence a changed byte is also detected if size and modification time are the same.
+     This reads the file once more, which is still faster than finding the record positions again.
+  """
+  stat = os.stat(filename)
+  contentHash = hashlib.sha256()
+  with open(filename, 'rb') as inputFile:
+    for chunk in iter(lambda: inputFile.read(FINGERPRINT_CHUNK_SIZE), b''):
+      contentHash.update(chunk)
+
+  return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': contentHash.hexdigest()}
+
+# -----------------------------------------------------------------------------
+def writePositionIndex(indexFilename, positions, fingerprint, tagName):
+  """Stores the given RecordPositions together with the fingerprint of the input file."""
+
+  header = dict(fingerprint)
+  header.update({'tagName': tagName, 'count': len(positions), 'byteorder': sys.byteorder})
+
+  # write to a temporary file first, such that an interrupted run does not leave a broken index
+  tmpFilename = indexFilename + '.tmp'
+  with open(tmpFilename, 'wb') as indexFile:
+    indexFile.write(INDEX_MAGIC)
+    indexFile.write(json.dumps(header).encode('utf-8') + b'\n')
+    positions.starts.tofile(indexFile)
+    positions.ends.tofile(indexFile)
+  os.replace(tmpFilename, indexFilename)
+
+# -----------------------------------------------------------------------------
+def readPositionIndex(indexFilename, fingerprint, tagName):
+  """Returns the RecordPositions stored in the given index file,
+     or None if there is no index or if it does not belong to the given fingerprint and tag name.
+  """
+  if not os.path.isfile(indexFilename):
+    return None
+
+  with open(indexFilename, 'rb') as indexFile:
+    if indexFile.readline() != INDEX_MAGIC:
+      return None
+    header = json.loads(indexFile.readline())
+
+    for key, value in fingerprint.items():
+      if header.get(key) != value:
+        return None
+    if header.get('tagName') != tagName:
+      return None
+
+    positions = utils.RecordPositions()
+    positions.starts.fromfile(indexFile, header['count'])
+    positions.ends.fromfile(indexFile, header['count'])
+    if header['byteorder'] != sys.byteorder:
+      positions.starts.byteswap()
+      positions.ends.byteswap()
+
+  return positions
+
+# -----------------------------------------------------------------------------
+def iter_indexed_record_positions(filename, tagName, chunkSize=1024*1024, indexDir=None, startPosition=0):
+  """Same as utils.iter_record_positions, but the positions are read from the position index of the file if it is still valid.
+     Otherwise the file is scanned and the found positions are stored in the index once all of them were consumed.
+  """
+  indexFilename = getIndexFilename(filename, indexDir)
+  fingerprint = getFileFingerprint(filename)
+
+  try:
+    positions = readPositionIndex(indexFilename, fingerprint, tagName)
+  except (OSError, ValueError, EOFError) as e:
+    logger.warning(f'could not read position index "{indexFilename}", the input file is scanned again: {e}')
+    positions = None
+
+  if positions is not None:
+    logger.info(f'using {len(positions)} record positions from index "{indexFilename}"')
+    for start, end in positions:
+      if start >= startPosition:
+        yield (start, end)
+    return
+
+  if startPosition > 0:
+    # only a part of the file is scanned, this cannot be stored as index
+    yield from utils.iter_record_positions(filename, tagName, chunkSize, startPosition)
+    return
+
+  positions = utils.RecordPositions()
+  for start, end in utils.iter_record_positions(filename, tagName, chunkSize):
+    positions.append(start, end)
+    yield (start, end)
+
+  try:
+    writePositionIndex(indexFilename, positions, fingerprint, tagName)
+    logger.info(f'stored {len(positions)} record positions in index "{indexFilename}"')
+  except OSError as e:
+    logger.warning(f'could not store position index "{indexFilename}": {e}')
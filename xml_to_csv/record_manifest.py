@@ -0,0 +1,161 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import os
+import csv
+import json
+import hashlib
+import itertools
+import logging
+import xml_to_csv.utils as utils
+
+LOGGER_NAME = "XML_TO_CSV.utils"
+logger = logging.getLogger(LOGGER_NAME)
+
+MANIFEST_MAGIC = 'XML_TO_CSV_MANIFEST 1\n'
+
+# size in bytes of the hash of a record, collisions of different records are negligible with 128 bits
+DIGEST_SIZE = 16
+
+# -----------------------------------------------------------------------------
+def getDeletedIDsFilename(outputFilename):
+  """Returns the filename of the CSV file with the identifiers of the deleted records which belongs to the given main output.
+
+  >>> getDeletedIDsFilename('output/persons.csv.gz')
+  'output/persons-deleted.csv'
+  >>> getDeletedIDsFilename('persons.sqlite')
+  'persons-deleted.csv'
+  """
+  compression = utils.getCompressionExtension(outputFilename)
+  basename = outputFilename[:-len(compression)] if compression else outputFilename
+  return os.path.splitext(basename)[0] + '-deleted.csv'
+
+# -----------------------------------------------------------------------------
+def getConfigHash(config, dateConfig):
+  """Returns a hash of everything of the config and the date config which changes the output,
+     the execution settings and the counters of a run are not part of it.
+
+  >>> getConfigHash({"recordTag": "record", "execution": {"recordBatchSize": 10}}, {}) == getConfigHash({"recordTag": "record"}, {})
+  True
+  """
+  relevant = {key: value for key, value in config.items() if key not in ('execution', 'counters')}
+  return hashlib.sha256(json.dumps([relevant, dateConfig], sort_keys=True).encode('utf-8')).hexdigest()
+
+# -----------------------------------------------------------------------------
+def getDigest(data, start, end):
+  """Returns the hash of the raw bytes of the record in the byte range start-end of the given bytes or memory-mapping."""
+  return hashlib.blake2b(data[start:end], digest_size=DIGEST_SIZE).digest()
+
+# -----------------------------------------------------------------------------
+def readManifest(filename):
+  """Returns the header, the entries and the untracked identifiers of the given manifest file.
+     The entries are a dictionary with the digest as key and the record identifier as value,
+     the untracked identifiers are the ones of records without digest (see RecordManifest).
+  """
+  entries = {}
+  untrackedIDs = []
+  with open(filename, 'r', encoding='utf-8', newline='') as manifestFile:
+    if manifestFile.readline() != MANIFEST_MAGIC:
+      raise ValueError(f'"{filename}" is not a record manifest')
+    header = json.loads(manifestFile.readline())
+    for digest, recordID in csv.reader(manifestFile):
+      if digest:
+        entries[bytes.fromhex(digest)] = recordID
+      else:
+        untrackedIDs.append(recordID)
+  return header, entries, untrackedIDs
+
+# -----------------------------------------------------------------------------
+class RecordManifest():
+  """Record identifiers and hashes of the raw bytes of the records of a run.
+     With the manifest of a previous run, records whose bytes did not change (keepUnchanged) are not extracted again,
+     the identifiers of the previous run which are not part of this run anymore are returned by getDeletedIDs.
+     Filtered records are part of the manifest with an empty identifier, such that they are also skipped if they did not change.
+     Records without digest, i.e. records which were not found by the position scan but parsed as part of a batch,
+     are extracted in every run, only their identifier is part of the manifest to find out if they were deleted.
+     The previous manifest is only used to skip records if it was created with the same config and date config.
+
+  >>> manifest = RecordManifest('config-hash')
+  >>> manifest.previousEntries = {b'a': '1', b'b': '2', b'c': ''}
+  >>> manifest.keepUnchanged(b'a'), manifest.keepUnchanged(b'x')
+  (True, False)
+  >>> manifest.add(b'x', '3')
+  >>> manifest.add(b'y', None)
+  >>> manifest.add(None, '4')
+  >>> manifest.getDeletedIDs(), sorted(manifest.entries.items()), list(manifest.untrackedIDs)
+  (['2'], [(b'a', '1'), (b'x', '3'), (b'y', '')], ['4'])
+  """
+
+  def __init__(self, configHash, previousFilename=None):
+    self.configHash = configHash
+
+    # key: digest of a record, value: its identifier, an empty string for filtered records
+    self.entries = {}
+    self.previousEntries = {}
+
+    # identifiers of the records without digest, a dictionary is used as ordered set
+    self.untrackedIDs = {}
+    self.previousUntrackedIDs = []
+
+    # identifiers of the records of this run, including the ones of records without a digest
+    self.recordIDs = set()
+
+    if previousFilename is not None:
+      header, self.previousEntries, self.previousUntrackedIDs = readManifest(previousFilename)
+      logger.info(f'read {len(self.previousEntries)} records from the manifest "{previousFilename}"')
+      if header.get('configHash') != configHash:
+        logger.warning(f'The config changed since the manifest "{previousFilename}" was created, all records are extracted')
+        self.skipUnchanged = False
+        return
+    self.skipUnchanged = True
+
+  def getDigest(self, data, start, end):
+    return getDigest(data, start, end)
+
+  def keepUnchanged(self, digest):
+    """Returns True if a record with the given digest was already part of the previous run, its entry is then kept for this run."""
+    if not self.skipUnchanged or digest not in self.previousEntries:
+      return False
+    recordID = self.previousEntries[digest]
+    self.entries[digest] = recordID
+    if recordID:
+      self.recordIDs.add(recordID)
+    return True
+
+  def add(self, digest, recordID):
+    """Adds an extracted record, recordID is None if the record was filtered and digest is None if the bytes of the record are unknown."""
+    if digest is not None:
+      self.entries[digest] = recordID if recordID is not None else ''
+    elif recordID is not None:
+      self.untrackedIDs[recordID] = None
+    if recordID is not None:
+      self.recordIDs.add(recordID)
+
+  def getDeletedIDs(self):
+    """Returns the identifiers of the previous run which are not part of this run, in the order of the previous manifest."""
+    previousIDs = itertools.chain(self.previousEntries.values(), self.previousUntrackedIDs)
+    deletedIDs = {recordID: None for recordID in previousIDs if recordID and recordID not in self.recordIDs}
+    return list(deletedIDs)
+
+  def write(self, filename):
+    """Stores the entries of this run, such that the file can be used as previous manifest of the next run."""
+
+    # write to a temporary file first, such that the previous manifest stays valid if the run dies while writing
+    # (the same file can be used as previous manifest and as manifest of a run)
+    tmpFilename = filename + '.tmp'
+    with open(tmpFilename, 'w', encoding='utf-8', newline='') as manifestFile:
+      manifestFile.write(MANIFEST_MAGIC)
+      manifestFile.write(json.dumps({'configHash': self.configHash, 'count': len(self.entries)}) + '\n')
+      writer = csv.writer(manifestFile)
+      writer.writerows((digest.hex(), recordID) for digest, recordID in self.entries.items())
+      writer.writerows(('', recordID) for recordID in self.untrackedIDs)
+    os.replace(tmpFilename, filename)
+
+# -----------------------------------------------------------------------------
+def writeDeletedIDs(filename, recordIDColumnName, deletedIDs):
+  """Stores the given identifiers of deleted records as CSV file with a single column."""
+  with open(filename, 'w', encoding='utf-8', newline='') as deletedFile:
+    writer = csv.writer(deletedFile)
+    writer.writerow([recordIDColumnName])
+    writer.writerows([recordID] for recordID in deletedIDs)
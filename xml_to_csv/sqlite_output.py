@@ -0,0 +1,152 @@
+#
+# (c) 2024 Sven Lieber
+# KBR Brussels
+#
+import os
+import sqlite3
+import logging
+import xml_to_csv.utils as utils
+
+LOGGER_NAME = "XML_TO_CSV.utils"
+logger = logging.getLogger(LOGGER_NAME)
+
+# output files with these extensions are SQLite databases instead of CSV files
+SQLITE_FILE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+# -----------------------------------------------------------------------------
+def isSQLiteFilename(filename):
+  """Returns True if the given output file is a SQLite database.
+
+  >>> isSQLiteFilename('my-data.sqlite'), isSQLiteFilename('my-data.csv')
+  (True, False)
+  """
+  return filename.endswith(SQLITE_FILE_EXTENSIONS)
+
+# -----------------------------------------------------------------------------
+def getMainTableName(filename):
+  """Returns the name of the table of the main output, i.e. the name of the database file without extension.
+
+  >>> getMainTableName('output/persons.sqlite')
+  'persons'
+  """
+  return os.path.splitext(os.path.basename(filename))[0]
+
+# -----------------------------------------------------------------------------
+def get1NTableName(prefix, columnName):
+  """Returns the name of the table of a 1:n output, the same name as the one of the 1:n output CSV file without extension.
+
+  >>> get1NTableName('persons', 'name')
+  'persons-name'
+  """
+  return f'{prefix}-{columnName}'
+
+# -----------------------------------------------------------------------------
+def quoteIdentifier(name):
+  """Returns the given table or column name as quoted SQL identifier.
+
+  >>> quoteIdentifier('birthDate-original')
+  '"birthDate-original"'
+  """
+  return '"' + name.replace('"', '""') + '"'
+
+# -----------------------------------------------------------------------------
+class _TableInserter():
+  """Inserts rows into a table with executemany, used instead of the csv.writer of a BatchedCSVWriter."""
+
+  def __init__(self, connection, table, fieldnames):
+    self.connection = connection
+    self.statement = f'INSERT INTO {quoteIdentifier(table)} VALUES ({", ".join("?" for f in fieldnames)})'
+
+  def writerows(self, rows):
+    self.connection.executemany(self.statement, rows)
+
+# -----------------------------------------------------------------------------
+class SQLiteTableWriter(utils.BatchedCSVWriter):
+  """Replacement for BatchedCSVWriter which inserts the rows into a table of a SQLite database,
+     the table is created by writeheader. Inserted rows are part of the transaction of the SQLiteOutput.
+  """
+
+  def __init__(self, output, table, fieldnames, maxRows=1000):
+    self.fieldnames = list(fieldnames)
+    self.table = table
+    self.output = output
+    self.writer = _TableInserter(output.connection, table, self.fieldnames)
+    self.maxRows = maxRows
+    self.rows = []
+    self.writerThread = None
+
+  def writeheader(self):
+    self.output.createTable(self.table, self.fieldnames)
+
+# -----------------------------------------------------------------------------
+class SQLiteOutput():
+  """SQLite database with a table for the main output and one table per 1:n output, instead of CSV files.
+     An existing database is replaced. The rows are inserted in one transaction per batch (see commit)
+     and the tables get an index on the record identifier column after all rows are inserted (see close).
+
+  >>> import tempfile
+  >>> filename = os.path.join(tempfile.mkdtemp(), 'out.sqlite')
+  >>> with SQLiteOutput(filename, 'id') as output:
+  ...   writer = output.getWriter('out', ['id', 'name'])
+  ...   writer.writeheader()
+  ...   writer.writerow({'id': '1', 'name': ['a', 'b']})
+  ...   writer.writetuple(('2', None))
+  ...   writer.flush()
+  ...   output.commit()
+  >>> sqlite3.connect(filename).execute('SELECT * FROM out').fetchall()
+  [('1', "['a', 'b']"), ('2', None)]
+  """
+
+  def __init__(self, filename, recordIDColumnName):
+    self.filename = filename
+    self.recordIDColumnName = recordIDColumnName
+    if os.path.exists(filename):
+      os.remove(filename)
+
+    # the rows may be inserted by an OutputWriterThread, it never runs at the same time as a commit
+    self.connection = sqlite3.connect(filename, check_same_thread=False)
+    self.tables = []
+
+  def createTable(self, table, fieldnames):
+    columns = ", ".join(f'{quoteIdentifier(f)} TEXT' for f in fieldnames)
+    self.connection.execute(f'CREATE TABLE {quoteIdentifier(table)} ({columns})')
+    self.tables.append(table)
+
+  def getWriter(self, table, fieldnames, maxRows=1000):
+    """Returns a SQLiteTableWriter for the given table."""
+    return SQLiteTableWriter(self, table, fieldnames, maxRows=maxRows)
+
+  def create1NOutputWriters(self, config, prefix):
+    """Returns a dictionary where each key is a column name and its value is a SQLiteTableWriter for its 1:n output,
+       like utils.create1NOutputWriters does for CSV files.
+    """
+    return {field["columnName"]: self.getWriter(get1NTableName(prefix, field["columnName"]), utils.get1NOutputFields(field, config["recordIDColumnName"]))
+            for field in config["dataFields"]}
+
+  def commit(self):
+    """Commits the rows inserted since the last commit, usually the rows of a batch."""
+    self.connection.commit()
+
+  def createIndexes(self):
+    """Creates an index on the record identifier column of each table,
+       after the rows are inserted, because updating the index while inserting is slower.
+    """
+    for table in self.tables:
+      self.connection.execute(f'CREATE INDEX {quoteIdentifier(table + "-" + self.recordIDColumnName)} ON {quoteIdentifier(table)} ({quoteIdentifier(self.recordIDColumnName)})')
+    self.connection.commit()
+
+  def close(self):
+    self.createIndexes()
+    self.connection.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      # the rows of the last complete batch are kept
+      self.connection.rollback()
+      self.connection.close()
+    return False
@@ -1,6 +1,10 @@
 from datetime import datetime
 import time
 import gc
+import sys
+import collections
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
 import lxml.etree as ET
 import unicodedata as ud
 import logging
@@ -9,6 +13,15 @@ from io import BytesIO
 import csv
 import os
 import re
+import shutil
+import gzip
+import bz2
+import lzma
+import queue
+import threading
+import calendar
+import mmap
+from array import array
 from . import csv_logger as csv_logger
 
 NS_MARCSLIM = 'http://www.loc.gov/MARC21/slim'
@@ -18,24 +31,80 @@ LOGGER_NAME = "XML_TO_CSV.utils"
 logger = logging.getLogger(LOGGER_NAME)
 
 # -----------------------------------------------------------------------------
-def updateProgressBar(pbar, config, updateFrequency):
-  """This function updates the given progress bar based on the given update frequency."""
+class RecordPositions():
+  """Compact list of (start, end) byte positions of records, stored in two arrays of 64 bit integers instead of a list of tuples.
+     Items are returned as (start, end) tuples, slices are returned as RecordPositions.
+
+  >>> positions = RecordPositions([(15, 60), (66, 111)])
+  >>> positions.append(117, 162)
+  >>> len(positions)
+  3
+  >>> positions[-1]
+  (117, 162)
+  >>> positions[1:].start, positions[1:].end
+  (66, 162)
+  >>> list(positions[:2])
+  [(15, 60), (66, 111)]
+  """
 
-  message = "##### xml_to_csv #####"
-  if "recordFilter" in config:
-    passedFilter = config['counters']['recordCounter'] - config['counters']['filteredRecordCounter']
-    pbar.set_description(f'{message} files: {config["counters"]["fileCounter"]}; batches: {config["counters"]["batchCounter"]}; records total: {config["counters"]["recordCounter"]}; passed filter: {passedFilter}; not passed filter: {config["counters"]["filteredRecordCounter"]}; could not apply filter: {config["counters"]["filteredRecordExceptionCounter"]}')
-  else:
-    pbar.set_description(f'{message} files: {config["counters"]["fileCounter"]}; batches: {config["counters"]["batchCounter"]}; records total: {config["counters"]["recordCounter"]}')
-  pbar.update(updateFrequency)
+  __slots__ = ('starts', 'ends')
+
+  def __init__(self, positions=None):
+    self.starts = array('q')
+    self.ends = array('q')
+    if positions is not None:
+      for start, end in positions:
+        self.append(start, end)
+
+  def append(self, start, end):
+    self.starts.append(start)
+    self.ends.append(end)
+
+  def __len__(self):
+    return len(self.starts)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      sliced = RecordPositions()
+      sliced.starts = self.starts[index]
+      sliced.ends = self.ends[index]
+      return sliced
+    return (self.starts[index], self.ends[index])
+
+  def __iter__(self):
+    return zip(self.starts, self.ends)
+
+  @property
+  def start(self):
+    """Start of the first record"""
+    return self.starts[0]
+
+  @property
+  def end(self):
+    """End of the last record"""
+    return self.ends[-1]
+
+# -----------------------------------------------------------------------------
+def iter_batches(positions, batchSize):
+  """Groups the given (start, end) tuples into RecordPositions batches of batchSize records.
+     positions can be a lazy iterator, such as iter_record_positions, batches are created while it is consumed.
+
+  >>> [list(b) for b in iter_batches(iter([(0, 5), (5, 10), (10, 15)]), 2)]
+  [[(0, 5), (5, 10)], [(10, 15)]]
+  """
+  batch = RecordPositions()
+  for start, end in positions:
+    batch.append(start, end)
+    if len(batch) >= batchSize:
+      yield batch
+      batch = RecordPositions()
+  if len(batch) > 0:
+    yield batch
 
 # -----------------------------------------------------------------------------
 def create_batches(positions, batch_size):
     """Splits the list of position tuples into batches."""
-    batches = []
-    for i in range(0, len(positions), batch_size):
-        batches.append(positions[i:i + batch_size])
-    return batches
+    return list(iter_batches(positions, batch_size))
 
 # -----------------------------------------------------------------------------
 def read_chunk(filename, start, end):
@@ -44,88 +113,851 @@ def read_chunk(filename, start, end):
         file.seek(start)
         return file.read(end - start)
 
+# the maximum number of bytes given to the XML parser at once
+PARSER_FEED_SIZE = 1024*1024
+
+# -----------------------------------------------------------------------------
+class MappedInputFile():
+  """Memory-mapped input file, opened once per input file instead of once per batch.
+     Byte ranges are read from the mapping in pieces of at most PARSER_FEED_SIZE bytes,
+     hence a batch is never copied as a whole into memory.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.file = open(filename, 'rb')
+    self.size = os.fstat(self.file.fileno()).st_size
+
+    # an empty file cannot be mapped, but it also does not contain records
+    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else None
+
+  def iter_chunks(self, start, end, chunkSize=None):
+    """Yields the bytes from start to end in pieces of at most chunkSize bytes."""
+    chunkSize = chunkSize if chunkSize else PARSER_FEED_SIZE
+    for offset in range(start, end, chunkSize):
+      yield self.map[offset:min(offset + chunkSize, end)]
+
+  def close(self):
+    if self.map is not None:
+      self.map.close()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+# compressed input files are decompressed while they are read, the file extension determines the compression
+COMPRESSED_FILE_OPENERS = {
+  '.gz': gzip.open,
+  '.bz2': bz2.open,
+  '.xz': lzma.open
+}
+
+# -----------------------------------------------------------------------------
+def isCompressedFile(filename):
+  """Returns True if the given file is compressed according to its extension.
+
+  >>> isCompressedFile('records.xml.gz')
+  True
+  >>> isCompressedFile('records.xml')
+  False
+  """
+  return os.path.splitext(filename)[1] in COMPRESSED_FILE_OPENERS
+
 # -----------------------------------------------------------------------------
-def fast_iter_batch(inputFilename, positions, func, tagName, pbar, config, dateConfig, monthMapping, updateFrequency=100, batchSize=100, *args, **kwargs):
+def openInputFile(filename):
+  """Opens the given input file for reading bytes, compressed files are decompressed while they are read."""
+  opener = COMPRESSED_FILE_OPENERS.get(os.path.splitext(filename)[1], open)
+  return opener(filename, 'rb')
+
+# -----------------------------------------------------------------------------
+class DecompressedInputFile():
+  """Compressed input file which is decompressed once while it is read, positions are offsets in the decompressed data.
+     It replaces MappedInputFile for compressed files: the record scanner reads the file with read
+     and the byte ranges of the batches are taken from the decompressed data which is still in memory.
+     Byte ranges have to be requested in increasing order, data before the end of a requested range is freed.
+     Hence no decompressed copy of the file is written, and at most the data of about one batch is kept in memory.
+  """
+
+  def __init__(self, filename, startPosition=0):
+    self.filename = filename
+    self.file = openInputFile(filename)
+
+    # decompressed data which was read but not yet requested, window[0] is the byte at offset windowStart
+    self.window = bytearray()
+    self.windowStart = 0
+    self.position = 0
+
+    # a resumed run does not need the data before startPosition, it is skipped without keeping it
+    while self.position < startPosition:
+      skipped = self.file.read(min(PARSER_FEED_SIZE, startPosition - self.position))
+      if not skipped:
+        break
+      self.position += len(skipped)
+    self.windowStart = self.position
+
+  def read(self, size):
+    """Reads and returns the next size bytes of decompressed data, they are kept until they are requested."""
+    chunk = self.file.read(size)
+    self.window += chunk
+    self.position += len(chunk)
+    return chunk
+
+  def iter_chunks(self, start, end, chunkSize=None):
+    """Yields the bytes from start to end in pieces of at most chunkSize bytes, afterwards the data up to end is freed."""
+    chunkSize = chunkSize if chunkSize else PARSER_FEED_SIZE
+    if start < self.windowStart:
+      raise ValueError(f'The byte range ({start},{end}) of "{self.filename}" was already freed')
+
+    # data which was not yet read by the record scanner is decompressed now
+    while self.position < end and self.read(PARSER_FEED_SIZE):
+      pass
+
+    for offset in range(start, end, chunkSize):
+      yield bytes(self.window[offset - self.windowStart:min(offset + chunkSize, end) - self.windowStart])
+    del self.window[:end - self.windowStart]
+    self.windowStart = end
+
+  def read_range(self, start, end):
+    """Returns the bytes from start to end as a whole."""
+    return b''.join(self.iter_chunks(start, end))
+
+  def close(self):
+    self.window = bytearray()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+# -----------------------------------------------------------------------------
+def iter_prefetched(iterable, depth):
+  """Iterates the given iterable on a background thread which stays up to depth items ahead of the consumer.
+     Hence reading the next items (e.g. from disk) overlaps with processing the current one.
+     Exceptions of the background thread are raised to the consumer.
+
+  >>> list(iter_prefetched(iter([1, 2, 3]), 2))
+  [1, 2, 3]
+  """
+  items = queue.Queue(maxsize=depth)
+  stopped = threading.Event()
+  end = object()
+
+  def put(entry):
+    # the consumer may stop early, hence the thread does not wait forever for free space
+    while not stopped.is_set():
+      try:
+        items.put(entry, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in iterable:
+        if not put((item, None)):
+          return
+      put((end, None))
+    except BaseException as e:
+      put((end, e))
+
+  thread = threading.Thread(target=produce, daemon=True)
+  thread.start()
+  try:
+    while True:
+      item, error = items.get()
+      if item is end:
+        if error is not None:
+          raise error
+        return
+      yield item
+  finally:
+    stopped.set()
+    thread.join()
+
+# -----------------------------------------------------------------------------
+class PrefetchingReader():
+  """Binary file object which reads the given file in chunks of chunkSize bytes on a background thread,
+     up to depth chunks ahead of the reader (e.g. iterparse), such that reading and parsing overlap.
+
+  >>> reader = PrefetchingReader(BytesIO(b'<c><r/></c>'), 2, chunkSize=4)
+  >>> [reader.read(3), reader.read(3), reader.read()]
+  [b'<c>', b'<', b'r/></c>']
+  """
+
+  def __init__(self, file, depth, chunkSize=None):
+    chunkSize = chunkSize if chunkSize else PARSER_FEED_SIZE
+    self.chunks = iter_prefetched(iter(lambda: file.read(chunkSize), b''), depth)
+    self.chunk = b''
+    self.offset = 0
+
+  def read(self, size=-1):
+    if size is None or size < 0:
+      data = b''.join([self.chunk[self.offset:], *self.chunks])
+      self.chunk = b''
+      self.offset = 0
+      return data
+
+    if self.offset >= len(self.chunk):
+      self.chunk = next(self.chunks, b'')
+      self.offset = 0
+    data = self.chunk[self.offset:self.offset + size]
+    self.offset += len(data)
+    return data
+
+  def close(self):
+    self.chunks.close()
+
+# -----------------------------------------------------------------------------
+def iter_parsed_records(chunks, tagName):
+  """Parses the concatenation of the given byte chunks, wrapped in a <collection> element, and yields the found records with name "tagName".
+     The chunks are fed to the parser one after the other, hence they never have to be concatenated.
+     Records are cleared once the consumer continues with the next record to save RAM.
+
+  >>> [r.findtext('id') for r in iter_parsed_records([b'<record><id>1</id></rec', b'ord><record><id>2</id></record>'], 'record')]
+  ['1', '2']
+  """
+
+  # only fire for end events and additionally only fire for tagName elements
+  parser = ET.XMLPullParser(events=('end',), tag=tagName)
+
+  # the synthetic wrapper is fed separately instead of concatenating it with the data
+  parser.feed(b'<collection>')
+  for chunk in itertools.chain(chunks, [None]):
+    if chunk is None:
+      parser.feed(b'</collection>')
+      parser.close()
+    else:
+      parser.feed(chunk)
+
+    for event, record in parser.read_events():
+      yield record
+
+      # clear to save RAM
+      record.clear()
+
+      # delete preceding siblings to save memory (https://lxml.de/3.2/parsing.html)
+      while record.getprevious() is not None:
+        del record.getparent()[0]
+
+# -----------------------------------------------------------------------------
+def iter_batch_records(inputFile, start, end, tagName, byteExtractor=None, counters=None):
+  """Parses the byte range start-end of the given MappedInputFile or DecompressedInputFile and yields the found records with name "tagName".
+     If a ByteRecordExtractor is given, it reads the records instead of lxml, directly from the memory-mapping of a MappedInputFile.
+  """
+  if byteExtractor is None:
+    return iter_parsed_records(inputFile.iter_chunks(start, end), tagName)
+  if isinstance(inputFile, MappedInputFile):
+    return byteExtractor.iter_records(inputFile.map, start, end, counters=counters)
+  return byteExtractor.iter_records(inputFile.read_range(start, end), counters=counters)
+
+# the content between records which is not parsed
+ONLY_WHITESPACE = re.compile(rb'\s*')
+
+# -----------------------------------------------------------------------------
+def getKeptRanges(data, offset, batch, counters, preFilter=None, manifest=None):
+  """Returns the byte ranges of the given batch (RecordPositions) which still have to be parsed, as tuples (start, end, digest).
+     data contains the bytes of the batch from the position offset on, e.g. the memory-mapping of the whole file with offset 0.
+     Records rejected by the given BytePreFilter are left out and counted like records filtered by processRecord.
+     With a RecordManifest, records which did not change since the previous run are left out as well and counted as unchangedRecordCounter,
+     digest is then the hash of the record in the range. Content between the records which is not only whitespace is kept as range without digest.
+
+  >>> class PreFilter():
+  ...   def rejects(self, data, start, end): return data[start:end] == b'<r>o</r>'
+  >>> data = b'<r>p</r> <r>o</r><r>o</r> <x/> <r>p</r>'
+  >>> counters = {'recordCounter': 0, 'filteredRecordCounter': 0, 'preFilteredRecordCounter': 0}
+  >>> ranges = getKeptRanges(data[8:], 8, RecordPositions([(9, 17), (17, 25), (31, 39)]), counters, preFilter=PreFilter())
+  >>> [data[start:end] for start, end, digest in ranges], counters['filteredRecordCounter']
+  ([b' <x/> ', b'<r>p</r>'], 2)
+  """
+  ranges = []
+  position = batch.start
+  for start, end in batch:
+    digest = manifest.getDigest(data, start - offset, end - offset) if manifest is not None else None
+    if digest is not None and manifest.keepUnchanged(digest):
+      counters['unchangedRecordCounter'] += 1
+      kept = False
+    elif preFilter is not None and preFilter.rejects(data, start - offset, end - offset):
+      counters['recordCounter'] += 1
+      counters['filteredRecordCounter'] += 1
+      counters['preFilteredRecordCounter'] += 1
+      if manifest is not None:
+        manifest.add(digest, None)
+      kept = False
+    else:
+      kept = True
+
+    if not ONLY_WHITESPACE.fullmatch(data, position - offset, start - offset):
+      ranges.append((position, start, None))
+    if kept:
+      ranges.append((start, end, digest))
+    position = end
+  if not ONLY_WHITESPACE.fullmatch(data, position - offset, batch.end - offset):
+    ranges.append((position, batch.end, None))
+  return ranges
+
+# -----------------------------------------------------------------------------
+def iter_ranges_records(data, offset, ranges, tagName, byteExtractor=None, counters=None):
+  """Yields the records with name "tagName" in the given byte ranges of data (see getKeptRanges), which contains the bytes from the position offset on,
+     together with the digest of their range. Only the first record found in a range gets its digest, further records get None
+     (a range with a digest contains a single record found by the position scan).
+     If a ByteRecordExtractor is given, it reads the records instead of lxml.
+
+  >>> data = b'<r>1</r> <x><r>2</r><r>3</r></x>'
+  >>> [(r.text, digest) for r, digest in iter_ranges_records(data, 0, [(0, 8, b'a'), (9, 33, b'b')], 'r')]
+  [('1', b'a'), ('2', b'b'), ('3', None)]
+  """
+  if byteExtractor is not None:
+    for start, end, digest in ranges:
+      for record in byteExtractor.iter_records(data, start - offset, end - offset, counters=counters):
+        yield (record, digest)
+        digest = None
+    return
+
+  # the ranges are parsed with a single parser, as if the batch would only consist of them
+  parser = ET.XMLPullParser(events=('end',), tag=tagName)
+  parser.feed(b'<collection>')
+  for start, end, digest in itertools.chain(ranges, [(None, None, None)]):
+    if start is None:
+      parser.feed(b'</collection>')
+      parser.close()
+    else:
+      parser.feed(data[start - offset:end - offset])
+
+    for event, record in parser.read_events():
+      yield (record, digest)
+      digest = None
+
+      # clear to save RAM, like iter_parsed_records
+      record.clear()
+      while record.getprevious() is not None:
+        del record.getparent()[0]
+
+# -----------------------------------------------------------------------------
+def getBatchBytes(inputFile, start, end):
+  """Returns the bytes containing the byte range start-end of the given MappedInputFile or DecompressedInputFile and the position at which they start."""
+  if isinstance(inputFile, MappedInputFile):
+    return inputFile.map, 0
+  return inputFile.read_range(start, end), start
+
+# -----------------------------------------------------------------------------
+def fast_iter_batch(inputFilename, positions, func, tagName, metrics, config, dateConfig, monthMapping, updateFrequency=100, batchSize=100, *args, onBatchEnd=None, stageTimer=None, inputFile=None, prefetch=0, byteExtractor=None, preFilter=None, manifest=None, **kwargs):
   """
   Adapted from http://stackoverflow.com/questions/12160418
 
   This function calls "func" for each parsed record with name "tagName".
-  All name parameters of this function are used to initialize and update a progress bar.
+  The given MetricsReporter is updated every updateFrequency records and reports the progress at most once per interval.
+  If given, onBatchEnd is called with the end position of each batch after all its records were processed.
+  If a StageTimer is given, the time of position scanning, parsing and record processing is measured.
+  If an inputFile is given (e.g. a DecompressedInputFile), the batches are read from it instead of from a memory-mapping of inputFilename.
+  With prefetch > 0 a reader thread finds the positions and reads the bytes of up to prefetch batches while the current batch is processed.
+  If a ByteRecordExtractor is given, it reads the records of the batches instead of lxml.
+  If a BytePreFilter is given, the records it rejects are counted as filtered without being parsed.
+  If a RecordManifest is given, records which did not change since the previous run are skipped and the extracted records are added to it,
+  in this case "func" has to return the identifier of the record or None if it was filtered.
   Other non-keyword arguments (args) and keyword arguments (kwargs) are provided to "func".
   """
 
   # disable automatic garbage collection as we will do it manually
   gc.disable()
 
+  # the input file is opened once, batches are read from its memory-mapping
+  ownInputFile = inputFile is None
+  if ownInputFile:
+    inputFile = MappedInputFile(inputFilename)
+
   # Given all the start/end positions of records, create larger batches containing multiple records
-  batches = create_batches(positions, batchSize)
+  # if positions is a lazy iterator (iter_record_positions), the file is scanned while the batches are processed
+  if stageTimer is not None:
+    positions = stageTimer.timeIterator(positions, 'positionScanning')
+  batches = iter_batches(positions, batchSize)
+  if prefetch > 0:
+    batches = iter_prefetched(((batch, list(inputFile.iter_chunks(batch.start, batch.end))) for batch in batches), prefetch)
+  else:
+    batches = ((batch, None) for batch in batches)
    
-  for batch in batches:
+  for batch, chunks in batches:
     config["counters"]["batchCounter"] += 1
-    start = batch[0][0]  # Start of the first tuple in the batch
-    end = batch[-1][1]   # End of the last tuple in the batch
-
-    # Read the chunk of the file from the beginning of the batch to the end of the batch
-    chunk_data = read_chunk(inputFilename, start, end)
-
-    # we need to store the byte stream in a variable so we can clear it later
-    bytesStream = BytesIO(b'<collection>' + chunk_data + b'</collection>')
-
-    # only fire for end events (default) and additionally only fire for tagName elements
-    context = ET.iterparse(bytesStream, tag=tagName)
+    start = batch.start  # Start of the first record in the batch
+    end = batch.end      # End of the last record in the batch
 
     try:
-      # We assume that context is configured to only fire 'end' events for tagName
-      #
-      for event, record in context:
+      if preFilter is not None or manifest is not None:
+        data, offset = (b''.join(chunks), start) if chunks is not None else getBatchBytes(inputFile, start, end)
+        ranges = timed(stageTimer, 'preFiltering', getKeptRanges, data, offset, batch, config['counters'], preFilter, manifest)
+        records = iter_ranges_records(data, offset, ranges, tagName, byteExtractor, config['counters'])
+      else:
+        if chunks is None:
+          records = iter_batch_records(inputFile, start, end, tagName, byteExtractor, config['counters'])
+        elif byteExtractor is not None:
+          records = byteExtractor.iter_records(b''.join(chunks), counters=config['counters'])
+        else:
+          records = iter_parsed_records(chunks, tagName)
+        records = zip(records, itertools.repeat(None))
+      if stageTimer is not None:
+        stageTimer.bytesRead += end - start
+        records = stageTimer.timeIterator(records, 'xmlParsing')
+
+      for record, digest in records:
         # call the given function and provide it the given parameters
-        func(record, config, dateConfig, monthMapping, *args, **kwargs)
+        recordID = timed(stageTimer, 'recordProcessing', func, record, config, dateConfig, monthMapping, *args, **kwargs)
+        if manifest is not None:
+          manifest.add(digest, recordID)
 
         config['counters']['recordCounter'] += 1
 
-        # clear to save RAM
-        record.clear()
-
-        # delete preceding siblings to save memory (https://lxml.de/3.2/parsing.html)
-        while record.getprevious() is not None:
-          del record.getparent()[0]
-
         if config['counters']['recordCounter'] % updateFrequency == 0:
-          updateProgressBar(pbar, config, updateFrequency)
+          metrics.update()
 
       # free up RAM after parsing all recors of the batch
-      bytesStream.close()
       gc.collect()
     except Exception as e:
-      logger.error(f'batch processing error for tuple ({start},{end})')
-      sys.exit(0)
+      # exit with an error, such that a scheduler knows that the run has to be resumed (the checkpoint of the last batch is kept)
+      logger.exception(f'batch processing error for tuple ({start},{end}): {e}')
+      sys.exit(1)
+
+    if onBatchEnd is not None:
+      onBatchEnd(end)
 
-    # update the remaining count after the loop has ended
-    updateProgressBar(pbar, config, updateFrequency)
+    metrics.update()
 
-    # We are done
-    del context
+  if ownInputFile:
+    inputFile.close()
 
   # re-enable automatic gargabe collection
   gc.enable()
 
+# -----------------------------------------------------------------------------
+def getRowTuple(rowdict, fieldnames):
+  """Returns the values of the given row in the order of the fieldnames, missing values are empty strings.
+     Lists are converted to their string right away like csv.writer would do it,
+     because processRecord still changes the dictionaries in them when it writes the 1:n rows.
+
+  >>> getRowTuple({'name': [{'a': 1}], 'id': '1'}, ['id', 'name', 'other'])
+  ('1', "[{'a': 1}]", '')
+  """
+  row = []
+  for key in fieldnames:
+    value = rowdict.get(key, '')
+    row.append(str(value) if isinstance(value, list) else value)
+  return tuple(row)
+
+# -----------------------------------------------------------------------------
+def getTupleWriter(writer, fieldnames):
+  """Returns a function which writes a row given as tuple in the order of the given fieldnames with the given writer:
+     writers with the same fieldnames and a writetuple method (BatchedCSVWriter, RowCollector) take the tuple as it is,
+     other writers like csv.DictWriter get a dictionary.
+
+  >>> from io import StringIO
+  >>> out = StringIO()
+  >>> getTupleWriter(csv.DictWriter(out, ['id', 'name']), ['id', 'name'])(('1', 'x'))
+  5
+  >>> out.getvalue().splitlines(), getTupleWriter(BatchedCSVWriter(out, ['id', 'name']), ['id', 'name']).__name__
+  (['1,x'], 'writetuple')
+  """
+  if hasattr(writer, 'writetuple') and writer.fieldnames == fieldnames:
+    return writer.writetuple
+  return lambda row: writer.writerow(dict(zip(fieldnames, row)))
+
+# -----------------------------------------------------------------------------
+class BatchedCSVWriter():
+  """Replacement for csv.DictWriter which keeps the rows as tuples in the order of fieldnames
+     and writes them with a single writerows call once maxRows rows are buffered or flush is called.
+     The written CSV is the same as the one of csv.DictWriter with the same format parameters.
+     If the attribute writerThread is set to an OutputWriterThread, the rows are written by that thread.
+
+  >>> from io import StringIO
+  >>> out = StringIO()
+  >>> writer = BatchedCSVWriter(out, ['id', 'name'], maxRows=2)
+  >>> writer.writeheader()
+  >>> writer.writerow({'id': '1', 'name': [1, 2]})
+  >>> out.getvalue().splitlines()
+  ['id,name']
+  >>> writer.writetuples([('2', None)])
+  >>> out.getvalue().splitlines()
+  ['id,name', '1,"[1, 2]"', '2,']
+  """
+
+  def __init__(self, outputFile, fieldnames, maxRows=1000, **fmtparams):
+    self.fieldnames = list(fieldnames)
+    self.writer = csv.writer(outputFile, **fmtparams)
+    self.maxRows = maxRows
+    self.rows = []
+    self.writerThread = None
+
+  def writeheader(self):
+    self.writer.writerow(self.fieldnames)
+
+  def writerow(self, rowdict):
+    self.rows.append(getRowTuple(rowdict, self.fieldnames))
+    if len(self.rows) >= self.maxRows:
+      self.flush()
+
+  def writetuple(self, row):
+    """Adds a row which is already a tuple in the order of the fieldnames."""
+    self.rows.append(row)
+    if len(self.rows) >= self.maxRows:
+      self.flush()
+
+  def writetuples(self, rows):
+    """Adds rows which are already tuples in the order of the fieldnames."""
+    self.rows.extend(rows)
+    if len(self.rows) >= self.maxRows:
+      self.flush()
+
+  def flush(self):
+    """Writes the buffered rows to the file, the file itself is not flushed."""
+    if self.rows:
+      if self.writerThread is not None:
+        self.writerThread.put(self.writer, self.rows)
+        self.rows = []
+      else:
+        self.writer.writerows(self.rows)
+        self.rows.clear()
+
+# -----------------------------------------------------------------------------
+class OutputWriterThread():
+  """Background thread which writes the rows of BatchedCSVWriter objects in the order in which they were flushed.
+     At most depth flushed row lists wait to be written, join waits until all of them are written.
+  """
+
+  def __init__(self, depth):
+    self.tasks = queue.Queue(maxsize=depth)
+    self.error = None
+    self.thread = threading.Thread(target=self._writeRows, daemon=True)
+    self.thread.start()
+
+  def _writeRows(self):
+    while True:
+      task = self.tasks.get()
+      try:
+        if task is None:
+          return
+        writer, rows = task
+        # after an error the remaining tasks are still taken from the queue, such that put does not block
+        if self.error is None:
+          writer.writerows(rows)
+      except Exception as e:
+        self.error = e
+      finally:
+        self.tasks.task_done()
+
+  def put(self, writer, rows):
+    """Adds the rows which should be written with the given csv.writer."""
+    if self.error is not None:
+      raise self.error
+    self.tasks.put((writer, rows))
+
+  def join(self):
+    """Waits until all added rows are written."""
+    self.tasks.join()
+    if self.error is not None:
+      raise self.error
+
+  def close(self):
+    self.tasks.put(None)
+    self.thread.join()
+    if self.error is not None:
+      raise self.error
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+# -----------------------------------------------------------------------------
+class RowCollector():
+  """Drop-in replacement for csv.DictWriter that keeps the written rows in memory.
+     Batch workers use it to hand the rows of a batch back to the parent process.
+     With fieldnames the rows are kept as tuples in their order (see BatchedCSVWriter.writetuples).
+
+  >>> collector = RowCollector()
+  >>> row = {'id': '1', 'birth': [{'birth': '1850'}]}
+  >>> collector.writerow(row)
+  >>> row['birth'][0]['id'] = '1'
+  >>> collector.rows
+  [{'id': '1', 'birth': "[{'birth': '1850'}]"}]
+  """
+
+  def __init__(self, fieldnames=None):
+    self.fieldnames = fieldnames
+    self.rows = []
+
+  def writerow(self, row):
+    if self.fieldnames is None:
+      # processRecord still changes the dictionaries in the cells when it writes the 1:n rows (e.g. it adds the record identifier),
+      # hence lists are converted to their string right away like csv.DictWriter would do it
+      self.rows.append({key: str(value) if isinstance(value, list) else value for key, value in row.items()})
+    else:
+      self.rows.append(getRowTuple(row, self.fieldnames))
+
+  def writetuple(self, row):
+    """Adds a row which is already a tuple in the order of the fieldnames."""
+    self.rows.append(row)
+
+# -----------------------------------------------------------------------------
+class WorkerLogForwarder():
+  """Forwards the log records which worker processes put in logQueue to the handlers of the parent process.
+     The workers send their log records with initWorkerLogging(logLevel, logQueue).
+  """
+
+  def __init__(self):
+    parentLogger = logging.getLogger(LOGGER_NAME)
+    handlers = list(parentLogger.handlers)
+    if parentLogger.propagate:
+      handlers.extend(logging.getLogger().handlers)
+
+    self.logLevel = parentLogger.getEffectiveLevel()
+    self.logQueue = multiprocessing.Queue()
+    self.logListener = QueueListener(self.logQueue, *handlers, respect_handler_level=True)
+
+  def __enter__(self):
+    self.logListener.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.logListener.stop()
+    return False
+
+# -----------------------------------------------------------------------------
+def initWorkerLogging(logLevel, logQueue):
+  """Sends the log records of a worker process to the parent process which writes them with its handlers."""
+  workerLogger = logging.getLogger(LOGGER_NAME)
+  for handler in list(workerLogger.handlers):
+    workerLogger.removeHandler(handler)
+  workerLogger.addHandler(QueueHandler(logQueue))
+  workerLogger.setLevel(logLevel)
+  workerLogger.propagate = False
+
+# -----------------------------------------------------------------------------
+# State of a batch worker process, set once by _initBatchWorker
+_batchWorkerState = {}
+
+# -----------------------------------------------------------------------------
+def _initBatchWorker(config, dateConfig, monthMapping, prefix, tagName, logLevel, logQueue, profile=False, byteExtractor=None, preFilter=None):
+  """Initializes a worker process of the BatchWorkerPool."""
+  initWorkerLogging(logLevel, logQueue)
+
+  _batchWorkerState.update({
+    'config': config,
+    'dateConfig': dateConfig,
+    'monthMapping': monthMapping,
+    'prefix': prefix,
+    'tagName': tagName,
+    'byteExtractor': byteExtractor,
+    'preFilter': preFilter,
+    # compiled XPath objects cannot be pickled, hence each worker compiles its own plan
+    'plan': ExtractionPlan(config, dateConfig, monthMapping)
+  })
+  if profile:
+    _batchWorkerState['plan'].stageTimer = StageTimer()
+
+# -----------------------------------------------------------------------------
+def _processBatchInWorker(task):
+  """Extracts all records of a single batch in a worker process.
+     Returns the main output rows, the 1:n output rows per column, the counters of this batch,
+     the measured stage times of this batch (None without profiling) and, if the ranges of the batch were given,
+     the digest and the identifier of each extracted record for the RecordManifest (otherwise None).
+  """
+  inputFilename, start, end, data, batch, ranges = task
+  state = _batchWorkerState
+  config = state['config']
+
+  # the parent merges the counters, hence only report the counts of this batch
+  for counterName in config['counters']:
+    config['counters'][counterName] = 0
+
+  stageTimer = state['plan'].stageTimer
+  if stageTimer is not None:
+    stageTimer.reset()
+    stageTimer.bytesRead += end - start
+
+  # rows are sent as tuples, they are smaller to send and can be written as they are
+  plan = state['plan']
+  mainRows = RowCollector(plan.mainOutputFields)
+  files = {field.columnName: RowCollector(field.outputFields) for field in plan.fields}
+
+  if data is None:
+    # each worker maps the current input file once, not once per batch
+    if state.get('inputFile') is None or state['inputFile'].filename != inputFilename:
+      if state.get('inputFile') is not None:
+        state['inputFile'].close()
+      state['inputFile'] = MappedInputFile(inputFilename)
+
+  recordIDs = None
+  if ranges is not None:
+    # the ranges still to be parsed were already determined by the parent, which keeps the RecordManifest
+    data, offset = (data, start) if data is not None else (state['inputFile'].map, 0)
+    records = iter_ranges_records(data, offset, ranges, state['tagName'], state['byteExtractor'], config['counters'])
+    recordIDs = []
+  elif batch is not None:
+    # the record positions of the batch are only sent along for the BytePreFilter
+    data, offset = (data, start) if data is not None else (state['inputFile'].map, 0)
+    ranges = timed(stageTimer, 'preFiltering', getKeptRanges, data, offset, batch, config['counters'], state['preFilter'])
+    records = iter_ranges_records(data, offset, ranges, state['tagName'], state['byteExtractor'], config['counters'])
+  else:
+    if data is not None:
+      # the bytes of the batch were sent along, e.g. because the input file is compressed
+      if state['byteExtractor'] is not None:
+        records = state['byteExtractor'].iter_records(data, counters=config['counters'])
+      else:
+        records = iter_parsed_records([data], state['tagName'])
+    else:
+      records = iter_batch_records(state['inputFile'], start, end, state['tagName'], state['byteExtractor'], config['counters'])
+    records = zip(records, itertools.repeat(None))
+  if stageTimer is not None:
+    records = stageTimer.timeIterator(records, 'xmlParsing')
+
+  for record, digest in records:
+    recordID = timed(stageTimer, 'recordProcessing', processRecord, record, config, state['dateConfig'], state['monthMapping'], mainRows, files, state['prefix'], plan=state['plan'])
+    config['counters']['recordCounter'] += 1
+    if recordIDs is not None:
+      recordIDs.append((digest, recordID))
+
+  gc.collect()
+  stageTimes = None
+  if stageTimer is not None:
+    # rows are only collected here, the parent writes them and measures the CSV writing
+    stageTimer.seconds['csvWriting'] = 0.0
+    stageTimer.calls['csvWriting'] = 0
+    stageTimes = stageTimer.getState()
+  return (mainRows.rows, {columnName: w.rows for columnName, w in files.items()}, dict(config['counters']), stageTimes, recordIDs)
+
+# -----------------------------------------------------------------------------
+class BatchWorkerPool():
+  """A pool of worker processes which extract the records of whole batches in parallel.
+     Log messages of the workers are forwarded to the handlers of the parent process.
+     With profile the workers measure the time of their processing stages.
+     If a ByteRecordExtractor is given, the workers read the records with it instead of lxml.
+     If a BytePreFilter is given, the workers count the records it rejects as filtered without parsing them.
+  """
+
+  def __init__(self, workers, config, dateConfig, monthMapping, prefix, tagName, profile=False, byteExtractor=None, preFilter=None):
+    self.workers = workers
+    self.preFilter = preFilter
+
+    # QName objects cannot be pickled, the Clark notation string works as well for iterparse
+    tagName = str(tagName)
+
+    self.logForwarder = WorkerLogForwarder()
+    self.pool = multiprocessing.Pool(workers, initializer=_initBatchWorker, initargs=(config, dateConfig, monthMapping, prefix, tagName, self.logForwarder.logLevel, self.logForwarder.logQueue, profile, byteExtractor, preFilter))
+
+  def __enter__(self):
+    self.logForwarder.__enter__()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.pool.close()
+    else:
+      self.pool.terminate()
+    self.pool.join()
+    self.logForwarder.__exit__(exc_type, exc_value, traceback)
+    return False
+
+# -----------------------------------------------------------------------------
+def fast_iter_batch_parallel(inputFilename, positions, workerPool, metrics, config, batchSize, outputWriter, files, prefix, onBatchEnd=None, stageTimer=None, inputFile=None, manifest=None):
+  """Parallel version of fast_iter_batch: the batches are extracted by the given BatchWorkerPool.
+     The workers return the rows as tuples, hence outputWriter and files have to be BatchedCSVWriter objects.
+     The rows are written in the original record order and the counters of the workers are merged into config['counters'].
+     If given, onBatchEnd is called with the end position of each batch after all its rows were written.
+     If a StageTimer is given, the stage times measured by the workers (BatchWorkerPool with profile) are merged into it.
+     If an inputFile is given (e.g. a DecompressedInputFile), the bytes of each batch are read from it and sent to the workers,
+     otherwise the workers read the batches from their own memory-mapping of inputFilename.
+     If a RecordManifest is given, this process skips the records which did not change since the previous run
+     (and the records rejected by the BytePreFilter of the pool), only the remaining byte ranges are extracted by the workers.
+  """
+
+  if stageTimer is not None:
+    positions = stageTimer.timeIterator(positions, 'positionScanning')
+  batches = iter_batches(positions, batchSize)
+
+  # the records are hashed by this process, because it keeps the manifest
+  mappedInputFile = MappedInputFile(inputFilename) if manifest is not None and inputFile is None else None
+
+  # limit the number of batches in flight, otherwise all results may pile up in memory
+  maxPending = 2 * workerPool.workers
+  pending = collections.deque()
+
+  def writeBatchResult(start, end, asyncResult):
+    try:
+      mainRows, columnRows, batchCounters, stageTimes, recordIDs = asyncResult.get()
+    except Exception as e:
+      # the traceback of the worker is part of the logged exception
+      logger.exception(f'batch processing error for tuple ({start},{end}): {e}')
+      sys.exit(1)
+
+    config['counters']['batchCounter'] += 1
+    timed(stageTimer, 'csvWriting', outputWriter.writetuples, mainRows)
+    if prefix != "":
+      for columnName, rows in columnRows.items():
+        timed(stageTimer, 'csvWriting', files[columnName].writetuples, rows)
+
+    if stageTimer is not None and stageTimes is not None:
+      stageTimer.merge(stageTimes)
+
+    for counterName, value in batchCounters.items():
+      config['counters'][counterName] = config['counters'].get(counterName, 0) + value
+
+    if manifest is not None:
+      for digest, recordID in recordIDs:
+        manifest.add(digest, recordID)
+
+    if onBatchEnd is not None:
+      onBatchEnd(end)
+
+    metrics.update()
+
+  for batch in batches:
+    start = batch.start  # Start of the first record in the batch
+    end = batch.end      # End of the last record in the batch
+    data = inputFile.read_range(start, end) if inputFile is not None else None
+    if manifest is not None:
+      batchData, offset = (data, start) if data is not None else (mappedInputFile.map, 0)
+      ranges = timed(stageTimer, 'preFiltering', getKeptRanges, batchData, offset, batch, config['counters'], workerPool.preFilter, manifest)
+      task = (inputFilename, start, end, data, None, ranges)
+    else:
+      positions = batch if workerPool.preFilter is not None else None
+      task = (inputFilename, start, end, data, positions, None)
+    pending.append((start, end, workerPool.pool.apply_async(_processBatchInWorker, (task,))))
+
+    if len(pending) >= maxPending:
+      writeBatchResult(*pending.popleft())
+
+  while pending:
+    writeBatchResult(*pending.popleft())
+
+  if mappedInputFile is not None:
+    mappedInputFile.close()
 
 # -----------------------------------------------------------------------------
-def fast_iter(context, func, pbar, config, dateConfig, monthMapping, updateFrequency=100, *args, **kwargs):
+def fast_iter(context, func, metrics, config, dateConfig, monthMapping, updateFrequency=100, *args, stageTimer=None, onUpdate=None, **kwargs):
   """
   Adapted from http://stackoverflow.com/questions/12160418
 
   This function calls "func" for each parsed record in context.
-  All name parameters of this function are used to initialize and update a progress bar.
+  The given MetricsReporter is updated every updateFrequency records and reports the progress at most once per interval.
+  If given, onUpdate is called every updateFrequency records as well.
+  If a StageTimer is given, the time of parsing and record processing is measured.
   Other non-keyword arguments (args) and keyword arguments (kwargs) are provided to "func".
   """
 
   # We assume that context is configured to only fire 'end' events for tagName
   #
-  for event, record in context:
+  events = context if stageTimer is None else stageTimer.timeIterator(context, 'xmlParsing')
+  for event, record in events:
 
     # call the given function and provide it the given parameters
-    func(record, config, dateConfig, monthMapping, *args, **kwargs)
+    timed(stageTimer, 'recordProcessing', func, record, config, dateConfig, monthMapping, *args, **kwargs)
 
     # Update progress bar
     config['counters']['recordCounter'] += 1
@@ -137,10 +969,12 @@ def fast_iter(context, func, pbar, config, dateConfig, monthMapping, updateFrequ
       del record.getparent()[0]
 
     if config['counters']['recordCounter'] % updateFrequency == 0:
-      updateProgressBar(pbar, config, updateFrequency)
+      metrics.update()
+      if onUpdate is not None:
+        onUpdate()
 
-  # update the remaining count after the loop has ended
-  updateProgressBar(pbar, config, updateFrequency)
+  # report the remaining records after the loop has ended
+  metrics.update()
 
   # We are done
   del context
@@ -227,17 +1061,7 @@ def parseDate(date, patterns):
     try:
       # try if the value is a year
       tmp = datetime.strptime(date, p).date()
-      if len(date) <= 4:
-        parsedDate = str(tmp.year)
-      elif len(date) > 4 and len(date) <= 7:
-        if any(ele in date for ele in ['(', '[', ')', ']', '.']):
-          parsedDate = str(tmp.year)
-        else:
-          parsedDate = None
-      elif len(date) == 8 and date.endswith('----'):
-        parsedDate = str(tmp.year)
-      else:
-        parsedDate = str(tmp)
+      parsedDate = formatParsedDate(date, tmp.year, tmp.month, tmp.day)
       break
     except ValueError:
       pass
@@ -247,6 +1071,164 @@ def parseDate(date, patterns):
   else:
     return parsedDate
 
+# -----------------------------------------------------------------------------
+def formatParsedDate(date, year, month, day):
+  """Returns the output string of parseDate for a date string that was parsed into year, month and day.
+     None is returned for the cases which are considered invalid (only year and month).
+  """
+  if len(date) <= 4:
+    return str(year)
+  elif len(date) > 4 and len(date) <= 7:
+    if any(ele in date for ele in ['(', '[', ')', ']', '.']):
+      return str(year)
+    else:
+      return None
+  elif len(date) == 8 and date.endswith('----'):
+    return str(year)
+  else:
+    # same as the string representation of a datetime.date
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+# -----------------------------------------------------------------------------
+class DatePatternParser():
+  """Fast path of parseDate: the strptime patterns are translated once into regular expressions,
+     such that a date can be recognized without calling datetime.strptime and catching its exceptions for every pattern.
+     The regular expressions of the supported directives are the same as the ones used by strptime.
+     Patterns which cannot be translated are still tried with datetime.strptime.
+
+  >>> parser = DatePatternParser(["%Y", "(%Y)", "[%Y]", "%Y-%m-%d", "%d/%m/%Y", "%Y%m%d", "%Y----", "%Y.%m.%d"])
+  >>> parser.parse('1988')
+  '1988'
+  >>> parser.parse('780')
+  '780'
+  >>> parser.parse('(1988)')
+  '1988'
+  >>> parser.parse('19880425')
+  '1988-04-25'
+  >>> parser.parse('25/4/1988')
+  '1988-04-25'
+  >>> parser.parse('1980----')
+  '1980'
+
+  Calendar correctness is checked like strptime does
+  >>> parser.parse('1988-02-30') is None
+  True
+  >>> parser.parse('1988-02-29')
+  '1988-02-29'
+  >>> parser.parse('1989-02-29') is None
+  True
+  >>> parser.parse('1988-02-29x') is None
+  True
+  """
+
+  # the same regular expressions as used by the strptime implementation of Python
+  DIRECTIVES = {
+    'Y': (r'(?P<Y>\d\d\d\d)', 4, 4),
+    'm': (r'(?P<m>1[0-2]|0[1-9]|[1-9])', 1, 2),
+    'd': (r'(?P<d>3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])', 1, 2)
+  }
+
+  def __init__(self, patterns):
+    self.patterns = patterns
+
+    # list of tuples (strptime pattern, compiled regex or None if not translatable, minimal length, maximal length)
+    self.matchers = []
+    for pattern in patterns:
+      translated = DatePatternParser.translate(pattern)
+      if translated is None:
+        self.matchers.append((pattern, None, 0, sys.maxsize))
+      else:
+        self.matchers.append((pattern, re.compile(translated[0], re.IGNORECASE), translated[1], translated[2]))
+
+  @staticmethod
+  def translate(pattern):
+    """Returns a tuple with the regular expression, minimal and maximal length of matching strings, or None if the pattern is not supported.
+
+    >>> DatePatternParser.translate('(%Y)')[1:]
+    (6, 6)
+    >>> DatePatternParser.translate('%Y-%m-%d')[1:]
+    (8, 10)
+    >>> DatePatternParser.translate('%d %B %Y') is None
+    True
+    """
+    regex = ''
+    minLength = 0
+    maxLength = 0
+    directives = set()
+    i = 0
+    while i < len(pattern):
+      char = pattern[i]
+      if char == '%':
+        if i + 1 >= len(pattern):
+          return None
+        directive = pattern[i+1]
+        i += 2
+        if directive == '%':
+          regex += '%'
+          minLength += 1
+          maxLength += 1
+        elif directive in DatePatternParser.DIRECTIVES and directive not in directives:
+          directives.add(directive)
+          directiveRegex, directiveMin, directiveMax = DatePatternParser.DIRECTIVES[directive]
+          regex += directiveRegex
+          minLength += directiveMin
+          maxLength += directiveMax
+        else:
+          return None
+      elif char.isspace():
+        # like strptime: a sequence of whitespace matches one or more whitespace characters
+        while i < len(pattern) and pattern[i].isspace():
+          i += 1
+        regex += r'\s+'
+        minLength += 1
+        maxLength = sys.maxsize
+      else:
+        regex += re.escape(char)
+        minLength += 1
+        maxLength += 1
+        i += 1
+
+    # without year strptime would use 1900 as default, leave that to strptime itself
+    if 'Y' not in directives:
+      return None
+    return (regex, minLength, maxLength)
+
+  def parse(self, date):
+    """Returns the same string as parseDate, but None instead of an exception if the date could not be parsed."""
+
+    # handle years before the year 1000
+    if len(date) < 4 and date.isdigit():
+      date = date.zfill(4)
+
+    dateLength = len(date)
+    for pattern, regex, minLength, maxLength in self.matchers:
+      if dateLength < minLength or dateLength > maxLength:
+        continue
+
+      if regex is None:
+        try:
+          tmp = datetime.strptime(date, pattern).date()
+        except ValueError:
+          continue
+        return formatParsedDate(date, tmp.year, tmp.month, tmp.day)
+
+      match = regex.match(date)
+      if match is None or match.end() != dateLength:
+        continue
+
+      groups = match.groupdict()
+      year = int(groups['Y'])
+      month = int(groups['m']) if 'm' in groups else 1
+      day = int(groups['d']) if 'd' in groups else 1
+
+      # strptime fails for dates which do not exist
+      if year < 1 or day > calendar.monthrange(year, month)[1]:
+        continue
+
+      return formatParsedDate(date, year, month, day)
+
+    return None
+
 # -----------------------------------------------------------------------------
 def roman_to_century(roman_numeral):
     roman_map = {
@@ -397,84 +1379,139 @@ def parseComplexDate(input_str, config, monthMapping):
     >>> parseComplexDate("before November 1980 and after April 1978", config, {"november": "11", "april": "04"})
     ('november-1980/april-1978', 'range_with_and_month')
     """
+    return DateRuleEngine(config, monthMapping).parse(input_str)
+
+# -----------------------------------------------------------------------------
+def _dateRuleRangeWithAndWrittenMonth(match, template, monthMapping):
+  before_year = match.group(4)  # Year before "and"
+  after_year = match.group(2)  # Year after "and"
+  before_month = match.group(3)  # Month before "and"
+  after_month = match.group(1)  # Month after "and"
+
+  beforeMonthNumeric = getNumericMonth(before_month, monthMapping)
+  afterMonthNumeric = getNumericMonth(after_month, monthMapping)
+  # Use the template for formatting
+  return template % (before_year, beforeMonthNumeric, after_year, afterMonthNumeric)
+
+# -----------------------------------------------------------------------------
+def _dateRuleRangeWithAndYear(match, template, monthMapping):
+  before_year = match.group(1)  # Year before "and"
+  after_year = match.group(2)  # Year after "and"
+
+  # Use the template for formatting
+  return template % (before_year, after_year)
+
+# -----------------------------------------------------------------------------
+def _dateRuleBeforeWrittenMonthYear(match, template, monthMapping):
+  year = match.group(2)
+  month = match.group(1)
+  monthNumeric = getNumericMonth(month, monthMapping)
+  return f"[..{year}-{monthNumeric}]"
+
+# -----------------------------------------------------------------------------
+def _dateRuleBeforeDashDate(match, template, monthMapping):
+  year = match.group(3)
+  month = match.group(2)
+  day = match.group(1)
+  return f"[..{year}-{month}-{day}]"
+
+# -----------------------------------------------------------------------------
+def _dateRuleYearsSlashAbbreviation(match, template, monthMapping):
+  year = match.group(1)
+  alternateYearAbbreviation = match.group(2)
+  otherYear = year[:-len(alternateYearAbbreviation)] + alternateYearAbbreviation
+  return f"[{year},{otherYear}]"
+
+# -----------------------------------------------------------------------------
+def _dateRuleWrittenMonthYear(match, template, monthMapping):
+  year = match.group(2)
+  month = match.group(1)
+  monthNumeric = getNumericMonth(month, monthMapping)
+  return f"{year}-{monthNumeric}"
+
+# -----------------------------------------------------------------------------
+def _dateRuleAfterWrittenMonthYear(match, template, monthMapping):
+  year = match.group(2)
+  month = match.group(1)
+  monthNumeric = getNumericMonth(month, monthMapping)
+  return f"[{year}-{monthNumeric}..]"
+
+# -----------------------------------------------------------------------------
+def _dateRuleBeforeYear(match, template, monthMapping):
+  year = match.group(1)
+  return f"[..{year}]"
+
+# -----------------------------------------------------------------------------
+def _dateRuleRomanCentury(match, template, monthMapping):
+  roman_numeral = match.group(1)  # Capture the Roman numeral
+  return roman_to_century(roman_numeral)
+
+# -----------------------------------------------------------------------------
+def _dateRuleTemplate(match, template, monthMapping):
+  groups = match.groups()
+  return template % groups
+
+# Rules that need more than filling their template with the matched groups
+DATE_RULE_HANDLERS = {
+  "range_with_and_written_month": _dateRuleRangeWithAndWrittenMonth,
+  "range_with_and_year": _dateRuleRangeWithAndYear,
+  "before_written_month_year": _dateRuleBeforeWrittenMonthYear,
+  "before_dash_date": _dateRuleBeforeDashDate,
+  "years_slash_abbreviation": _dateRuleYearsSlashAbbreviation,
+  "written_month_year": _dateRuleWrittenMonthYear,
+  "after_written_month_year": _dateRuleAfterWrittenMonthYear,
+  "before_year": _dateRuleBeforeYear,
+  "roman_century": _dateRuleRomanCentury
+}
+
+# -----------------------------------------------------------------------------
+class DateRuleEngine():
+  r"""Compiled form of the rules of a date config, created once instead of compiling all rule patterns for every date.
+  The rules are tried in the order of the config, the first matching rule determines the result.
+
+  >>> config = {
+  ...    "components": {
+  ...      "keywords": {"before": r"(?:before|avant|Avant)"},
+  ...      "months": {"English": { "November": "11", "April": "04" }},
+  ...      "year": r"(\d{4})"
+  ...    },
+  ...    "rules": {
+  ...      "before_written_month_year": { "pattern": r"%(keywords.before)s\s+(%(months.generic)s)\s+%(year)s", "template": "[..%s-%s]" },
+  ...      "before_year": { "pattern": r"%(keywords.before)s\s+%(year)s", "template": "%s~" }
+  ...    }
+  ... }
+  >>> engine = DateRuleEngine(config)
+  >>> engine.parse("avant 1980")
+  ('[..1980]', 'before_year')
+  >>> engine.parse("before April 1980")
+  ('[..1980-04]', 'before_written_month_year')
+  >>> engine.parse("unknown")
+  (None, None)
+  """
+
+  def __init__(self, dateConfig, monthMapping=None):
+    self.monthMapping = monthMapping if monthMapping is not None else buildMonthMapping(dateConfig)
+
+    # the simple patterns are tried before the rules, see normalizeDate
+    self.patternParser = DatePatternParser(dateConfig["datePatterns"]) if "datePatterns" in dateConfig else None
+
+    # list of tuples (rule name, compiled pattern, template, handler function)
+    self.rules = []
+    for ruleName, rule in dateConfig["rules"].items():
+      pattern = re.compile(compile_pattern(rule["pattern"], dateConfig["components"]), re.IGNORECASE)
+      handler = DATE_RULE_HANDLERS.get(ruleName, _dateRuleTemplate)
+      self.rules.append((ruleName, pattern, rule.get("template"), handler))
+
+  def parse(self, value):
+    """Returns a tuple of the standardized date in EDTF format and the name of the matching rule, or (None, None)."""
+
     # Normalize input
-    norm_input = getNormalizedDateString(input_str)
-
-    results = []
-
-    #print(f'input string: {norm_input}')
-    for rule_name, rule in config["rules"].items():
-        pattern_str = compile_pattern(rule["pattern"], config["components"])
-        pattern = re.compile(pattern_str, re.IGNORECASE)
-        match = pattern.search(norm_input)
-
-        if match:
-            #print(f'rule "{rule_name}" match with pattern "{pattern_str}" for input string "{norm_input}". Groups are {match.groups()}')
-
-            # Check for more specific rules first
-            if rule_name == "range_with_and_written_month":
-                before_year = match.group(4)  # Year before "and"
-                after_year = match.group(2)  # Year after "and"
-                before_month = match.group(3)  # Month before "and"
-                after_month = match.group(1)  # Month after "and"
-                
-                beforeMonthNumeric = getNumericMonth(before_month, monthMapping)
-                afterMonthNumeric = getNumericMonth(after_month, monthMapping)
-                # Use the template for formatting
-                result_str = rule["template"] % (before_year, beforeMonthNumeric, after_year, afterMonthNumeric)
-                return result_str, rule_name
-
-            elif rule_name == "range_with_and_year":
-                before_year = match.group(1)  # Year before "and"
-                after_year = match.group(2)  # Year after "and"
-                
-                # Use the template for formatting
-                result_str = rule["template"] % (before_year, after_year)
-                return result_str, rule_name
-
-            elif rule_name == "before_written_month_year":
-                year = match.group(2) 
-                month = match.group(1) 
-                monthNumeric = getNumericMonth(month, monthMapping)
-                return f"[..{year}-{monthNumeric}]", rule_name
-
-            elif rule_name == "before_dash_date":
-                year = match.group(3) 
-                month = match.group(2) 
-                day = match.group(1)
-                return f"[..{year}-{month}-{day}]", rule_name
-
-            elif rule_name == "years_slash_abbreviation":
-                year = match.group(1) 
-                alternateYearAbbreviation = match.group(2) 
-                otherYear = year[:-len(alternateYearAbbreviation)] + alternateYearAbbreviation
-                return f"[{year},{otherYear}]", rule_name
-
-            elif rule_name == "written_month_year":
-                year = match.group(2) 
-                month = match.group(1) 
-                monthNumeric = getNumericMonth(month, monthMapping)
-                return f"{year}-{monthNumeric}", rule_name
-
-            elif rule_name == "after_written_month_year":
-                year = match.group(2) 
-                month = match.group(1)
-                monthNumeric = getNumericMonth(month, monthMapping)
-                return f"[{year}-{monthNumeric}..]", rule_name
-
-            elif rule_name == "before_year":
-                year = match.group(1)
-                return f"[..{year}]", rule_name
-
-            elif rule_name == "roman_century":
-                roman_numeral = match.group(1)  # Capture the Roman numeral
-                century_str = roman_to_century(roman_numeral)
-                return century_str, rule_name
-            else:
-                groups = match.groups()
-                result_str = rule["template"] % groups
-                return result_str, rule_name
-            
+    normInput = getNormalizedDateString(value)
+
+    for ruleName, pattern, template, handler in self.rules:
+      match = pattern.search(normInput)
+      if match:
+        return handler(match, template, self.monthMapping), ruleName
 
     return None, None
 
@@ -591,7 +1628,510 @@ def getNormalizedDateString(s):
  
   
 # -----------------------------------------------------------------------------
-def passFilter(elem, filterConfig):
+# element names of MARC slim records, used by the MarcRecordIndex
+MARC_CONTROLFIELD = f'{{{NS_MARCSLIM}}}controlfield'
+MARC_DATAFIELD = f'{{{NS_MARCSLIM}}}datafield'
+MARC_SUBFIELD = f'{{{NS_MARCSLIM}}}subfield'
+
+# -----------------------------------------------------------------------------
+def _getQuotedPattern(name):
+  """Returns a regular expression for an XPath string literal in double or single quotes, its content is the group with the given name."""
+  return rf'''(?P<{name}Quote>["'])(?P<{name}>[^"']*)(?P={name}Quote)'''
+
+MARC_TEXT_CONDITION = r'''text\(\)\s*=\s*(["'])([^"']*)\1'''
+MARC_TEXT_CONDITIONS = rf'''(?P<texts>\(\s*{MARC_TEXT_CONDITION}(?:\s+or\s+{MARC_TEXT_CONDITION})*\s*\)|{MARC_TEXT_CONDITION})'''
+MARC_DATAFIELD_STEP = rf'''\./marc:datafield\[@tag\s*=\s*{_getQuotedPattern('tag')}\]'''
+
+# the shapes of MARC expressions which are answered from the MarcRecordIndex of a record instead of with XPath
+MARC_EXPRESSION_SHAPES = [
+  ('controlfield', re.compile(rf'''^\./marc:controlfield\[@tag\s*=\s*{_getQuotedPattern('tag')}\]$''')),
+  ('datafield', re.compile(rf'''^{MARC_DATAFIELD_STEP}$''')),
+  ('subfield', re.compile(rf'''^{MARC_DATAFIELD_STEP}/marc:subfield\[@code\s*=\s*{_getQuotedPattern('code')}\]$''')),
+  # e.g. the ISNI of 024 fields: ./marc:datafield[@tag="024"]/marc:subfield[@code="2" and (text()="isni" or text()="ISNI")]/../marc:subfield[@code="a"]
+  ('siblingSubfield', re.compile(rf'''^{MARC_DATAFIELD_STEP}/marc:subfield\[@code\s*=\s*{_getQuotedPattern('conditionCode')}\s+and\s+{MARC_TEXT_CONDITIONS}\]'''
+                                 rf'''/\.\./marc:subfield\[@code\s*=\s*{_getQuotedPattern('code')}\]$''')),
+  # relative to a datafield, e.g. the subfields of a json column
+  ('childSubfield', re.compile(rf'''^\./marc:subfield\[@code\s*=\s*{_getQuotedPattern('code')}\]$'''))
+]
+
+# -----------------------------------------------------------------------------
+class MarcRecordIndex():
+  """Fields of a MARC record collected in one pass over its children, in document order:
+     controlfields and datafields by tag, and subfields by tag and code (tag -> code -> [subfield elements]).
+
+  >>> record = ET.fromstring('<r xmlns="http://www.loc.gov/MARC21/slim"><controlfield tag="001">1</controlfield><datafield tag="100"><subfield code="a">x</subfield><subfield code="d">y</subfield></datafield></r>')
+  >>> index = MarcRecordIndex(record)
+  >>> [e.text for e in index.subfields['100']['a']], len(index.datafields['100']), index.controlfields['001'][0].text
+  (['x'], 1, '1')
+  """
+
+  __slots__ = ('controlfields', 'datafields', 'subfields')
+
+  def __init__(self, record):
+    self.controlfields = {}
+    self.datafields = {}
+    self.subfields = {}
+    for child in record:
+      if child.tag == MARC_DATAFIELD:
+        tag = child.get('tag')
+        self.datafields.setdefault(tag, []).append(child)
+        codes = self.subfields.setdefault(tag, {})
+        for subfield in child:
+          if subfield.tag == MARC_SUBFIELD:
+            codes.setdefault(subfield.get('code'), []).append(subfield)
+      elif child.tag == MARC_CONTROLFIELD:
+        self.controlfields.setdefault(child.get('tag'), []).append(child)
+
+# -----------------------------------------------------------------------------
+class MarcRecordIndexer():
+  """Keeps the MarcRecordIndex of the last given record, such that all expressions evaluated on a record share one index."""
+
+  def __init__(self):
+    self.record = None
+    self.index = None
+
+  def getIndex(self, record):
+    # the kept reference also keeps the lxml proxy of the record alive, hence another record is never the same object
+    if record is not self.record:
+      self.index = MarcRecordIndex(record)
+      self.record = record
+    return self.index
+
+# -----------------------------------------------------------------------------
+class MarcExpression():
+  """Used instead of a compiled XPath object for an expression with one of the MARC_EXPRESSION_SHAPES:
+     it returns the same elements in the same order, but takes them from the MarcRecordIndex of the record.
+
+  >>> record = ET.fromstring('<r xmlns:marc="http://www.loc.gov/MARC21/slim"><marc:datafield tag="024"><marc:subfield code="a">1</marc:subfield><marc:subfield code="2">isni</marc:subfield></marc:datafield><marc:datafield tag="024"><marc:subfield code="a">2</marc:subfield><marc:subfield code="2">viaf</marc:subfield></marc:datafield></r>')
+  >>> isni = compileMarcExpression('./marc:datafield[@tag="024"]/marc:subfield[@code="2" and (text()="isni" or text()="ISNI")]/../marc:subfield[@code="a"]', MarcRecordIndexer())
+  >>> [e.text for e in isni(record)]
+  ['1']
+  >>> [e.text for e in compileMarcExpression('./marc:datafield[@tag="024"]/marc:subfield[@code="a"]', MarcRecordIndexer())(record)]
+  ['1', '2']
+  """
+
+  __slots__ = ('expression', 'shape', 'tag', 'code', 'conditionCode', 'conditionTexts', 'indexer', 'select')
+
+  def __init__(self, expression, shape, match, indexer):
+    self.expression = expression
+    self.shape = shape
+    self.tag = match.groupdict().get('tag')
+    self.code = match.groupdict().get('code')
+    self.conditionCode = match.groupdict().get('conditionCode')
+    texts = match.groupdict().get('texts')
+    self.conditionTexts = frozenset(text for quote, text in re.findall(MARC_TEXT_CONDITION, texts)) if texts else None
+    self.indexer = indexer
+    self.select = {
+      'controlfield': self._selectControlfield,
+      'datafield': self._selectDatafield,
+      'subfield': self._selectSubfield,
+      'siblingSubfield': self._selectSiblingSubfield,
+      'childSubfield': self._selectChildSubfield
+    }[shape]
+
+  def __call__(self, elem):
+    return self.select(elem)
+
+  def _selectControlfield(self, elem):
+    return list(self.indexer.getIndex(elem).controlfields.get(self.tag, ()))
+
+  def _selectDatafield(self, elem):
+    return list(self.indexer.getIndex(elem).datafields.get(self.tag, ()))
+
+  def _selectSubfield(self, elem):
+    codes = self.indexer.getIndex(elem).subfields.get(self.tag)
+    return list(codes.get(self.code, ())) if codes else []
+
+  def _selectSiblingSubfield(self, elem):
+    values = []
+    for datafield in self.indexer.getIndex(elem).datafields.get(self.tag, ()):
+      subfields = [child for child in datafield if child.tag == MARC_SUBFIELD]
+      if any(s.get('code') == self.conditionCode and not self.conditionTexts.isdisjoint(getTextNodes(s)) for s in subfields):
+        values.extend(s for s in subfields if s.get('code') == self.code)
+    return values
+
+  def _selectChildSubfield(self, elem):
+    return [child for child in elem if child.tag == MARC_SUBFIELD and child.get('code') == self.code]
+
+# -----------------------------------------------------------------------------
+def getTextNodes(elem):
+  """Returns the text nodes which are children of the given element, like text() in XPath.
+
+  >>> getTextNodes(ET.fromstring('<a>x<!-- comment -->y<b>z</b></a>'))
+  ['x', 'y']
+  """
+  texts = [elem.text] + [child.tail for child in elem]
+  return [text for text in texts if text is not None]
+
+# -----------------------------------------------------------------------------
+def compileMarcExpression(expression, indexer):
+  """Returns a MarcExpression using the given MarcRecordIndexer if the expression has one of the MARC_EXPRESSION_SHAPES, otherwise None.
+
+  >>> compileMarcExpression("./marc:datafield[@tag='100']/marc:subfield[@code='a']", MarcRecordIndexer()).shape
+  'subfield'
+  >>> compileMarcExpression('./marc:datafield[@tag="100"]/marc:subfield[@code="a" or @code="b"]', MarcRecordIndexer()) is None
+  True
+  """
+  for shape, pattern in MARC_EXPRESSION_SHAPES:
+    match = pattern.match(expression.strip())
+    if match:
+      return MarcExpression(expression, shape, match, indexer)
+  return None
+
+# -----------------------------------------------------------------------------
+class ExecutionPlan():
+  """Compiled form of a config which is created once and passed down to the record processing.
+     All XPath expressions of the config (record identifier, record filter, data fields and their subfields)
+     are compiled once, instead of being parsed again by lxml for every record.
+     The record identifier is an ElementPath expression and is only compiled if it has a MARC shape (see getRecordID).
+     Expressions with a known MARC shape are answered from a MarcRecordIndex built once per record instead,
+     unless marcFieldIndex is false in the execution section of the config.
+
+  >>> config = {"recordIDExpression": "./id", "recordIDColumnName": "id", "dataFields": [{"columnName": "name", "expression": "./name", "valueType": "json", "subfields": [{"columnName": "lastName", "expression": "./lastName", "valueType": "text"}]}]}
+  >>> plan = ExecutionPlan(config)
+  >>> plan.numberExpressions
+  2
+  >>> plan.getXPath("./name")(ET.fromstring("<record><name>a</name></record>"))[0].text
+  'a'
+  """
+
+  def __init__(self, config, dateConfig=None, monthMapping=None):
+    startTime = time.perf_counter()
+
+    # all MARC expressions share the index of the current record
+    self.marcIndexer = MarcRecordIndexer() if getExecutionFlag(config, "marcFieldIndex", True) else None
+
+    # key: expression string, value: compiled lxml.etree.XPath object or MarcExpression
+    self.expressions = {}
+
+    # the record identifier keeps the ElementPath semantics of elem.find (e.g. Clark notation {namespace}tag),
+    # only an expression with a known MARC shape, which finds the same element, is answered from the MARC field index
+    self.recordID = compileMarcExpression(config['recordIDExpression'], self.marcIndexer) if self.marcIndexer else None
+    if self.recordID:
+      self.expressions[config['recordIDExpression']] = self.recordID
+    self.recordFilter = self._compile(config['recordFilter']['expression']) if 'recordFilter' in config else None
+
+    for field in config['dataFields']:
+      self._compile(field['expression'])
+      for subfield in field.get('subfields', []):
+        self._compile(subfield['expression'])
+
+    self.numberExpressions = len(self.expressions)
+    self.numberIndexedExpressions = sum(1 for e in self.expressions.values() if isinstance(e, MarcExpression))
+
+    # the date rules do not depend on the config, but they are also needed for every record
+    self.dateRuleEngine = DateRuleEngine(dateConfig, monthMapping) if dateConfig else None
+
+    # normalized dates are cached, because the same date values occur in many records
+    dateCacheSize = int(config["execution"]["dateCacheSize"]) if "execution" in config and "dateCacheSize" in config["execution"] else 10000
+    self.dateCache = DateCache(dateCacheSize, config.get('counters')) if dateCacheSize > 0 else None
+
+    # set to a StageTimer to measure the time of the processing stages (--profile-stats)
+    self.stageTimer = None
+
+    self.compilationTime = time.perf_counter() - startTime
+
+  def _compile(self, expression):
+    if expression not in self.expressions:
+      marcExpression = compileMarcExpression(expression, self.marcIndexer) if self.marcIndexer else None
+      self.expressions[expression] = marcExpression if marcExpression else ET.XPath(expression, namespaces=ALL_NS)
+    return self.expressions[expression]
+
+  def getXPath(self, expression):
+    """Returns the compiled XPath object (or MarcExpression), also expressions not part of the config can be given."""
+    if expression in self.expressions:
+      return self.expressions[expression]
+    else:
+      return self._compile(expression)
+
+# -----------------------------------------------------------------------------
+class DateCache():
+  """Least recently used cache of normalized dates: key is the raw date value, value a tuple (normalized value, rule).
+     The number of hits and misses is counted in the given counters dictionary, usually config['counters'].
+
+  >>> cache = DateCache(2)
+  >>> cache.put('1900', ('1900', 'simplePattern'))
+  >>> cache.put('1901', ('1901', 'simplePattern'))
+  >>> cache.get('1900')
+  ('1900', 'simplePattern')
+  >>> cache.put('1902', ('1902', 'simplePattern'))
+  >>> cache.get('1901') is None
+  True
+  >>> (cache.counters['dateCacheHits'], cache.counters['dateCacheMisses'])
+  (1, 1)
+  """
+
+  def __init__(self, maxSize, counters=None):
+    self.maxSize = maxSize
+    self.entries = collections.OrderedDict()
+    self.counters = counters if counters is not None else {}
+    self.counters.setdefault('dateCacheHits', 0)
+    self.counters.setdefault('dateCacheMisses', 0)
+
+  def get(self, value):
+    if value in self.entries:
+      self.entries.move_to_end(value)
+      self.counters['dateCacheHits'] += 1
+      return self.entries[value]
+    else:
+      self.counters['dateCacheMisses'] += 1
+      return None
+
+  def put(self, value, result):
+    self.entries[value] = result
+    self.entries.move_to_end(value)
+    if len(self.entries) > self.maxSize:
+      self.entries.popitem(last=False)
+
+# -----------------------------------------------------------------------------
+class StageTimer():
+  """Accumulated time and number of calls per processing stage, used for --profile-stats.
+     The stages are nested: recordProcessing contains the XPath evaluation, date normalization, encoding fixes and CSV writing of a record.
+
+  >>> timer = StageTimer()
+  >>> timer.add('csvWriting', 0.5)
+  >>> timer.call('csvWriting', len, 'abc')
+  3
+  >>> timer.calls['csvWriting']
+  2
+  >>> [r for r in timer.timeIterator([1, 2], 'xmlParsing')]
+  [1, 2]
+  >>> timer.calls['xmlParsing']
+  3
+  """
+
+  STAGES = ('positionScanning', 'preFiltering', 'xmlParsing', 'recordProcessing', 'xpathEvaluation', 'dateNormalization', 'encodingFixes', 'csvWriting')
+
+  def __init__(self):
+    self.seconds = dict.fromkeys(StageTimer.STAGES, 0.0)
+    self.calls = dict.fromkeys(StageTimer.STAGES, 0)
+    self.bytesRead = 0
+
+  def add(self, stage, seconds):
+    self.seconds[stage] += seconds
+    self.calls[stage] += 1
+
+  def call(self, stage, func, *args, **kwargs):
+    """Calls func with the given arguments and adds the time it took to the given stage."""
+    startTime = time.perf_counter()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      self.add(stage, time.perf_counter() - startTime)
+
+  def timeIterator(self, iterable, stage):
+    """Yields the items of iterable and adds the time spent to get each of them to the given stage."""
+    iterator = iter(iterable)
+    while True:
+      startTime = time.perf_counter()
+      try:
+        item = next(iterator)
+      except StopIteration:
+        return
+      finally:
+        self.add(stage, time.perf_counter() - startTime)
+      yield item
+
+  def getState(self):
+    """Returns the measurements as dictionary, e.g. to send them from a worker process to the parent."""
+    return {'seconds': dict(self.seconds), 'calls': dict(self.calls), 'bytesRead': self.bytesRead}
+
+  def merge(self, state):
+    """Adds the measurements returned by getState of another StageTimer."""
+    for stage in StageTimer.STAGES:
+      self.seconds[stage] += state['seconds'][stage]
+      self.calls[stage] += state['calls'][stage]
+    self.bytesRead += state['bytesRead']
+
+  def reset(self):
+    self.__init__()
+
+  def getReport(self, counters, wallTime):
+    """Returns the run report: total and per-record time per stage, batches, bytes read and the counters."""
+    records = counters.get('recordCounter', 0)
+    return {
+      'wallTime': wallTime,
+      'records': records,
+      'batches': counters.get('batchCounter', 0),
+      'bytesRead': self.bytesRead,
+      'stages': {stage: {
+          'seconds': self.seconds[stage],
+          'perRecord': self.seconds[stage] / records if records else None,
+          'calls': self.calls[stage]
+        } for stage in StageTimer.STAGES},
+      'counters': dict(counters)
+    }
+
+# -----------------------------------------------------------------------------
+def timed(stageTimer, stage, func, *args, **kwargs):
+  """Calls func with the given arguments, the time is only measured if a StageTimer is given.
+
+  >>> timed(None, 'csvWriting', len, 'abc')
+  3
+  """
+  if stageTimer is None:
+    return func(*args, **kwargs)
+  return stageTimer.call(stage, func, *args, **kwargs)
+
+# -----------------------------------------------------------------------------
+# Handlers of the value types which are not json, they are called with the already stripped value
+# and return the normalized value which is added to the output or None
+#
+def _valueTypeDate(plan, recordID, value, columnName):
+  parsedDate, parsingRule = handleTypeDate(recordID, value, plan.dateConfig, plan.monthMapping, plan.dateRuleEngine, plan.dateCache, plan.stageTimer)
+  # only add dates to the output that were parsed by any rule, otherwise they are part of the log
+  return {columnName: parsedDate, "rule": parsingRule} if parsedDate is not None else None
+
+def _valueTypeText(plan, recordID, value, columnName):
+  return value
+
+def _valueTypeISNIURL(plan, recordID, value, columnName):
+  return handleTypeISNIURL(recordID, value)
+
+def _valueTypeBnFURL(plan, recordID, value, columnName):
+  return handleTypeBnFURL(recordID, value)
+
+VALUE_TYPE_HANDLERS = {
+  'date': _valueTypeDate,
+  'text': _valueTypeText,
+  'isniURL': _valueTypeISNIURL,
+  'bnfURL': _valueTypeBnFURL
+}
+
+# -----------------------------------------------------------------------------
+class SubfieldDescriptor():
+  """Compiled form of a subfield config entry of a data field with valueType json."""
+
+  __slots__ = ('columnName', 'xpath', 'valueType', 'splitCharacter', 'fixEncoding')
+
+  def __init__(self, subfieldConfig, xpath, fixEncoding=True):
+    self.columnName = subfieldConfig['columnName']
+    self.xpath = xpath
+    self.valueType = subfieldConfig['valueType']
+    self.splitCharacter = subfieldConfig.get('splitCharacter')
+
+    # subfields repair the encoding like their data field, unless they have their own fixEncoding
+    self.fixEncoding = subfieldConfig['fixEncoding'] == 'true' if 'fixEncoding' in subfieldConfig else fixEncoding
+
+# -----------------------------------------------------------------------------
+class FieldDescriptor():
+  """Compiled form of a data field config entry, the slot is the position of the field in the config."""
+
+  __slots__ = ('slot', 'columnName', 'xpath', 'valueType', 'handler', 'keepOriginal', 'originalColumnName',
+               'splitCharacter', 'subfields', 'subfieldColumnNames', 'subfieldSplitCharacters', 'outputFields', 'fixEncoding', 'isDate')
+
+  def __init__(self, slot, fieldConfig, xpath, recordIDColumnName):
+    self.slot = slot
+    self.columnName = fieldConfig['columnName']
+    self.xpath = xpath
+    self.valueType = fieldConfig.get('valueType')
+    self.isDate = self.valueType == 'date'
+    self.keepOriginal = fieldConfig.get('keepOriginal') == 'true'
+    self.originalColumnName = getOriginalColumnName(fieldConfig) if self.keepOriginal else None
+
+    # wrongly encoded texts are repaired, unless fixEncoding is "false"
+    self.fixEncoding = fieldConfig.get('fixEncoding', 'true') == 'true'
+
+    # an empty split character means that the values are not split
+    self.splitCharacter = fieldConfig.get('splitCharacter') or None
+
+    # None if this field has no subfields
+    self.subfields = None
+    self.subfieldColumnNames = None
+    self.subfieldSplitCharacters = None
+
+    # unknown value types are handled by extractFieldValue which reports them
+    self.handler = VALUE_TYPE_HANDLERS.get(self.valueType)
+
+    # the columns of the 1:n output file of this field
+    self.outputFields = get1NOutputFields(fieldConfig, recordIDColumnName)
+
+# -----------------------------------------------------------------------------
+class ExtractionPlan(ExecutionPlan):
+  """Execution plan which additionally describes how the values of a record are extracted and written:
+     one FieldDescriptor per data field with its compiled expression, value type handler and split rules,
+     as well as the columns of the main output file and of the 1:n output files.
+
+  >>> config = {"recordIDExpression": "./id", "recordIDColumnName": "id", "dataFields": [{"columnName": "birthDate", "expression": "./birth", "valueType": "date", "keepOriginal": "true"}, {"columnName": "name", "expression": "./name", "valueType": "text", "splitCharacter": ";"}]}
+  >>> plan = ExtractionPlan(config)
+  >>> plan.mainOutputFields
+  ['id', 'birthDate-original', 'birthDate', 'name']
+  >>> [(f.slot, f.columnName, f.splitCharacter) for f in plan.fields]
+  [(0, 'birthDate', None), (1, 'name', ';')]
+  >>> plan.fields[0].outputFields
+  ['id', 'birthDate', 'birthDate-original', 'rule']
+  """
+
+  def __init__(self, config, dateConfig=None, monthMapping=None):
+    super().__init__(config, dateConfig, monthMapping)
+    startTime = time.perf_counter()
+
+    self.dateConfig = dateConfig
+    self.monthMapping = monthMapping
+    self.recordIDColumnName = config['recordIDColumnName']
+    self.identifierPrefix = config['recordIDPrefix'] if 'recordIDPrefix' in config else ''
+
+    # the repaired texts are counted, such that the repair can be switched off for data sources which never need it
+    self.encodingRepair = EncodingRepair(config.get('counters'))
+
+    # the field descriptors in the order of the config, i.e. the column order of the output
+    self.fields = [self._describeField(slot, fieldConfig) for slot, fieldConfig in enumerate(config['dataFields'])]
+
+    # define columns for the output based on config
+    self.mainOutputFields = [self.recordIDColumnName]
+    for field in self.fields:
+      if field.keepOriginal:
+        self.mainOutputFields.append(field.originalColumnName)
+      self.mainOutputFields.append(field.columnName)
+
+    self.compilationTime += time.perf_counter() - startTime
+
+  def _describeField(self, slot, fieldConfig):
+    field = FieldDescriptor(slot, fieldConfig, self.getXPath(fieldConfig['expression']), self.recordIDColumnName)
+    if 'subfields' in fieldConfig:
+      field.subfields = [SubfieldDescriptor(subfieldConfig, self.getXPath(subfieldConfig['expression']), field.fixEncoding) for subfieldConfig in fieldConfig['subfields']]
+      field.subfieldColumnNames = [subfield.columnName for subfield in field.subfields]
+      subSplits = {subfield.columnName: subfield.splitCharacter for subfield in field.subfields if subfield.splitCharacter is not None}
+      if subSplits:
+        field.subfieldSplitCharacters = subSplits
+    return field
+
+  def getFields(self, config, configKey):
+    """Returns the field descriptors of the given config key, the ones of dataFields are precomputed."""
+    if configKey == 'dataFields':
+      return self.fields
+    return [self._describeField(slot, fieldConfig) for slot, fieldConfig in enumerate(config[configKey])]
+
+  def extractValue(self, field, value, recordID, config):
+    """Returns the normalized form of the given text value of a field which is not of type json."""
+    if field.handler is None:
+      return extractFieldValue(value, field.valueType, recordID, config, self.dateConfig, self.monthMapping, field.columnName, self)
+    if not value:
+      return None
+    return field.handler(self, recordID, value.strip(), field.columnName)
+
+# -----------------------------------------------------------------------------
+def getRecordID(elem, config, plan=None):
+  """This function returns the identifier of the given record based on the recordIDExpression of the config.
+
+  >>> getRecordID(ET.fromstring("<record><id>1</id></record>"), {"recordIDExpression": "./id"})
+  '1'
+  >>> getRecordID(ET.fromstring("<record><other>1</other></record>"), {"recordIDExpression": "./id"})
+  ''
+
+  The expression is an ElementPath expression of elem.find, also with a compiled plan
+  >>> config = {"recordIDExpression": "./{http://example.org/}id", "dataFields": []}
+  >>> getRecordID(ET.fromstring('<record xmlns="http://example.org/"><id>1</id></record>'), config, ExecutionPlan(config))
+  '1'
+  """
+  if plan is None or plan.recordID is None:
+    return getElementValue(elem.find(config['recordIDExpression'], ALL_NS))
+
+  values = plan.recordID(elem)
+  return getElementValue(values[0] if values else None)
+
+# -----------------------------------------------------------------------------
+def passFilter(elem, filterConfig, compiledExpression=None):
   r"""This function checks if the given element passes the specified filter condition.
      If the expression of the filter finds several elements, all have to pass the filter.
 
@@ -651,7 +2191,10 @@ def passFilter(elem, filterConfig):
   filterExpression = filterConfig["expression"]
   condition = filterConfig["condition"]
 
-  values = elem.xpath(filterExpression, namespaces=ALL_NS)
+  if compiledExpression is not None:
+    values = compiledExpression(elem)
+  else:
+    values = elem.xpath(filterExpression, namespaces=ALL_NS)
   if condition == "exists" or condition == "exist":
     if values:
       return True
@@ -690,7 +2233,7 @@ def passFilter(elem, filterConfig):
 
   
 # -----------------------------------------------------------------------------
-def extractFieldValue(value, valueType, recordID, config, dateConfig, monthMapping, columnName):
+def extractFieldValue(value, valueType, recordID, config, dateConfig, monthMapping, columnName, plan=None):
 
   vNorm = None
   if value:
@@ -699,7 +2242,10 @@ def extractFieldValue(value, valueType, recordID, config, dateConfig, monthMappi
     value = value.strip()
 
     if valueType == 'date':
-      parsedDate, parsingRule = handleTypeDate(recordID, value, dateConfig, monthMapping)
+      if plan is not None:
+        parsedDate, parsingRule = handleTypeDate(recordID, value, dateConfig, monthMapping, plan.dateRuleEngine, plan.dateCache)
+      else:
+        parsedDate, parsingRule = handleTypeDate(recordID, value, dateConfig, monthMapping)
       # only add dates to the output that were parsed by any rule, otherwise they are part of the log
       # the handleTypeDate function will log it
       # vNorm will stay None and the calling function should handle it properly
@@ -721,27 +2267,64 @@ def extractFieldValue(value, valueType, recordID, config, dateConfig, monthMappi
   return vNorm
 
 # -----------------------------------------------------------------------------
-def handleTypeDate(recordID, value, dateConfig, monthMapping):
+def handleTypeDate(recordID, value, dateConfig, monthMapping, dateRuleEngine=None, dateCache=None, stageTimer=None):
 
-  datePatterns = dateConfig['datePatterns']
+  if stageTimer is not None:
+    startTime = time.perf_counter()
+
+  cachedResult = dateCache.get(value) if dateCache is not None else None
+  if cachedResult is not None:
+    vNorm, rule = cachedResult
+  else:
+    vNorm, rule = normalizeDate(value, dateConfig, monthMapping, dateRuleEngine)
+    if dateCache is not None:
+      dateCache.put(value, (vNorm, rule))
+
+  if stageTimer is not None:
+    stageTimer.add('dateNormalization', time.perf_counter() - startTime)
+
+  # the messages are logged for every occurrence, also if the result came from the cache
+  if rule == 'placeholder_value':
+    logger.warning(f'{recordID}: placeholder value "{value}" found instead of real data', extra={'identifier': recordID, 'message_type': csv_logger.MESSAGE_TYPES['INVALID_VALUE']})
+  elif rule != 'simplePattern' and not vNorm:
+    # log a warning, but also ensure that the value will not become part of the output
+    logger.error(f'{recordID}: no match with parseDate or parseComplexDate for {value}', extra={'identifier': recordID, 'message_type': csv_logger.MESSAGE_TYPES['INVALID_VALUE']})
 
-  vNorm = None
-  rule = 'placeholder_value'
-  try:
-    vNorm = parseDate(value, datePatterns)
-    rule = 'simplePattern'
-  except Exception as e:
-    # if the following is not true we simply go to the return statement that will have the default rule 'placeholder_value'
-    if value.replace('-','') == '': 
-      logger.warning(f'{recordID}: placeholder value "{value}" found instead of real data', extra={'identifier': recordID, 'message_type': csv_logger.MESSAGE_TYPES['INVALID_VALUE']})
-    if not value.replace('-','') == '': 
-      vNorm, rule  = parseComplexDate(value, dateConfig, monthMapping)
-      # log a warning, but also ensure that the value will not become part of the output
-      if not vNorm:
-        logger.error(f'{recordID}: no match with parseDate or parseComplexDate for {value}', extra={'identifier': recordID, 'message_type': csv_logger.MESSAGE_TYPES['INVALID_VALUE']})
-        
   return vNorm, rule
 
+# -----------------------------------------------------------------------------
+def normalizeDate(value, dateConfig, monthMapping, dateRuleEngine=None):
+  """Returns a tuple of the normalized date and the rule which was used, without logging anything.
+
+  >>> config = {"datePatterns": ["%Y"], "components": {"months": {}}, "rules": {}}
+  >>> normalizeDate("1900", config, {})
+  ('1900', 'simplePattern')
+  >>> normalizeDate("----", config, {})
+  (None, 'placeholder_value')
+  >>> normalizeDate("unknown", config, {})
+  (None, None)
+  """
+
+  if dateRuleEngine is not None and dateRuleEngine.patternParser is not None:
+    # fast path without strptime and exceptions
+    vNorm = dateRuleEngine.patternParser.parse(value)
+    if vNorm is not None:
+      return vNorm, 'simplePattern'
+  else:
+    try:
+      return parseDate(value, dateConfig['datePatterns']), 'simplePattern'
+    except Exception as e:
+      pass
+
+  # if the following is not true we simply return the default rule 'placeholder_value'
+  if value.replace('-','') == '':
+    return None, 'placeholder_value'
+
+  if dateRuleEngine is not None:
+    return dateRuleEngine.parse(value)
+  else:
+    return parseComplexDate(value, dateConfig, monthMapping)
+
 # -----------------------------------------------------------------------------
 def handleTypeISNIURL(recordID, value):
 
@@ -771,26 +2354,228 @@ def getOriginalColumnName(columnConfig):
   return columnConfig["columnName"] + "-original"
 
 # -----------------------------------------------------------------------------
-def create1NOutputWriters(config, outputFolder, prefix):
-  """This function returns a dictionary where each key is a column name and its value is a csv.DictWriter initialized with correct fieldnames.
+def get1NOutputFields(field, recordIDColumnName):
+  """Returns the columns of the 1:n output file of the given data field config entry.
+
+  >>> get1NOutputFields({"columnName": "place", "valueType": "json", "subfields": [{"columnName": "town"}, {"columnName": "country"}]}, "id")
+  ['id', 'town', 'country']
+  >>> get1NOutputFields({"columnName": "name", "valueType": "text", "keepOriginal": "true"}, "id")
+  ['id', 'name', 'name-original']
+  """
+  if field.get("valueType") == 'json':
+    return [recordIDColumnName] + [subfield["columnName"] for subfield in field.get("subfields", [])]
+
+  allColumnNames = [recordIDColumnName, field["columnName"]]
+  if "keepOriginal" in field and field["keepOriginal"] == "true":
+    allColumnNames.append(getOriginalColumnName(field))
+  if field.get("valueType") == 'date':
+    allColumnNames.append('rule')
+  return allColumnNames
+
+# -----------------------------------------------------------------------------
+def getExecutionFlag(config, name, default):
+  """Returns the on/off setting with the given name of the execution section of the config,
+     "true" and "false" are accepted as strings like the other flags of the config, and as JSON booleans.
+
+  >>> getExecutionFlag({"execution": {"marcFieldIndex": "false"}}, "marcFieldIndex", True)
+  False
+  >>> getExecutionFlag({"execution": {"marcFieldIndex": True}}, "marcFieldIndex", False), getExecutionFlag({}, "marcFieldIndex", True)
+  (True, True)
+  >>> getExecutionFlag({"execution": {"marcFieldIndex": "no"}}, "marcFieldIndex", True)
+  Traceback (most recent call last):
+  ...
+  ValueError: Invalid value "no" for marcFieldIndex in the execution section of the config, should be "true" or "false"
+  """
+  if "execution" not in config or name not in config["execution"]:
+    return default
+  value = str(config["execution"][name]).lower()
+  if value not in ("true", "false"):
+    raise ValueError(f'Invalid value "{config["execution"][name]}" for {name} in the execution section of the config, should be "true" or "false"')
+  return value == "true"
+
+# -----------------------------------------------------------------------------
+# on/off settings of the execution section of the config, see getExecutionFlag
+EXECUTION_FLAGS = ('marcFieldIndex', 'bytePreFilter')
+
+# -----------------------------------------------------------------------------
+def checkExecutionFlags(config):
+  """Raises a ValueError if one of the EXECUTION_FLAGS in the execution section of the config is neither true nor false.
+
+  >>> checkExecutionFlags({"execution": {"marcFieldIndex": "false", "bytePreFilter": True}})
+  >>> checkExecutionFlags({"execution": {"bytePreFilter": "yes"}})
+  Traceback (most recent call last):
+  ...
+  ValueError: Invalid value "yes" for bytePreFilter in the execution section of the config, should be "true" or "false"
+  """
+  for name in EXECUTION_FLAGS:
+    getExecutionFlag(config, name, False)
+
+# -----------------------------------------------------------------------------
+def getOutputBufferSize(config):
+  """Returns the buffer size in bytes of the output files, it can be configured with outputBufferSize in the execution section of the config.
+
+  >>> getOutputBufferSize({"execution": {"outputBufferSize": 4096}})
+  4096
+  >>> getOutputBufferSize({})
+  1048576
+  """
+  return int(config["execution"]["outputBufferSize"]) if "execution" in config and "outputBufferSize" in config["execution"] else 1024*1024
+
+# -----------------------------------------------------------------------------
+def getPipelineQueueDepth(config):
+  """Returns how many batches (or chunks of regular processing) are read ahead by a reader thread and how many row lists wait for the writer thread,
+     it can be configured with pipelineQueueDepth in the execution section of the config. 0 disables the reader and writer threads.
+
+  >>> getPipelineQueueDepth({"execution": {"pipelineQueueDepth": 2}})
+  2
+  >>> getPipelineQueueDepth({})
+  0
+  """
+  return int(config["execution"]["pipelineQueueDepth"]) if "execution" in config and "pipelineQueueDepth" in config["execution"] else 0
+
+# -----------------------------------------------------------------------------
+def getCompressionExtension(filename):
+  """Returns the extension of the compression of the given file, or an empty string for an uncompressed file.
+
+  >>> getCompressionExtension('my-data.csv.gz')
+  '.gz'
+  >>> getCompressionExtension('my-data.csv')
+  ''
+  """
+  extension = os.path.splitext(filename)[1]
+  return extension if extension in COMPRESSED_FILE_OPENERS else ''
+
+# -----------------------------------------------------------------------------
+class CompressedOutputFile():
+  """Text output file which is compressed on a background thread, the compression is determined by the file extension.
+     Written text is collected in blocks of about bufferSize characters, full blocks are passed to the thread via a queue
+     which holds at most maxPendingBlocks blocks. zlib, bz2 and lzma release the GIL while they compress,
+     hence the extraction continues while a block is compressed.
+
+  >>> import tempfile
+  >>> filename = os.path.join(tempfile.mkdtemp(), 'out.csv.gz')
+  >>> with CompressedOutputFile(filename, bufferSize=4) as outFile:
+  ...   _ = outFile.write('id,name\\n')
+  ...   _ = outFile.write('1,a\\n')
+  >>> gzip.open(filename, 'rt').read().splitlines()
+  ['id,name', '1,a']
+  """
+
+  def __init__(self, filename, bufferSize=1024*1024, maxPendingBlocks=4, encoding='utf-8'):
+    self.filename = filename
+    self.file = COMPRESSED_FILE_OPENERS[getCompressionExtension(filename)](filename, 'wb')
+    self.bufferSize = bufferSize
+    self.encoding = encoding
+    self.buffer = []
+    self.bufferedSize = 0
+    self.error = None
+    self.closed = False
+
+    self.blocks = queue.Queue(maxsize=maxPendingBlocks)
+    self.thread = threading.Thread(target=self._compressBlocks, daemon=True)
+    self.thread.start()
+
+  def _compressBlocks(self):
+    """Writes the blocks of the queue to the compressed file until None is received."""
+    while True:
+      block = self.blocks.get()
+      if block is None:
+        break
+      # after an error the remaining blocks are still taken from the queue, such that the writer is not blocked
+      if self.error is None:
+        try:
+          self.file.write(block)
+        except Exception as e:
+          self.error = e
+
+  def write(self, text):
+    self.buffer.append(text)
+    self.bufferedSize += len(text)
+    if self.bufferedSize >= self.bufferSize:
+      self.flush()
+    return len(text)
+
+  def flush(self):
+    """Passes the collected text to the compression thread, it does not wait until it is compressed."""
+    if self.error is not None:
+      raise self.error
+    if self.buffer:
+      self.blocks.put(''.join(self.buffer).encode(self.encoding))
+      self.buffer = []
+      self.bufferedSize = 0
+
+  def close(self):
+    """Waits until all text is compressed and closes the file."""
+    if self.closed:
+      return
+    self.closed = True
+    try:
+      self.flush()
+    finally:
+      self.blocks.put(None)
+      self.thread.join()
+      self.file.close()
+    if self.error is not None:
+      raise self.error
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+# -----------------------------------------------------------------------------
+def openOutputFile(filename, mode='w', bufferSize=1024*1024):
+  """Opens the given output file for writing text.
+     Files with the extension of a compression (e.g. .csv.gz) are compressed on a background thread, they can only be written from the start.
+  """
+  if getCompressionExtension(filename):
+    if mode != 'w':
+      raise ValueError(f'The compressed output file "{filename}" cannot be opened with mode "{mode}"')
+    return CompressedOutputFile(filename, bufferSize=bufferSize)
+  return open(filename, mode, buffering=bufferSize)
+
+# -----------------------------------------------------------------------------
+def create1NOutputWriters(config, outputFolder, prefix, fileHandles=None, mode='w', compression=''):
+  """This function returns a dictionary where each key is a column name and its value is a BatchedCSVWriter initialized with correct fieldnames.
      The function replaces the previous nested dictionary and list comprehension: it became to cluttered and adding subfield headings was difficult.
+     If a dictionary fileHandles is given, the opened files are added to it with their filename as key, such that the caller can flush and close them.
+     With a compression extension (e.g. '.gz', see getCompressionExtension) the files are compressed.
   """
+  bufferSize = getOutputBufferSize(config)
   outputWriters = {}
   for field in config["dataFields"]:
     columnName = field["columnName"]
-    if field["valueType"] == 'json':
-      allColumnNames = [config["recordIDColumnName"]] + [subfield["columnName"] for subfield in field["subfields"]]
-    else:
-      allColumnNames = [config["recordIDColumnName"], columnName]
-      if "keepOriginal" in field and field["keepOriginal"] == "true":
-        allColumnNames.append(getOriginalColumnName(field))
-      if field["valueType"] == 'date':
-        allColumnNames.append('rule')
-    outputFilename = os.path.join(outputFolder, f'{prefix}-{columnName}.csv')
-    outputWriters[field["columnName"]] = csv.DictWriter(open(outputFilename, 'w'), fieldnames=allColumnNames, delimiter=',') 
+    allColumnNames = get1NOutputFields(field, config["recordIDColumnName"])
+    outputFilename = os.path.join(outputFolder, f'{prefix}-{columnName}.csv{compression}')
+    outputFile = openOutputFile(outputFilename, mode, bufferSize=bufferSize)
+    if fileHandles is not None:
+      fileHandles[outputFilename] = outputFile
+    outputWriters[field["columnName"]] = BatchedCSVWriter(outputFile, allColumnNames, delimiter=',')
 
   return outputWriters
 
+# -----------------------------------------------------------------------------
+def concatenateCSVFiles(inputFilenames, outputFilename, bufferSize=1024*1024):
+  """Concatenates CSV files with the same header in the given order, the header is only written once.
+     Empty input files are skipped, the files are copied as bytes such that the rows remain unchanged.
+     The output file is compressed if it has the extension of a compression.
+  """
+  headerWritten = False
+  compression = getCompressionExtension(outputFilename)
+  opener = COMPRESSED_FILE_OPENERS[compression] if compression else open
+  with opener(outputFilename, 'wb') as outFile:
+    for inputFilename in inputFilenames:
+      with open(inputFilename, 'rb') as inFile:
+        header = inFile.readline()
+        if not header:
+          continue
+        if not headerWritten:
+          outFile.write(header)
+          headerWritten = True
+        shutil.copyfileobj(inFile, outFile, bufferSize)
+
 # -----------------------------------------------------------------------------
 def find_record_positions(filename, tagName, chunkSize=1024*1024):
     """
@@ -802,64 +2587,84 @@ def find_record_positions(filename, tagName, chunkSize=1024*1024):
     - chunkSize: The size of each chunk to read from the file.
 
     Returns:
-    - A list of tuples where each tuple contains the start and end byte positions of a record.
+    - A RecordPositions object which returns a (start, end) tuple of byte positions per record.
+    """
+    return RecordPositions(iter_record_positions(filename, tagName, chunkSize))
+
+# -----------------------------------------------------------------------------
+def iter_record_positions(filename, tagName, chunkSize=1024*1024, startPosition=0):
+    """
+    Lazy version of find_record_positions: yields a (start, end) tuple of byte positions as soon as a record is found.
+    The scan starts at startPosition, which should be the end of a record or 0.
+    """
+    with open(filename, 'rb') as file:
+        file.seek(startPosition)
+        yield from iter_stream_record_positions(file, tagName, chunkSize=chunkSize, startPosition=startPosition)
+
+# -----------------------------------------------------------------------------
+def iter_stream_record_positions(file, tagName, chunkSize=1024*1024, startPosition=0):
+    """
+    Yields a (start, end) tuple of byte positions for each record found while reading the given binary file object,
+    such as a DecompressedInputFile, chunk by chunk. startPosition is the position from which the file object is read.
+
+    >>> list(iter_stream_record_positions(BytesIO(b'<c><record>1</record><record>2</record></c>'), 'record', chunkSize=8))
+    [(3, 21), (21, 39)]
     """
     record_start_pattern = re.compile(fr'<{tagName}.*?>'.encode('utf-8'))
     record_end_pattern = re.compile(fr'</{tagName}>'.encode('utf-8'))
     
-    positions = []
-    current_position = 0
+    current_position = startPosition
     buffer = b''
     pending_start = None
     started_pending = False
     last_position = (-1, -1)
-    
-    with open(filename, 'rb') as file:
 
-        while True:
-            chunk = file.read(chunkSize)
-            if not chunk:
-                break
-
-            # Keep last buffer tail and track absolute positions
-            buffer += chunk
-
-            # Handle the case where records might be split across chunks
-            if pending_start is not None:
-                # Search for the end tag in the combined buffer
-                end_match = record_end_pattern.search(buffer)
-                if end_match:
-                    end_pos = end_match.end() + current_position - len(buffer) + len(chunk)
-                    if (pending_start, end_pos) != last_position:
-                      positions.append((pending_start, end_pos))
-                      last_position = (pending_start, end_pos)
-                    pending_start = None
-
-            # Search for start and end positions in the current buffer
-            for match_start in record_start_pattern.finditer(buffer):
-                if pending_start is None:
-                    # If no pending start, mark the start position
-                    pending_start = match_start.start() + current_position - len(buffer) + len(chunk)
-                
-                # Look for the corresponding end tag after the start tag
-                end_pos_search_start = match_start.end()
-                end_match = record_end_pattern.search(buffer, end_pos_search_start)
-                if end_match:
-                    # If an end tag is found, calculate the absolute position and store
-                    end_pos = end_match.end() + current_position - len(buffer) + len(chunk)
-                    if (pending_start, end_pos) != last_position:
-                      positions.append((pending_start, end_pos))
-                      last_position = (pending_start, end_pos)
-                    pending_start = None
-
-            # Update the current position to reflect the amount of the file read so far
-            current_position += len(chunk)
+    while True:
+        chunk = file.read(chunkSize)
+        if not chunk:
+            break
+
+        # Keep last buffer tail and track absolute positions
+        buffer += chunk
+
+        # Handle the case where records might be split across chunks
+        if pending_start is not None:
+            # Search for the end tag in the combined buffer
+            end_match = record_end_pattern.search(buffer)
+            if end_match:
+                end_pos = end_match.end() + current_position - len(buffer) + len(chunk)
+                if (pending_start, end_pos) != last_position:
+                  yield (pending_start, end_pos)
+                  last_position = (pending_start, end_pos)
+                pending_start = None
+
+        # Search for start and end positions in the current buffer
+        for match_start in record_start_pattern.finditer(buffer):
+            if pending_start is None:
+                # If no pending start, mark the start position
+                pending_start = match_start.start() + current_position - len(buffer) + len(chunk)
             
-            # Retain the last part of the buffer (to handle cases where tags span chunks)
-            buffer_overlap = len(record_end_pattern.pattern)
-            buffer = buffer[-buffer_overlap:]
-
-    return positions
+            # Look for the corresponding end tag after the start tag
+            end_pos_search_start = match_start.end()
+            end_match = record_end_pattern.search(buffer, end_pos_search_start)
+            if end_match:
+                # If an end tag is found, calculate the absolute position and store
+                end_pos = end_match.end() + current_position - len(buffer) + len(chunk)
+                if (pending_start, end_pos) != last_position:
+                  yield (pending_start, end_pos)
+                  last_position = (pending_start, end_pos)
+                pending_start = None
+
+        # Update the current position to reflect the amount of the file read so far
+        current_position += len(chunk)
+        
+        # Retain the last part of the buffer (to handle cases where tags span chunks)
+        # a start tag with attributes can be longer than the end tag, hence an unfinished tag is retained completely
+        buffer_overlap = len(record_end_pattern.pattern)
+        last_tag_start = buffer.rfind(b'<')
+        if last_tag_start != -1 and buffer.find(b'>', last_tag_start) == -1:
+            buffer_overlap = max(buffer_overlap, len(buffer) - last_tag_start)
+        buffer = buffer[-buffer_overlap:]
 
 # -----------------------------------------------------------------------------
 def needs_encoding_fixing(text):
@@ -889,6 +2694,47 @@ def fix_encoding(text):
         # Return the original also for issues, encoding of invalid input can not be fixed
         return text
 
+# -----------------------------------------------------------------------------
+class EncodingRepair():
+  """Repairs texts whose UTF-8 bytes were wrongly decoded as Latin-1 (e.g. mÃ©ridionaux instead of méridionaux),
+     detection and repair are done with a single encode-decode round trip and pure ASCII texts are skipped without one.
+     The number of repaired texts is counted as repairedEncodingCounter in the given counters dictionary, usually config['counters'].
+
+  >>> repair = EncodingRepair()
+  >>> repair.repair('Ecole des Pays-Bas mÃ©ridionaux'), repair.repair('méridionaux'), repair.repair('plain ASCII')
+  ('Ecole des Pays-Bas méridionaux', 'méridionaux', 'plain ASCII')
+  >>> repair.counters['repairedEncodingCounter']
+  1
+  """
+
+  def __init__(self, counters=None):
+    self.counters = counters if counters is not None else {}
+    self.counters.setdefault('repairedEncodingCounter', 0)
+
+  def repair(self, text):
+    """Returns the given text, repaired if it is wrongly encoded."""
+    if text is None or text.isascii():
+      return text
+    try:
+      repaired = text.encode('latin1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+      # characters outside of Latin-1 or no valid UTF-8: the text was decoded correctly
+      return text
+    if repaired != text:
+      self.counters['repairedEncodingCounter'] += 1
+    return repaired
+
+  def repairTexts(self, elements):
+    """Returns the texts of the given elements which have text, wrongly encoded texts are repaired."""
+    return [self.repair(e.text) for e in elements if e.text is not None]
+
+  def repairElement(self, elem):
+    """Repairs the text of the given element in place if it is wrongly encoded."""
+    text = elem.text
+    repaired = self.repair(text)
+    if repaired is not text:
+      elem.text = repaired
+
 # -----------------------------------------------------------------------------
 def split_values_with_config(data, splitConfig):
     processed = {}
@@ -909,7 +2755,168 @@ def split_values_with_config(data, splitConfig):
 
 
 # -----------------------------------------------------------------------------
-def getValueList(elem, config, configKey, dateConfig, monthMapping):
+def _getTexts(elements):
+  """Returns the texts of the given elements which have text."""
+  return [e.text for e in elements if e.text is not None]
+
+# -----------------------------------------------------------------------------
+def getValueDict(field, value):
+  """Returns the dictionary form of a value of the given field as it is stored in RecordValues,
+     i.e. the form in which getValueList returns the values.
+
+  >>> plan = ExtractionPlan({"recordIDExpression": "./id", "recordIDColumnName": "id", "dataFields": [{"columnName": "birthDate", "expression": "./birth", "valueType": "date", "keepOriginal": "true"}]})
+  >>> getValueDict(plan.fields[0], ('1858', '1858.', 'simplePattern'))
+  {'birthDate': '1858', 'rule': 'simplePattern', 'birthDate-original': '1858.'}
+  """
+  if field.valueType == 'json':
+    return dict(zip(field.subfieldColumnNames, value))
+
+  valueDict = {field.columnName: value[0]}
+  if field.isDate and value[0] is not None:
+    # only parsed dates have a rule
+    valueDict['rule'] = value[-1]
+  if field.keepOriginal:
+    valueDict[field.originalColumnName] = value[1]
+  return valueDict
+
+# -----------------------------------------------------------------------------
+class RecordValues():
+  """The values extracted from a record: one list per data field, at the slot of its FieldDescriptor,
+     with one tuple per value in the column order of the 1:n output file of the field, without the identifier column.
+     Hence a 1:n output row is the record identifier followed by the tuple, no dictionaries are created per value.
+     Values of json fields are the texts of their subfields, in the order of the subfields.
+
+  >>> config = {"recordIDExpression": "./id", "recordIDColumnName": "id", "dataFields": [{"columnName": "name", "expression": "./name", "valueType": "text", "keepOriginal": "true"}]}
+  >>> values = extractRecordValues(ET.fromstring('<r><id>1</id><name> x </name></r>'), config, 'dataFields', {}, {})
+  >>> values.recordID, values.values
+  ('1', [[('x', ' x ')]])
+  """
+
+  __slots__ = ('recordID', 'fields', 'values')
+
+  def __init__(self, recordID, fields):
+    self.recordID = recordID
+    self.fields = fields
+    self.values = [[] for field in fields]
+
+  def getValueLists(self, plan):
+    """Returns the values as dictionary of lists of dictionaries per column, see getValueList."""
+    recordData = {field.columnName: [] for field in plan.fields}
+    recordData[plan.recordIDColumnName] = self.recordID
+    for field, values in zip(self.fields, self.values):
+      recordData[field.columnName] = [getValueDict(field, value) for value in values]
+    return {k:"" if not v else v for k,v in recordData.items()}
+
+# -----------------------------------------------------------------------------
+def extractRecordValues(elem, config, configKey, dateConfig, monthMapping, plan=None):
+  """This function extracts all values from the XML element elem according to the config and returns them as RecordValues,
+     values of a column which is not kept with its original value are only added once (https://github.com/kbrbe/xml-to-csv/issues/14).
+
+  >>> config = {"recordIDExpression": "./id", "recordIDColumnName": "id", "dataFields": [{"columnName": "name", "expression": "./name", "valueType": "text"}]}
+  >>> extractRecordValues(ET.fromstring('<r><id>1</id><name>a</name><name>b</name><name>a</name></r>'), config, 'dataFields', {}, {}).values
+  [[('a',), ('b',)]]
+  """
+
+  # first check if we can extract the data we should extract
+  #
+  if configKey not in config:
+    logger.error(f'No key "{configKey}" in config!', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
+    return None
+
+  if plan is None:
+    plan = ExtractionPlan(config, dateConfig, monthMapping)
+
+  timer = plan.stageTimer
+  recordID = timed(timer, 'xpathEvaluation', getRecordID, elem, config, plan)
+
+  fields = plan.getFields(config, configKey)
+  recordValues = RecordValues(recordID, fields)
+
+  # check each datafield description
+  #
+  for field in fields:
+    columnName = field.columnName
+    values = recordValues.values[field.slot]
+
+    # the values which are already added, only used for the columns without original value
+    addedValues = set()
+
+    # process all extracted data (possibly more than one value)
+    #
+    for v in timed(timer, 'xpathEvaluation', field.xpath, elem):
+
+      if field.valueType is None:
+        logger.error(f'No valueType given!', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
+
+      elif field.valueType == 'json':
+        if field.subfields is not None:
+          subfieldTexts = []
+
+          # collect subfield data in the order of the subfields
+          #
+          atLeastOneValue = False
+          for subfield in field.subfields:
+
+            # we are not doing recursive calls here
+            if subfield.valueType == 'json':
+              logger.error(f'type "json" not allowed for subfields', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
+              subfieldTexts.append('')
+              continue
+            subfieldValues = timed(timer, 'xpathEvaluation', subfield.xpath, v)
+
+            # a subfield should not appear several times
+            # if it does, print a warning and concatenate output instead of using an array
+            #
+            subfieldDelimiter = ';'
+            if len(subfieldValues) > 1:
+              logger.warning(f'multiple values for subfield {subfield.columnName} in record {recordID} (concatenated with {subfieldDelimiter})', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
+            if subfield.fixEncoding:
+              subfieldTextValues = timed(timer, 'encodingFixes', plan.encodingRepair.repairTexts, subfieldValues)
+            else:
+              subfieldTextValues = _getTexts(subfieldValues)
+
+            if subfieldTextValues:
+              atLeastOneValue = True
+            subfieldTexts.append(subfieldDelimiter.join(subfieldTextValues))
+
+          if atLeastOneValue:
+            # add the subfield texts as one value of this column
+            # https://github.com/kbrbe/xml-to-csv/issues/13
+            values.append(tuple(subfieldTexts))
+        else:
+          logger.error(f'JSON specified, but no subfields given', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
+      else:
+        # other value types require to analyze the text content
+        # parsedValue could be None, this should handled appropriately
+        if field.fixEncoding:
+          timed(timer, 'encodingFixes', plan.encodingRepair.repairElement, v)
+        text = v.text
+        parsedValue = plan.extractValue(field, text, recordID, config)
+
+        # bad practice: different types of return values
+        # temporarily solution to additionally get parsing rule for dates
+        if isinstance(parsedValue, dict):
+          value, rule = parsedValue[columnName], parsedValue['rule']
+        else:
+          value, rule = parsedValue, None
+
+        if field.keepOriginal:
+          # avoid processing parsedValues that are None
+          if parsedValue is not None:
+            values.append((value, text, rule) if field.isDate else (value, text))
+        elif isinstance(parsedValue, dict):
+          # a parsed date is never the same as an already added value
+          values.append((value, rule))
+        elif value not in addedValues:
+          # check if we did not already add the exact same name already (https://github.com/kbrbe/xml-to-csv/issues/14)
+          # no keepOriginal check, because we don't expect this for names (possible bad practice to fix?)
+          addedValues.add(value)
+          values.append((value, rule) if field.isDate else (value,))
+
+  return recordValues
+
+# -----------------------------------------------------------------------------
+def getValueList(elem, config, configKey, dateConfig, monthMapping, plan=None):
   """This function extracts all values from the XML element elem according to the config
   Example output: {'isni': '', 'bnf': '', 'name': [{'name': 'Hayashi Motoharu'}], 'birthDate': [{'birthDate': '1858', 'rule': 'simplePattern'}], 'deathDate': [{'deathDate': None}], 'birthPlace': [{'birthTown': 'Osaka', 'birthCountry': 'Japon'}], 'deathPlace': '', 'autID': '6840'}
 
@@ -920,6 +2927,8 @@ def getValueList(elem, config, configKey, dateConfig, monthMapping):
   * date can have only one subkey which is none
   * in this example subkeys for places, because it is of type json
 
+  processRecord uses the compact RecordValues of extractRecordValues instead.
+
   Testing that text values are correctly encoded
   >>> config0 = {"recordIDExpression": "./id", "recordIDColumnName": "id", "dataFields": [{"columnName": "alternateName", "expression": "./alternateName", "valueType": "text"}]}
   >>> configKey = "dataFields"
@@ -934,236 +2943,116 @@ def getValueList(elem, config, configKey, dateConfig, monthMapping):
   {'name': [{'lastName': 'Méridionaux'}], 'id': '1'}
   """
 
-  keyParts = []
+  if plan is None and configKey in config:
+    plan = ExtractionPlan(config, dateConfig, monthMapping)
 
-  # first check if we can extract the data we should extract
-  #
-  if configKey not in config:
-    logger.error(f'No key "{configKey}" in config!', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
+  recordValues = extractRecordValues(elem, config, configKey, dateConfig, monthMapping, plan)
+  if recordValues is None:
     return None
+  return recordValues.getValueLists(plan)
 
-  recordID = getElementValue(elem.find(config['recordIDExpression'], ALL_NS))
-
-  # initialize the dictionary for the output CSV of this record
-  recordData = {f["columnName"]: [] for f in config["dataFields"]}
-  recordData[config["recordIDColumnName"]] = recordID
-
-  # check each datafield description config entry
-  #
-  for p in config[configKey]:
-    expression = p['expression']
-    columnName = p['columnName']
-
-    # extract the data by using xpath
-    #
-    values = elem.xpath(expression, namespaces=ALL_NS)
-
-    # process all extracted data (possibly more than one value)
-    #
-    if values:
-      for v in values: 
-
-        if 'valueType' in p:
-          valueType = p['valueType']
-
-          if valueType == 'json':
-            if "subfields" in p:
-              subfieldConfigEntries = p['subfields']
-              allSubfieldsData = {f["columnName"]: [] for f in subfieldConfigEntries}
-
-              # collect subfield data in a dictionary
-              #
-              atLeastOneValue = False
-              for subfieldConfig in subfieldConfigEntries:
-                subfieldColumnName = subfieldConfig['columnName']
-                subfieldExpression = subfieldConfig['expression']
-                subfieldValueType = subfieldConfig['valueType']
-
-                # we are not doing recursive calls here
-                if subfieldValueType == 'json':
-                  logger.error(f'type "json" not allowed for subfields', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
-                  continue
-                subfieldValues = v.xpath(subfieldExpression, namespaces=ALL_NS)
-
-                # a subfield should not appear several times
-                # if it does, print a warning and concatenate output instead of using an array
-                #
-                subfieldDelimiter = ';'
-                if len(subfieldValues) > 1:
-                  logger.warning(f'multiple values for subfield {subfieldColumnName} in record {recordID} (concatenated with {subfieldDelimiter})', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
-                subfieldTextValues = [fix_encoding(s.text) if needs_encoding_fixing(s.text) else s.text for s in subfieldValues if s.text is not None]
-          
-                if subfieldTextValues:
-                  atLeastOneValue = True
-                allSubfieldsData[subfieldColumnName] = subfieldDelimiter.join(subfieldTextValues)
-         
-              if atLeastOneValue:
-                # add the current dictionary of subfield lists to the value of this column
-                # https://github.com/kbrbe/xml-to-csv/issues/13
-                recordData[columnName].append(allSubfieldsData)
-            else:
-              logger.error(f'JSON specified, but no subfields given', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
-          else:
-            # other value types require to analyze the text content
-            # parsedValue could be None, this should handled appropriately
-            if needs_encoding_fixing(v.text):
-              v.text = fix_encoding(v.text)
-            parsedValue = extractFieldValue(v.text, valueType, recordID, config, dateConfig, monthMapping, columnName)
-
-            # add original value for current data field if necessary
-            if "keepOriginal" in p and p["keepOriginal"] == "true":
-              originalColumnName = getOriginalColumnName(p)
-
-              # bad practice: different types of return values
-              # temporarily solution to additionally get parsing rule for dates
-              if isinstance(parsedValue, dict):               
-                dictToAppend = parsedValue
-                dictToAppend.update({originalColumnName: v.text})
-                recordData[columnName].append(dictToAppend)
-              elif parsedValue is not None:
-                # elif instead of else to avoid processing parsedValues that are None
-                recordData[columnName].append({columnName: parsedValue, originalColumnName: v.text})
-            else:
-              # check if we did not already add the exact same name already (https://github.com/kbrbe/xml-to-csv/issues/14)
-              # no keepOriginal check, because we don't expect this for names (possible bad practice to fix?)
-              existingValues = [colDict[columnName] for colDict in recordData[columnName]]
-              if parsedValue not in existingValues:
-                # bad practice: different types of return values
-                # temporarily solution to additionally get parsing rule for dates
-                if isinstance(parsedValue, dict):               
-                  dictToAppend = parsedValue
-                  recordData[columnName].append(dictToAppend)
-                else:
-                  recordData[columnName].append({columnName: parsedValue})
-
-        else:
-          logger.error(f'No valueType given!', extra={'message_type': csv_logger.MESSAGE_TYPES['CONFIG_ERROR']})
-    
-  recordData = {k:"" if not v else v for k,v in recordData.items()}
-  return recordData
+# -----------------------------------------------------------------------------
+def _addToMainOutputRow(outputRow, columnName, valueDict):
+  """Adds a value in dictionary form (see getValueDict) to the row of the main output file."""
+  if columnName in valueDict and 'rule' not in valueDict:
+    # the result contains a subfield with the same name as the column
+    # i.e. not type json, but a regular column with possible original
+    for valueColumnName, singleValue in valueDict.items():
+      singleValue = singleValue if singleValue else ''
+      if valueColumnName in outputRow:
+        outputRow[valueColumnName].append(singleValue)
+      else:
+        outputRow[valueColumnName] = [singleValue]
+  else:
+    # the result contains subfields (i.e. type json), write as-is
+    outputRow[columnName].append(valueDict)
 
 # -----------------------------------------------------------------------------
-def processRecord(elem, config, dateConfig, monthMapping, outputWriter, files, prefix):
+def processRecord(elem, config, dateConfig, monthMapping, outputWriter, files, prefix, plan=None):
+
+  # without a plan created upfront (see main), the expressions are compiled for this record only
+  if plan is None:
+    plan = ExtractionPlan(config, dateConfig, monthMapping)
 
-  if "recordFilter" in config:
+  if plan.recordFilter is not None:
     try:
-      if not passFilter(elem, config["recordFilter"]):
+      if not passFilter(elem, config["recordFilter"], plan.recordFilter):
         config['counters']['filteredRecordCounter'] += 1
         return None
     except Exception as e:
-        recordID = getElementValue(elem.find(config['recordIDExpression'], ALL_NS))
         config['counters']['filteredRecordExceptionCounter'] += 1
         return None
 
-  recordData = getValueList(elem, config, "dataFields", dateConfig, monthMapping)
+  recordValues = extractRecordValues(elem, config, "dataFields", dateConfig, monthMapping, plan)
 
-  identifierPrefix = config["recordIDPrefix"] if "recordIDPrefix" in config else ''
+  recordIDColumnName = plan.recordIDColumnName
+  recordID = plan.identifierPrefix + recordValues.recordID
 
   # (1) write output to the general CSV file
-  outputRow = {config["recordIDColumnName"]: identifierPrefix + recordData[config["recordIDColumnName"]]}
-  for columnName, extractedValues in recordData.items():
-    if columnName != config["recordIDColumnName"]:
-      outputRow[columnName] = []
-      if extractedValues:
-        # there are one or more results for this column
-        for valueDict in extractedValues:
-          if columnName in valueDict and 'rule' not in valueDict:
-            # the result contains a subfield with the same name as the column
-            # i.e. not type json, but a regular column with possible original
-            for valueColumnName, singleValue in valueDict.items():
-              singleValue = singleValue if singleValue else ''
-              if valueColumnName in outputRow:
-                outputRow[valueColumnName].append(singleValue)
-              else:
-                outputRow[valueColumnName] = [singleValue]
-
-          else:
-            # the result contains subfields (i.e. type json), write as-is
-            outputRow[columnName].append(valueDict)
+  outputRow = {recordIDColumnName: recordID}
+  for field, values in zip(plan.fields, recordValues.values):
+    columnName = field.columnName
+    if not values:
+      outputRow[columnName] = ''
+      continue
+
+    # there are one or more results for this column
+    columnValues = []
+    originalValues = []
+    outputRow[columnName] = columnValues
+    for value in values:
+      if field.valueType == 'json' or (field.isDate and value[0] is not None):
+        # subfields and parsed dates with their rule are written as dictionary
+        _addToMainOutputRow(outputRow, columnName, getValueDict(field, value))
       else:
-        outputRow[columnName] = ''
-  outputWriter.writerow(outputRow)
+        columnValues.append(value[0] if value[0] else '')
+        if field.keepOriginal:
+          originalValues.append(value[1] if value[1] else '')
+    if originalValues:
+      outputRow[field.originalColumnName] = originalValues
+  timed(plan.stageTimer, 'csvWriting', outputWriter.writerow, outputRow)
 
-  splitCharacters = {c['columnName']: c['splitCharacter'] for c in config['dataFields'] if 'splitCharacter' in c }
-  splitCharactersSubfields = {c['columnName']: c['splitCharacter'] for c in config['dataFields'] if 'splitCharacter' in c }
-  columnTypes = {c['columnName']: c['valueType'] for c in config['dataFields'] if 'valueType' in c }
+  # (2) Create a CSV output file for each selected columns to resolve 1:n relationships
+  if prefix != "":
 
-  subFieldSplitCharacters = {}
+    for field, values in zip(plan.fields, recordValues.values):
+      if not values:
+        continue
+      writeRow = getTupleWriter(files[field.columnName], field.outputFields)
 
-  for field in config["dataFields"]:
-    if field.get("valueType") == "json":
-        subSplits = {
-            sf["columnName"]: sf["splitCharacter"]
-            for sf in field.get("subfields", [])
-            if "splitCharacter" in sf
-        }
-        if subSplits:
-            subFieldSplitCharacters[field["columnName"]] = subSplits
+      # simple 1:n relationship: one row per value
+      # the value tuple already has the columns of the 1:n output file, e.g. the parsed value and the original value
+      for value in values:
 
-  # (2) Create a CSV output file for each selected columns to resolve 1:n relationships
-  if prefix != "":
-    recordID = recordData[config["recordIDColumnName"]]
-
-    for columnName, valueList in recordData.items():
-
-      # this is a content column specified in "dataFields" (not the ID column)
-      if valueList and columnName != config["recordIDColumnName"]:
-
-
-        # simple 1:n relationship: one row per value
-        # but it is one dictionary per relationship, 
-        # because we eventually have a whole dictionary with subfields like the parsed value and the original value
-        for v in valueList:
-
-          # skip if none, e.g. if {"birthDate": {"birthDate": None} }
-          if any(v.values()):
-
-            # We have to do the splitCharacter check, either on field or subfields
-            # first, are there subfields?
-            if columnName in columnTypes and columnTypes[columnName] == 'json':
-              # yes we have subfields, does any of the subfields have a split character?
-              # example if subfields: v = {'place': 'Ghent ; Gent', 'country': 'Belgium ; België'}
-              if columnName in subFieldSplitCharacters:
-                subSplitConfig = subFieldSplitCharacters[columnName]
-                jsonRows = split_values_with_config(v, subSplitConfig)
-
-                for row in jsonRows:
-                  outputRow = row
-                  outputRow.update({config["recordIDColumnName"]: identifierPrefix + recordID})
-                  files[columnName].writerow(outputRow)
-              else:
-                # no splitting needed, regular writing to output (like in the general else case)
-                outputRow = v
-                outputRow.update({config["recordIDColumnName"]: identifierPrefix + recordID})
-                files[columnName].writerow(outputRow)
+        # skip if none, e.g. if a birthDate could not be parsed
+        if any(value):
+
+          # We have to do the splitCharacter check, either on field or subfields
+          # first, are there subfields?
+          if field.valueType == 'json':
+            # yes we have subfields, does any of the subfields have a split character?
+            # example if subfields: value = ('Ghent ; Gent', 'Belgium ; België')
+            if field.subfieldSplitCharacters is not None:
+              jsonRows = split_values_with_config(dict(zip(field.subfieldColumnNames, value)), field.subfieldSplitCharacters)
+              for row in jsonRows:
+                timed(plan.stageTimer, 'csvWriting', writeRow, (recordID,) + tuple(row[name] for name in field.subfieldColumnNames))
+            else:
+              # no splitting needed, regular writing to output (like in the general else case)
+              timed(plan.stageTimer, 'csvWriting', writeRow, (recordID,) + value)
+          else:
+            # no subfields, let's check if we have to split?
+            if field.splitCharacter is not None:
+              # example no subfields: value = ('value1 ; value2',)
+              # there can be an original value and a rule after the value, but we don't have to touch them
+              for s in value[0].split(field.splitCharacter):
+                if s != '':
+                  timed(plan.stageTimer, 'csvWriting', writeRow, (recordID, s.strip()) + value[1:])
             else:
-              # no subfields, let's check if we have to split?
-              if columnName in splitCharacters and splitCharacters[columnName] != '':
-                # example no subfields: v = {'field': 'value1 ; value2'}
-                # there can be a separate key 'field-original', but we don't have to touch it
-                splittedValues = v[columnName].split(splitCharacters[columnName])
-                for s in splittedValues:
-                  if s != '':
-                    outputRow = v
-                    outputRow[columnName] = s.strip()
-                    outputRow.update({config["recordIDColumnName"]: identifierPrefix + recordID})
-                    files[columnName].writerow(outputRow)
-                     
-              else:
-                # no subfields and no splitting
-                outputRow = v
-                outputRow.update({config["recordIDColumnName"]: identifierPrefix + recordID})
-                files[columnName].writerow(outputRow)
-
-        #if isinstance(valueList, list):
-        #  pass
-        #elif isinstance(valueList, dict):
-        #  # complex 1:n relationship: one row per value, but subfields require multiple columns
-        #  # this data comes from valueType JSON
-        #  valueList.update({config["recordIDColumnName"]: recordID})
-        #  files[columnName].writerow(valueList)
-          
+              # no subfields and no splitting
+              timed(plan.stageTimer, 'csvWriting', writeRow, (recordID,) + value)
 
+  # the identifier of the written record, e.g. for the RecordManifest
+  return recordID
 
 
 # -----------------------------------------------------------------------------
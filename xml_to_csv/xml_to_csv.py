@@ -6,6 +6,11 @@ import lxml.etree as ET
 import os
 import sys
 import json
+import time
+import glob
+import shutil
+import tempfile
+import multiprocessing
 import itertools
 import logging
 import hashlib
@@ -15,17 +20,32 @@ import xml_to_csv.csv_logger as csv_logger
 from xml_to_csv.csv_logger import CSVFileHandler
 from contextlib import ExitStack
 from argparse import ArgumentParser
-from tqdm import tqdm
 import xml_to_csv.utils as utils
+import xml_to_csv.position_index as position_index
+import xml_to_csv.checkpoint as checkpoint
+import xml_to_csv.metrics as xml_metrics
+import xml_to_csv.byte_extractor as byte_extractor
+import xml_to_csv.sqlite_output as sqlite_output
+import xml_to_csv.record_manifest as record_manifest
 
 NS_MARCSLIM = 'http://www.loc.gov/MARC21/slim'
 ALL_NS = {'marc': NS_MARCSLIM}
 
+# files with other extensions are skipped, compressed files are decompressed while they are read
+INPUT_FILE_EXTENSIONS = ('.xml', '.xml.gz', '.xml.bz2', '.xml.xz')
+
+# name of the main output file in a shard folder of extractFilesInParallel
+SHARD_OUTPUT_NAME = 'shard'
+
 LOGGER_NAME = "XML_TO_CSV.utils"
 logger = logging.getLogger(LOGGER_NAME)
 
 # -----------------------------------------------------------------------------
-def main(inputFilenames, outputFilename, configFilename, dateConfigFilename, prefix, incrementalProcessing, logLevel='INFO', logFile=None):
+class ExtractionStopped(Exception):
+  """Raised by extractFiles in a file worker when the stopEvent is set, because another file worker failed."""
+
+# -----------------------------------------------------------------------------
+def main(inputFilenames, outputFilename, configFilename, dateConfigFilename, prefix, incrementalProcessing, logLevel='INFO', logFile=None, workers=1, positionIndex=False, indexDir=None, resume=False, profileStats=None, fileWorkers=1, statusFile=None, manifest=None, previousManifest=None, deletedIDs=None):
   """This script reads XML files in and extracts several fields to create CSV files."""
 
 
@@ -42,11 +62,147 @@ def main(inputFilenames, outputFilename, configFilename, dateConfigFilename, pre
   # build a single numeric month lookup data structure
   monthMapping = utils.buildMonthMapping(dateConfig)
 
-  setupLogging(logLevel, logFile)
+  setupLogging(logLevel, logFile, filemode='a' if resume else 'w')
+
+  # invalid on/off settings of the execution section are reported before any output is written
+  try:
+    utils.checkExecutionFlags(config)
+  except ValueError as e:
+    logger.error(str(e))
+    sys.exit(1)
+
+  # directories and glob patterns are replaced by the input files they refer to
+  inputFilenames = expandInputFilenames(inputFilenames)
+
+  startTime = time.perf_counter()
+  if fileWorkers > 1 and len(inputFilenames) > 1 and sqlite_output.isSQLiteFilename(outputFilename):
+    logger.warning(f'Multiple file workers are not supported together with a SQLite output, the files are processed one after the other')
+    fileWorkers = 1
+  if fileWorkers > 1 and len(inputFilenames) > 1 and (manifest or previousManifest):
+    logger.warning(f'Multiple file workers are not supported together with a record manifest, the files are processed one after the other')
+    fileWorkers = 1
+
+  if fileWorkers > 1 and len(inputFilenames) > 1:
+    if resume:
+      logger.error(f'Resuming is not possible together with several file workers')
+      sys.exit(1)
+    if workers > 1:
+      logger.warning(f'Multiple workers per file are not supported together with several file workers, each file is processed by a single process')
+    stageTimer = extractFilesInParallel(inputFilenames, outputFilename, config, dateConfig, monthMapping, prefix, incrementalProcessing, fileWorkers,
+                                        positionIndex=positionIndex, indexDir=indexDir, profile=profileStats is not None, statusFile=statusFile)
+  else:
+    stageTimer = extractFiles(inputFilenames, outputFilename, config, dateConfig, monthMapping, prefix, incrementalProcessing,
+                              workers=workers, positionIndex=positionIndex, indexDir=indexDir, resume=resume, profile=profileStats is not None, statusFile=statusFile,
+                              manifestFilename=manifest, previousManifestFilename=previousManifest, deletedIDsFilename=deletedIDs)
+
+  if stageTimer is not None:
+    with open(profileStats, 'w') as profileFile:
+      json.dump(stageTimer.getReport(config['counters'], time.perf_counter() - startTime), profileFile, indent=2)
+    logger.info(f'stored the time per processing stage in "{profileStats}"')
+
+# -----------------------------------------------------------------------------
+def extractFiles(inputFilenames, outputFilename, config, dateConfig, monthMapping, prefix, incrementalProcessing, workers=1, positionIndex=False, indexDir=None, resume=False, profile=False, progress=True, statusFile=None,
+                 manifestFilename=None, previousManifestFilename=None, deletedIDsFilename=None, stopEvent=None):
+  """Extracts the records of the given input files one after the other into the output files.
+     The counters of the run are stored in config['counters'], the StageTimer is returned if profile is True.
+     The progress is shown if progress is True and written to statusFile if given.
+     With manifestFilename the identifier and the hash of each record are stored in this record manifest.
+     With previousManifestFilename only the records which changed since the run of this manifest are extracted,
+     the identifiers of the records which are not in the input anymore are written to deletedIDsFilename.
+     If the given stopEvent (e.g. a multiprocessing.Event) is set, ExtractionStopped is raised after the current batch.
+  """
 
   outputFolder = os.path.dirname(outputFilename)
+
+  # progress of incremental runs is stored after each batch, such that a run can be resumed
+  checkpointFilename = checkpoint.getCheckpointFilename(outputFilename)
+
+  # with the extension of a compression (e.g. my-data.csv.gz) the main and the 1:n output files are compressed
+  # compressed files cannot be truncated to the last stored batch, hence there are no checkpoints
+  compression = utils.getCompressionExtension(outputFilename)
+
+  # with the extension of a SQLite database (e.g. my-data.sqlite) the main and the 1:n outputs are tables in this database
+  useSQLite = sqlite_output.isSQLiteFilename(outputFilename)
+
+  resumeState = None
+  if resume:
+    if not incrementalProcessing:
+      logger.error(f'Resuming is only possible together with incremental processing')
+      sys.exit(1)
+    if compression:
+      logger.error(f'Resuming is not possible with compressed output files')
+      sys.exit(1)
+    if useSQLite:
+      logger.error(f'Resuming is not possible with a SQLite output')
+      sys.exit(1)
+    try:
+      resumeState = checkpoint.loadCheckpoint(checkpointFilename, inputFilenames)
+      checkpoint.truncateOutputs(resumeState)
+    except (OSError, ValueError) as e:
+      logger.error(f'Cannot resume: {e}')
+      sys.exit(1)
+    logger.info(f'resuming after batch {resumeState["lastBatch"]} (input file {resumeState["fileIndex"] + 1}, byte offset {resumeState["byteOffset"]})')
+
+  # the byte extractor reads the records without lxml, which only works for simple MARC configs
+  # (checked before any output is written)
+  useByteExtractor = False
+  try:
+    extractionEngine = byte_extractor.getExtractionEngine(config)
+  except ValueError as e:
+    logger.error(str(e))
+    sys.exit(1)
+  if extractionEngine == 'bytes':
+    if not incrementalProcessing:
+      logger.warning(f'The byte extractor is only supported together with incremental processing, records are parsed with lxml')
+    else:
+      try:
+        reasons = byte_extractor.getUnsupportedReasons(config, utils.ExecutionPlan(config))
+      except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+      if reasons:
+        logger.error(f'The byte extractor cannot be used with this config: {"; ".join(reasons)}')
+        sys.exit(1)
+      useByteExtractor = True
+
+  # records which did not change since a previous run are not extracted again (delta processing)
+  manifest = None
+  if manifestFilename or previousManifestFilename:
+    if not incrementalProcessing:
+      logger.error(f'A record manifest is only possible together with incremental processing')
+      sys.exit(1)
+    if resume:
+      logger.error(f'Resuming is not possible together with a record manifest')
+      sys.exit(1)
+    try:
+      manifest = record_manifest.RecordManifest(record_manifest.getConfigHash(config, dateConfig), previousManifestFilename)
+    except (OSError, ValueError) as e:
+      logger.error(f'Cannot read the manifest of the previous run: {e}')
+      sys.exit(1)
+    if previousManifestFilename and deletedIDsFilename is None:
+      deletedIDsFilename = record_manifest.getDeletedIDsFilename(outputFilename)
+
+  # records which certainly do not pass the recordFilter are counted as filtered before they are parsed
+  usePreFilter = False
+  if byte_extractor.isPreFilterEnabled(config):
+    if not incrementalProcessing:
+      logger.warning(f'The byte pre-filter is only supported together with incremental processing, all records are parsed')
+    else:
+      reasons = byte_extractor.getPreFilterUnsupportedReasons(config)
+      if reasons:
+        logger.warning(f'The byte pre-filter cannot be used with this config, all records are parsed: {"; ".join(reasons)}')
+      else:
+        usePreFilter = True
+
+  # resumed runs continue the existing output files
+  outputMode = 'a' if resume else 'w'
   
-  with open(outputFilename, 'w') as outFile:
+  if useSQLite:
+    output = sqlite_output.SQLiteOutput(outputFilename, config['recordIDColumnName'])
+  else:
+    output = utils.openOutputFile(outputFilename, outputMode, bufferSize=utils.getOutputBufferSize(config))
+
+  with output as outFile:
 
 
     # Create a dictionary with file pointers
@@ -54,31 +210,15 @@ def main(inputFilenames, outputFilename, configFilename, dateConfigFilename, pre
     # This is necessary, because the selected columns and thus possible output file pointers are variable
     # In the code we cannot determine upfront how many "with" statements we would need
     with ExitStack() as stack:
-      files = utils.create1NOutputWriters(config, outputFolder, prefix)
-
-      # define columns for the output based on config
-      outputFields = [config["recordIDColumnName"]]
-      for f in config["dataFields"]:
-        if "keepOriginal" in f and f["keepOriginal"] == "true":
-          columnNameOriginal = utils.getOriginalColumnName(f)
-          outputFields.append(columnNameOriginal)
-        outputFields.append(f["columnName"])
-
-      outputWriter = csv.DictWriter(outFile, fieldnames=outputFields, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-      
-      # write the CSV header for the output file
-      outputWriter.writeheader()
-
-      # write the CSV header for the per-column output files (1:n relationships)
-      if prefix != "":
-        for filename, fileHandle  in files.items():
-          fileHandle.writeheader()
-
-      pbar = tqdm(position=0)
-
-
-      # update progress bar every x records
-      updateFrequency=5000
+      if useSQLite:
+        outputFiles = {}
+        files = outFile.create1NOutputWriters(config, prefix)
+      else:
+        outputFiles = {outputFilename: outFile}
+        files = utils.create1NOutputWriters(config, outputFolder, prefix, fileHandles=outputFiles, mode=outputMode, compression=compression)
+      for filename, fileHandle in outputFiles.items():
+        if fileHandle is not outFile:
+          stack.enter_context(fileHandle)
 
       config['counters'] = {
         'batchCounter': 0,
@@ -87,6 +227,78 @@ def main(inputFilenames, outputFilename, configFilename, dateConfigFilename, pre
         'filteredRecordCounter': 0,
         'filteredRecordExceptionCounter': 0
       }
+      if useByteExtractor:
+        # records which are parsed with lxml, because they are not handled by the byte extractor
+        config['counters']['byteExtractorFallbackCounter'] = 0
+      if usePreFilter:
+        # filtered records which were not parsed, they are also part of filteredRecordCounter
+        config['counters']['preFilteredRecordCounter'] = 0
+      if manifest is not None:
+        # records which are not extracted, because they did not change since the previous run
+        config['counters']['unchangedRecordCounter'] = 0
+      if resumeState is not None:
+        config['counters'].update(resumeState['counters'])
+
+      # compile the expressions of the config, the date rules and the field descriptors once instead of for every record
+      # (created after the counters, because the date cache reports its hits and misses there)
+      try:
+        plan = utils.ExtractionPlan(config, dateConfig, monthMapping)
+      except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+      logger.info(f'compiled {plan.numberExpressions} XPath expressions ({plan.numberIndexedExpressions} answered from the MARC field index) and {len(plan.dateRuleEngine.rules)} date rules in {plan.compilationTime:.4f} seconds')
+
+      # the time of the processing stages is only measured on request, because measuring also takes time
+      stageTimer = utils.StageTimer() if profile else None
+      plan.stageTimer = stageTimer
+
+      # the columns of the output are defined by the config
+      # rows are buffered as tuples and written together, see flushOutputWriters
+      if useSQLite:
+        outputWriter = outFile.getWriter(sqlite_output.getMainTableName(outputFilename), plan.mainOutputFields)
+      else:
+        outputWriter = utils.BatchedCSVWriter(outFile, plan.mainOutputFields, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+
+      # with a pipeline queue depth a reader thread reads ahead and a writer thread writes the rows
+      pipelineQueueDepth = utils.getPipelineQueueDepth(config)
+      writerThread = None
+      if pipelineQueueDepth > 0:
+        # entered after the 1:n output files, such that all rows are written before the files are closed
+        writerThread = stack.enter_context(utils.OutputWriterThread(pipelineQueueDepth))
+        for writer in [outputWriter, *files.values()]:
+          writer.writerThread = writerThread
+
+      def flushOutputWriters():
+        utils.timed(stageTimer, 'csvWriting', outputWriter.flush)
+        for writer in files.values():
+          utils.timed(stageTimer, 'csvWriting', writer.flush)
+        if writerThread is not None:
+          utils.timed(stageTimer, 'csvWriting', writerThread.join)
+        if useSQLite:
+          # the rows of a batch are inserted in one transaction
+          utils.timed(stageTimer, 'csvWriting', outFile.commit)
+      
+      if not resume:
+        # write the CSV header for the output file
+        outputWriter.writeheader()
+
+        # write the CSV header for the per-column output files (1:n relationships)
+        if prefix != "":
+          for filename, fileHandle  in files.items():
+            fileHandle.writeheader()
+
+      # the progress is reported at most once per metricsInterval seconds, relative to the size of the input files
+      fileSizes = [os.path.getsize(f) if f.endswith(INPUT_FILE_EXTENSIONS) and os.path.isfile(f) else 0 for f in inputFilenames]
+      metrics = xml_metrics.MetricsReporter(config, fileSizes, interval=xml_metrics.getMetricsInterval(config), statusFilename=statusFile, progress=progress)
+
+      # check every x records if the metrics should be reported
+      updateFrequency=100
+
+      # file workers stop when another file worker failed
+      def checkStopped():
+        if stopEvent is not None and stopEvent.is_set():
+          raise ExtractionStopped('stopped because the extraction of another input file failed')
+
   
       # used for namespace-agnostic extraction of XML-parsed records
       recordTag = getRecordTagName(config)
@@ -100,49 +312,279 @@ def main(inputFilenames, outputFilename, configFilename, dateConfigFilename, pre
         chunkSize = int(config["execution"]["byteChunkSize"]) if "execution" in config and "byteChunkSize" in config["execution"] else 1024*1024
         batchSize = int(config["execution"]["recordBatchSize"]) if "execution" in config and "recordBatchSize" in config["execution"] else 40000
 
+        # reads the records of the batches without building lxml trees, if configured
+        byteExtractor = byte_extractor.ByteRecordExtractor(recordTag) if useByteExtractor else None
+        preFilter = byte_extractor.BytePreFilter(recordTag, config['recordFilter']) if usePreFilter else None
 
+        # batches are self-contained byte ranges, hence they can be extracted by several processes
+        if workers > 1:
+          workerPool = stack.enter_context(utils.BatchWorkerPool(workers, config, dateConfig, monthMapping, prefix, recordTag, profile=stageTimer is not None, byteExtractor=byteExtractor, preFilter=preFilter))
 
-      for inputFilename in inputFilenames:
-        if inputFilename.endswith('.xml'):
-          config['counters']['fileCounter'] += 1
+        # the manifest is only stored at the end of a run, hence a run with manifest cannot be resumed
+        checkpointer = checkpoint.Checkpoint(checkpointFilename, inputFilenames, outputFiles) if not compression and not useSQLite and manifest is None else None
+      elif workers > 1:
+        logger.warning(f'Multiple workers are only supported together with incremental processing, processing with a single process')
+
+
+      for fileIndex, inputFilename in enumerate(inputFilenames):
+        if inputFilename.endswith(INPUT_FILE_EXTENSIONS):
+
+          startPosition = 0
+          if resumeState is not None:
+            if fileIndex < resumeState['fileIndex']:
+              # this file was already processed completely before
+              continue
+            elif fileIndex == resumeState['fileIndex']:
+              startPosition = resumeState['byteOffset']
+
+          # a partially processed file is already counted
+          if startPosition == 0:
+            config['counters']['fileCounter'] += 1
+          metrics.startFile(fileIndex, position=startPosition)
 
           if incrementalProcessing:
             logger.info(f'incremental processing ...')
 
+            # write the buffered rows and store the progress after each batch
+            def onBatchEnd(batchEnd):
+              checkStopped()
+              metrics.setFilePosition(batchEnd)
+              flushOutputWriters()
+              if checkpointer is not None:
+                checkpointer.save(config, fileIndex, batchEnd)
+
             # use record tag string, because for finding the positions there is no explicit namespace
             # later for record parsing we should use the namespace-agnostic name
-            positions = utils.find_record_positions(inputFilename, recordTagString, chunkSize=chunkSize)
-
-            # The first 6 arguments are related to the fast_iter function
-            # everything afterwards will directly be given to processRecord
-            utils.fast_iter_batch(inputFilename, positions, utils.processRecord, recordTag, pbar, config, dateConfig, monthMapping, updateFrequency, batchSize, outputWriter, files, prefix)
+            # positions are found lazily, such that scanning the file and processing batches overlap
+            compressedInput = None
+            if utils.isCompressedFile(inputFilename):
+              # compressed files cannot be memory-mapped: they are decompressed once, the scanner finds the positions
+              # in the decompressed data and the batches are taken from it while it is still in memory
+              if positionIndex or indexDir:
+                logger.info(f'no position index is used for the compressed input file "{inputFilename}"')
+              compressedInput = utils.DecompressedInputFile(inputFilename, startPosition=startPosition)
+              metrics.startFile(fileIndex, positionFunction=xml_metrics.getFilePositionFunction(compressedInput.file))
+              positions = utils.iter_stream_record_positions(compressedInput, recordTagString, chunkSize=chunkSize, startPosition=startPosition)
+            elif positionIndex or indexDir:
+              # positions of previous runs are reused if the input file did not change
+              positions = position_index.iter_indexed_record_positions(inputFilename, recordTagString, chunkSize=chunkSize, indexDir=indexDir, startPosition=startPosition)
+            else:
+              positions = utils.iter_record_positions(inputFilename, recordTagString, chunkSize=chunkSize, startPosition=startPosition)
+
+            if workers > 1:
+              utils.fast_iter_batch_parallel(inputFilename, positions, workerPool, metrics, config, batchSize, outputWriter, files, prefix, onBatchEnd=onBatchEnd, stageTimer=stageTimer, inputFile=compressedInput, manifest=manifest)
+            else:
+              # The first 6 arguments are related to the fast_iter function
+              # everything afterwards will directly be given to processRecord
+              utils.fast_iter_batch(inputFilename, positions, utils.processRecord, recordTag, metrics, config, dateConfig, monthMapping, updateFrequency, batchSize, outputWriter, files, prefix, plan=plan, onBatchEnd=onBatchEnd, stageTimer=stageTimer, inputFile=compressedInput, prefetch=pipelineQueueDepth, byteExtractor=byteExtractor, preFilter=preFilter, manifest=manifest)
+
+            if compressedInput is not None:
+              compressedInput.close()
+
+            # the next run can continue with the next input file
+            flushOutputWriters()
+            if checkpointer is not None:
+              checkpointer.save(config, fileIndex + 1, 0)
 
           else:
             logger.info(f'regular iterative processing ...')
 
-            context = ET.iterparse(inputFilename, tag=recordTag)
+            # compressed files are decompressed while they are parsed
+            inputFile = utils.openInputFile(inputFilename)
+            metrics.startFile(fileIndex, positionFunction=xml_metrics.getFilePositionFunction(inputFile))
+            reader = utils.PrefetchingReader(inputFile, pipelineQueueDepth) if pipelineQueueDepth > 0 else inputFile
+            context = ET.iterparse(reader, tag=recordTag)
+            if stageTimer is not None:
+              stageTimer.bytesRead += os.path.getsize(inputFilename)
             utils.fast_iter(
               context, # the XML context
               utils.processRecord, # the function that is called for every found recordTag
-              pbar, # the progress bar that should be updated
+              metrics, # reports the progress
               config, # configuration object with counters and other data
               dateConfig, # configuration object for date parsing
               monthMapping, # lookup of calendar months
               updateFrequency, # after how many records the progress bar should be updated
               outputWriter, # paramter for processRecord: CSV writer for main output file
               files, # parameter for processRecord: dictionary of CSV writers for each column 1:n relationships
-              prefix # parameter for processRecord: prefix for output files
+              prefix, # parameter for processRecord: prefix for output files
+              plan=plan, # parameter for processRecord: compiled expressions of the config
+              stageTimer=stageTimer, # measures the time of the processing stages if given
+              onUpdate=checkStopped # called every updateFrequency records
             )
+            reader.close()
+            inputFile.close()
 
+          # the input file is processed completely
+          metrics.startFile(fileIndex + 1)
+
+      flushOutputWriters()
+
+      if manifest is not None:
+        if manifestFilename:
+          manifest.write(manifestFilename)
+          logger.info(f'stored {len(manifest.entries)} records in the manifest "{manifestFilename}"')
+        if previousManifestFilename:
+          deletedIDs = manifest.getDeletedIDs()
+          config['counters']['deletedRecordCounter'] = len(deletedIDs)
+          record_manifest.writeDeletedIDs(deletedIDsFilename, config['recordIDColumnName'], deletedIDs)
+          logger.info(f'stored the identifiers of {len(deletedIDs)} deleted records in "{deletedIDsFilename}"')
+      metrics.finish()
+
+      # everything is processed, nothing to resume anymore
+      if incrementalProcessing and checkpointer is not None:
+        checkpointer.remove()
+
+  return stageTimer
+
+# -----------------------------------------------------------------------------
+# State of a file worker process, set once by _initFileWorker
+_fileWorkerState = {}
+
+# -----------------------------------------------------------------------------
+def _initFileWorker(config, dateConfig, monthMapping, prefix, incrementalProcessing, positionIndex, indexDir, profile, logLevel, logQueue, stopEvent):
+  """Initializes a worker process of extractFilesInParallel."""
+  utils.initWorkerLogging(logLevel, logQueue)
+  _fileWorkerState.update({
+    'stopEvent': stopEvent,
+    'config': config,
+    'dateConfig': dateConfig,
+    'monthMapping': monthMapping,
+    'prefix': prefix,
+    'incrementalProcessing': incrementalProcessing,
+    'positionIndex': positionIndex,
+    'indexDir': indexDir,
+    'profile': profile
+  })
+
+# -----------------------------------------------------------------------------
+def _extractFileShard(task):
+  """Extracts a single input file into the output files of a shard folder in a worker process.
+     Returns the index of the input file, the counters and the measured stage times (None without profiling).
+     If the extraction fails, a RuntimeError is raised which the pool hands to the parent process.
+  """
+  fileIndex, inputFilename, shardFolder = task
+  state = _fileWorkerState
+  config = state['config']
+
+  if state['stopEvent'].is_set():
+    raise RuntimeError(f'The extraction of the input file "{inputFilename}" was not started, because the extraction of another input file failed')
+
+  try:
+    stageTimer = extractFiles([inputFilename], os.path.join(shardFolder, SHARD_OUTPUT_NAME), config, state['dateConfig'], state['monthMapping'],
+                              getShardPrefix(state['prefix']), state['incrementalProcessing'], positionIndex=state['positionIndex'], indexDir=state['indexDir'],
+                              profile=state['profile'], progress=False, stopEvent=state['stopEvent'])
+  except SystemExit as e:
+    # extractFiles logs the error and calls sys.exit, a SystemExit would end the worker process without a result for this task
+    raise RuntimeError(f'The extraction of the input file "{inputFilename}" failed with exit status {e.code}') from None
+  except Exception as e:
+    raise RuntimeError(f'The extraction of the input file "{inputFilename}" failed: {e}') from None
+
+  return (fileIndex, dict(config['counters']), stageTimer.getState() if stageTimer is not None else None)
+
+# -----------------------------------------------------------------------------
+def getShardPrefix(prefix):
+  """Returns the prefix of the 1:n output files of a shard, without prefix there are no 1:n output files."""
+  return SHARD_OUTPUT_NAME if prefix != "" else ""
+
+# -----------------------------------------------------------------------------
+def extractFilesInParallel(inputFilenames, outputFilename, config, dateConfig, monthMapping, prefix, incrementalProcessing, fileWorkers, positionIndex=False, indexDir=None, profile=False, statusFile=None):
+  """Extracts the given input files with a pool of processes, largest files first.
+     Each file is extracted into the output files of its own shard folder,
+     afterwards the shards are concatenated in the order of the input files with a single header.
+     The shards are not compressed, a compressed output (e.g. my-data.csv.gz) is compressed while concatenating.
+     The summed counters are stored in config['counters'], the merged StageTimer is returned if profile is True.
+     The progress is reported whenever a file is completed and written to statusFile if given.
+  """
+  outputFolder = os.path.dirname(outputFilename)
+  shardRoot = tempfile.mkdtemp(prefix='.xml-to-csv-shards-', dir=outputFolder if outputFolder else '.')
+
+  shardFolders = [os.path.join(shardRoot, str(fileIndex)) for fileIndex in range(len(inputFilenames))]
+  for shardFolder in shardFolders:
+    os.mkdir(shardFolder)
+
+  # the largest files are started first, such that no large file is processed alone at the end
+  tasks = [(fileIndex, inputFilename, shardFolders[fileIndex]) for fileIndex, inputFilename in enumerate(inputFilenames)]
+  tasks.sort(key=lambda task: os.path.getsize(task[1]) if os.path.isfile(task[1]) else 0, reverse=True)
+
+  config['counters'] = {}
+  stageTimer = utils.StageTimer() if profile else None
+  fileSizes = [os.path.getsize(f) if os.path.isfile(f) else 0 for f in inputFilenames]
+  metrics = xml_metrics.MetricsReporter(config, fileSizes, interval=xml_metrics.getMetricsInterval(config), statusFilename=statusFile)
+
+  # set when the extraction of a file failed, such that the other file workers stop
+  stopEvent = multiprocessing.Event()
+
+  try:
+    with utils.WorkerLogForwarder() as logForwarder:
+      pool = multiprocessing.Pool(fileWorkers, initializer=_initFileWorker, initargs=(config, dateConfig, monthMapping, prefix, incrementalProcessing, positionIndex, indexDir, profile, logForwarder.logLevel, logForwarder.logQueue, stopEvent))
+      failed = False
+      try:
+        for fileIndex, fileCounters, stageTimes in pool.imap_unordered(_extractFileShard, tasks):
+          for counterName, value in fileCounters.items():
+            config['counters'][counterName] = config['counters'].get(counterName, 0) + value
+          if stageTimer is not None:
+            stageTimer.merge(stageTimes)
+          metrics.completedBytes += fileSizes[fileIndex]
+          metrics.update()
+      except RuntimeError as e:
+        logger.error(str(e))
+        failed = True
+        stopEvent.set()
+      except BaseException:
+        pool.terminate()
+        raise
+
+      # after a failure the other file workers stop after their current batch instead of being terminated,
+      # because a worker which is killed while it sends its result or a log record blocks the pool or the log forwarder forever
+      pool.close()
+      pool.join()
+
+    if failed:
+      # the shard folder is removed below
+      sys.exit(1)
+    metrics.finish()
+
+    logger.info(f'concatenating the output of {len(inputFilenames)} input files')
+    utils.concatenateCSVFiles([os.path.join(shardFolder, SHARD_OUTPUT_NAME) for shardFolder in shardFolders], outputFilename)
+    shardPrefix = getShardPrefix(prefix)
+    compression = utils.getCompressionExtension(outputFilename)
+    for field in config['dataFields']:
+      columnName = field['columnName']
+      utils.concatenateCSVFiles([os.path.join(shardFolder, f'{shardPrefix}-{columnName}.csv') for shardFolder in shardFolders],
+                                os.path.join(outputFolder, f'{prefix}-{columnName}.csv{compression}'))
+  finally:
+    shutil.rmtree(shardRoot, ignore_errors=True)
+
+  return stageTimer
+
+# -----------------------------------------------------------------------------
+def expandInputFilenames(inputFiles):
+  """Returns the input filenames, directories are replaced by the input files they contain and glob patterns by the matching files.
+
+  >>> expandInputFilenames(['test/resources'])
+  ['test/resources/10-records-with-subfields.xml', 'test/resources/10-records-with-unrelated-records.xml', 'test/resources/10-records.xml', 'test/resources/marc-records.xml']
+  >>> expandInputFilenames(['test/resources/10-records.x?l', 'other.xml'])
+  ['test/resources/10-records.xml', 'other.xml']
+  """
+  inputFilenames = []
+  for inputFile in inputFiles:
+    if os.path.isdir(inputFile):
+      inputFilenames.extend(sorted(os.path.join(inputFile, f) for f in os.listdir(inputFile) if f.endswith(INPUT_FILE_EXTENSIONS)))
+    elif not os.path.exists(inputFile) and any(c in inputFile for c in '*?['):
+      inputFilenames.extend(sorted(glob.glob(inputFile)))
+    else:
+      inputFilenames.append(inputFile)
+  return inputFilenames
 
 # -----------------------------------------------------------------------------
-def setupLogging(logLevel, logFile):
+def setupLogging(logLevel, logFile, filemode='w'):
 
   logFormat = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
   if logFile:
     logger = logging.getLogger(LOGGER_NAME)
     # Debug: Print current handlers
-    csvHandler = CSVFileHandler(logFile, logLevel=logLevel, delimiter=',', filemode='w')
+    # when appending to the log of a resumed run, the header is already there
+    csvHandler = CSVFileHandler(logFile, logLevel=logLevel, delimiter=',', filemode=filemode, writeHeader=(filemode == 'w'))
     logger.addHandler(csvHandler)
   else:
     logging.basicConfig(level=logLevel, format=logFormat)
@@ -166,12 +608,22 @@ def getRecordTagName(config):
 def parseArguments():
 
   parser = ArgumentParser(description='This script reads an XML file in MARC slim format and extracts several fields to create a CSV file.')
-  parser.add_argument('inputFiles', nargs='+', help='The input files containing XML records')
+  parser.add_argument('inputFiles', nargs='+', help='The input files containing XML records (also compressed as .xml.gz, .xml.bz2 or .xml.xz), directories or glob patterns')
   parser.add_argument('-c', '--config-file', action='store', required=True, help='The config file with XPath expressions to extract')
   parser.add_argument('-d', '--date-config-file', action='store', required=True, help='The config file for date parsing')
   parser.add_argument('-p', '--prefix', action='store', required=False, default='', help='If given, one file per column with this prefix will be generated to resolve 1:n relationships')
-  parser.add_argument('-o', '--output-file', action='store', required=True, help='The output CSV file containing extracted fields based on the provided config')
+  parser.add_argument('-o', '--output-file', action='store', required=True, help='The output CSV file containing extracted fields based on the provided config, with the extension .csv.gz, .csv.bz2 or .csv.xz all output files are compressed, with the extension .sqlite, .sqlite3 or .db all outputs are tables of a SQLite database')
   parser.add_argument('-i', '--incremental', action='store_true', help='Optional flag to indicate if the input files should be read incremental (identifying records with string-parsing in chunks and parsing XML records in batch)')
+  parser.add_argument('-w', '--workers', action='store', type=int, default=1, help='The number of processes used to extract batches in parallel (only together with --incremental), default is 1')
+  parser.add_argument('-W', '--file-workers', action='store', type=int, default=1, help='The number of processes used to extract several input files in parallel, the output is the same as with a single process, default is 1')
+  parser.add_argument('--status-file', action='store', help='Optional file to which the progress (records/s, MB/s, ETA, counters) is written periodically as JSON, or in the Prometheus text format if it ends with .prom')
+  parser.add_argument('--position-index', action='store_true', help='Optional flag to store the record positions found with --incremental in an index file next to the input file and to reuse them in later runs')
+  parser.add_argument('--index-dir', action='store', help='Optional directory in which the record position indexes are stored instead of next to the input files (implies --position-index)')
+  parser.add_argument('--resume', action='store_true', help='Optional flag to resume an interrupted --incremental run after the last batch stored in the checkpoint file next to the output file')
+  parser.add_argument('--manifest', action='store', help='Optional file in which the identifier and a hash of the bytes of each record are stored (only together with --incremental), to be used as --previous-manifest of a later run')
+  parser.add_argument('--previous-manifest', action='store', help='Optional manifest of a previous run: only new and changed records are extracted and the identifiers of the records which are not in the input anymore are written to the file of --deleted-ids')
+  parser.add_argument('--deleted-ids', action='store', help='The CSV file for the identifiers of the deleted records found with --previous-manifest, default is the name of the output file with the suffix -deleted.csv')
+  parser.add_argument('--profile-stats', action='store', help='Optional JSON file in which the time per processing stage, the number of batches, the bytes read and the counters of the run are stored')
   parser.add_argument('-l', '--log-file', action='store', help='The optional name of the logfile')
   parser.add_argument('-L', '--log-level', action='store', default='INFO', help='The log level, default is INFO')
   args = parser.parse_args()
@@ -181,4 +633,4 @@ def parseArguments():
 
 if __name__ == '__main__':
   args = parseArguments()
-  main(args.inputFiles, args.output_file, args.config_file, args.date_config_file, args.prefix, args.incremental, logLevel=args.log_level, logFile=args.log_file)
+  main(args.inputFiles, args.output_file, args.config_file, args.date_config_file, args.prefix, args.incremental, logLevel=args.log_level, logFile=args.log_file, workers=args.workers, positionIndex=args.position_index, indexDir=args.index_dir, resume=args.resume, profileStats=args.profile_stats, fileWorkers=args.file_workers, statusFile=args.status_file, manifest=args.manifest, previousManifest=args.previous_manifest, deletedIDs=args.deleted_ids)